@@ -2,24 +2,59 @@
 import streamlit as st
 import sys
 from pathlib import Path
-from docx import Document
-from io import BytesIO
 
 # Add parent directory to path for imports
 sys.path.insert(0, str(Path(__file__).parent.parent))
 
-from utils.pdf_utils import extract_text_from_pdf, get_pdf_info
-from utils.ai_utils import LMStudioClient
+from utils.pdf_utils import load_pdf_document
+from utils.docx_utils import read_docx
+from utils.ui_utils import extract_text_with_progress, show_normalization_report, StreamingRenderer
+from utils.ai_utils import get_lm_client, create_contract_prompt, create_contract_comparison_prompt
+from utils.retrieval_utils import BM25Index, EXCERPT_LABEL, MIN_RETRIEVAL_TOKENS, analysis_query, format_passages
+from utils.chunked_analysis import estimate_tokens
+from utils.similarity_utils import CLAUSE_COMPARISON_NOTE, compare_contracts, clause_comparison_to_text
 
 
-def extract_text_from_docx(docx_file):
-    """Extract text from a DOCX file."""
-    try:
-        doc = Document(BytesIO(docx_file.read()))
-        text = "\n".join([paragraph.text for paragraph in doc.paragraphs])
-        return text
-    except Exception as e:
-        raise Exception(f"Error extracting text from DOCX: {str(e)}")
+def set_contract_text(text):
+    """Store the contract text, dropping the passage index built for the previous one."""
+    if text != st.session_state.contract_text:
+        st.session_state.contract_text = text
+        st.session_state.contract_index = None
+
+
+def get_contract_index():
+    """Get the BM25 passage index of the contract text, building it once per document."""
+    if st.session_state.get("contract_index") is None:
+        st.session_state.contract_index = BM25Index.from_text(st.session_state.contract_text)
+    return st.session_state.contract_index
+
+
+def contract_excerpt(analysis_type, custom_instructions):
+    """
+    Get the contract text to send for an analysis.
+
+    Long contracts are reduced to the passages most relevant to the
+    analysis type unless full-text mode is on.
+
+    Args:
+        analysis_type: Selected analysis type
+        custom_instructions: Custom instructions, used as the query for Custom Analysis
+
+    Returns:
+        tuple: (label, text, note) where note describes the reduction or is None
+    """
+    text = st.session_state.contract_text
+    full_tokens = estimate_tokens(text)
+    if st.session_state.contract_full_text or full_tokens < MIN_RETRIEVAL_TOKENS:
+        return "CONTRACT DOCUMENT", text, None
+
+    index = get_contract_index()
+    passages = index.retrieve(analysis_query(analysis_type, custom_instructions))
+    excerpt = format_passages(passages)
+    note = (f"Sending {len(passages)} of {len(index)} passages "
+            f"(~{estimate_tokens(excerpt):,} of ~{full_tokens:,} tokens). "
+            f"Enable full contract text in Settings to send everything.")
+    return EXCERPT_LABEL, excerpt, note
 
 
 def show():
@@ -42,11 +77,13 @@ def show():
     # Initialize session state
     if 'contract_text' not in st.session_state:
         st.session_state.contract_text = None
+    if 'contract_index' not in st.session_state:
+        st.session_state.contract_index = None
 
     # Settings in expander
     with st.expander("⚙️ Settings", expanded=False):
-        # Initialize LM Studio client
-        lm_client = LMStudioClient()
+        # Get the shared LM Studio client
+        lm_client = get_lm_client()
 
         # Get available models
         models = lm_client.get_available_models()
@@ -72,6 +109,20 @@ def show():
         )
         st.session_state.contract_custom_instructions = custom_instructions
 
+        # Response cache bypass
+        st.session_state.contract_use_response_cache = st.checkbox(
+            "Reuse cached AI responses",
+            value=True,
+            help="Replay the saved result when the same model, prompt and settings were run before. Uncheck to force a fresh run."
+        )
+
+        # Retrieval bypass
+        st.session_state.contract_full_text = st.checkbox(
+            "Send full contract text",
+            value=False,
+            help="Long contracts are reduced to the clauses most relevant to the analysis type, and comparisons to the clauses that differ. Check to always send whole contracts."
+        )
+
     st.markdown("---")
 
     # File upload section
@@ -88,14 +139,13 @@ def show():
             file_type = contract_file.name.split('.')[-1].lower()
 
             if file_type == 'pdf':
-                pdf_info = get_pdf_info(contract_file)
-                st.success(f"✅ {pdf_info['file_name']}")
-                st.caption(f"Pages: {pdf_info['page_count']} | Size: {pdf_info['file_size'] / 1024:.1f} KB")
+                pdf_doc = load_pdf_document(contract_file)
+                st.success(f"✅ {pdf_doc.file_name}")
+                st.caption(f"Pages: {pdf_doc.page_count} | Size: {pdf_doc.file_size / 1024:.1f} KB")
 
                 if st.session_state.contract_text is None or st.button("Re-extract Text"):
-                    with st.spinner("Extracting text from PDF..."):
-                        st.session_state.contract_text = extract_text_from_pdf(contract_file)
-                        st.success(f"Extracted {len(st.session_state.contract_text)} characters")
+                    set_contract_text(extract_text_with_progress(pdf_doc, "Extracting text from PDF...", max_chars=None))
+                    st.success(f"Extracted {len(st.session_state.contract_text)} characters")
 
             elif file_type == 'docx':
                 st.success(f"✅ {contract_file.name}")
@@ -104,13 +154,15 @@ def show():
 
                 if st.session_state.contract_text is None or st.button("Re-extract Text"):
                     with st.spinner("Extracting text from DOCX..."):
-                        st.session_state.contract_text = extract_text_from_docx(contract_file)
+                        text, report = read_docx(contract_file)
+                        set_contract_text(text)
                         st.success(f"Extracted {len(st.session_state.contract_text)} characters")
+                    show_normalization_report(report)
 
             elif file_type == 'txt':
                 st.success(f"✅ {contract_file.name}")
                 text_content = contract_file.read().decode('utf-8', errors='ignore')
-                st.session_state.contract_text = text_content
+                set_contract_text(text_content)
                 st.caption(f"Size: {len(text_content)} characters")
 
             # Show preview
@@ -163,71 +215,32 @@ def show():
         st.warning(f"⚠️ Please upload {', '.join(missing_items)} to run analysis")
 
     if st.button("🚀 Run Contract Analysis", disabled=not can_analyze, use_container_width=True):
-        # Create the prompt based on analysis type
-        analysis_prompts = {
-            "Contract Summary": """Provide a comprehensive summary of this contract, including:
-- Main parties involved
-- Purpose and scope of the contract
-- Key terms and conditions
-- Duration and termination clauses
-- Important dates and milestones""",
-
-            "Key Clauses Extraction": """Extract and summarize the key clauses from this contract, including:
-- Payment terms
-- Delivery/Performance obligations
-- Warranties and guarantees
-- Liability and indemnification
-- Termination conditions
-- Dispute resolution""",
-
-            "Obligations & Responsibilities": """Analyze and list the obligations and responsibilities for each party:
-- Party A obligations
-- Party B obligations
-- Mutual obligations
-- Deadlines and milestones
-- Performance standards""",
-
-            "Risk Assessment": """Assess potential risks in this contract:
-- Legal risks
-- Financial risks
-- Operational risks
-- Compliance risks
-- Recommendations for risk mitigation""",
-
-            "Compliance Review": """Review the contract for compliance with standard practices:
-- Missing or unclear terms
-- Unusual or potentially problematic clauses
-- Recommendations for improvement
-- Areas needing legal review""",
-
-            "Custom Analysis": st.session_state.contract_custom_instructions or "Analyze this contract and provide insights."
-        }
-
-        prompt = f"""{analysis_prompts[analysis_type]}
-
-CONTRACT DOCUMENT:
-{st.session_state.contract_text}
-
-Please provide a detailed, structured analysis."""
+        contract_label, contract_content, excerpt_note = contract_excerpt(
+            analysis_type, st.session_state.contract_custom_instructions)
+        prompt = create_contract_prompt(analysis_type, contract_label, contract_content,
+                                        st.session_state.contract_custom_instructions)
 
         # Run analysis
         st.markdown("### Contract Analysis Results")
         st.info("🤖 AI analysis in progress...")
+        if excerpt_note:
+            st.caption(excerpt_note)
 
         # Create placeholder for streaming results
         result_placeholder = st.empty()
-        full_response = ""
 
         try:
-            lm_client = LMStudioClient()
+            lm_client = get_lm_client()
 
             with st.spinner("Analyzing contract..."):
-                for chunk in lm_client.analyze_documents(prompt, st.session_state.contract_selected_model, stream=True):
-                    full_response += chunk
-                    result_placeholder.markdown(full_response)
+                response_stream = lm_client.analyze_documents(prompt, st.session_state.contract_selected_model, stream=True,
+                                                              use_cache=st.session_state.contract_use_response_cache)
+                renderer = StreamingRenderer(result_placeholder)
+                full_response = renderer.render(response_stream)
 
             # Display final result
             st.success("✅ Contract analysis complete!")
+            st.caption(renderer.summary())
 
             # Download button
             st.download_button(
@@ -260,45 +273,58 @@ Please provide a detailed, structured analysis."""
                 # Extract text from second contract
                 file_type_2 = contract_file_2.name.split('.')[-1].lower()
 
+                report_2 = None
                 if file_type_2 == 'pdf':
-                    contract_text_2 = extract_text_from_pdf(contract_file_2)
+                    pdf_doc_2 = load_pdf_document(contract_file_2)
+                    contract_text_2 = pdf_doc_2.extract_text(parallel=True, max_chars=None)
+                    report_2 = pdf_doc_2.normalization_report()
                 elif file_type_2 == 'docx':
-                    contract_text_2 = extract_text_from_docx(contract_file_2)
+                    contract_text_2, report_2 = read_docx(contract_file_2)
                 else:
                     contract_text_2 = contract_file_2.read().decode('utf-8', errors='ignore')
 
                 st.success(f"✅ Second contract loaded ({len(contract_text_2)} characters)")
+                show_normalization_report(report_2, contract_file_2.name)
 
                 if st.button("🚀 Compare Contracts", use_container_width=True):
-                    comparison_prompt = f"""Compare these two contracts and identify:
-1. Key differences in terms and conditions
-2. Differences in obligations and responsibilities
-3. Variations in payment terms
-4. Differences in liability and risk allocation
-5. Recommendations on which terms are more favorable
-
-CONTRACT 1:
+                    if st.session_state.contract_full_text:
+                        contracts_content = f"""CONTRACT 1:
 {st.session_state.contract_text}
 
 CONTRACT 2:
-{contract_text_2}
+{contract_text_2}"""
+                    else:
+                        with st.spinner("Matching clauses..."):
+                            comparison = compare_contracts(st.session_state.contract_text, contract_text_2)
+                        clause_changes = clause_comparison_to_text(comparison)
+                        st.caption(
+                            f"Clause matching: {len(comparison['identical'])} identical clauses skipped, "
+                            f"{len(comparison['changed'])} changed, {len(comparison['removed']) + len(comparison['added'])} "
+                            f"only in one contract (~{estimate_tokens(clause_changes):,} of "
+                            f"~{estimate_tokens(st.session_state.contract_text) + estimate_tokens(contract_text_2):,} tokens sent)"
+                        )
+                        contracts_content = f"""{CLAUSE_COMPARISON_NOTE}
+
+CLAUSE COMPARISON:
+{clause_changes}"""
 
-Provide a detailed comparison in a structured format."""
+                    comparison_prompt = create_contract_comparison_prompt(contracts_content)
 
                     # Run comparison
                     st.markdown("### Contract Comparison Results")
                     result_placeholder = st.empty()
-                    full_response = ""
 
                     try:
-                        lm_client = LMStudioClient()
+                        lm_client = get_lm_client()
 
                         with st.spinner("Comparing contracts..."):
-                            for chunk in lm_client.analyze_documents(comparison_prompt, st.session_state.contract_selected_model, stream=True):
-                                full_response += chunk
-                                result_placeholder.markdown(full_response)
+                            response_stream = lm_client.analyze_documents(comparison_prompt, st.session_state.contract_selected_model, stream=True,
+                                                                          use_cache=st.session_state.contract_use_response_cache)
+                            renderer = StreamingRenderer(result_placeholder)
+                            full_response = renderer.render(response_stream)
 
                         st.success("✅ Comparison complete!")
+                        st.caption(renderer.summary())
 
                         st.download_button(
                             label="📥 Download Comparison Report",
@@ -317,4 +343,5 @@ Provide a detailed comparison in a structured format."""
     # Reset button
     if st.button("🔄 Reset", use_container_width=True):
         st.session_state.contract_text = None
+        st.session_state.contract_index = None
         st.rerun()
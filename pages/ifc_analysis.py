@@ -6,7 +6,44 @@ from pathlib import Path
 # Add parent directory to path for imports
 sys.path.insert(0, str(Path(__file__).parent.parent))
 
-from utils.ai_utils import LMStudioClient
+from utils.ui_utils import StreamingRenderer
+from utils.ai_utils import get_lm_client, create_ifc_prompt, create_ifc_revision_prompt
+from utils.ifc_utils import IFCFile, IFCIndex, is_step_file
+from utils.ifc_takeoff import build_takeoff, analysis_tables, format_units, takeoff_to_text
+from utils.ifc_diff import diff_models, diff_to_text
+
+
+def release_ifc_file():
+    """Drop the index and close (and delete) the session's spooled IFC file."""
+    ifc_handle = st.session_state.get('ifc_file')
+    set_ifc_index(None)
+    st.session_state.ifc_file = None
+    st.session_state.ifc_file_id = None
+    if ifc_handle is not None:
+        ifc_handle.close()
+
+
+def set_ifc_index(ifc_index):
+    """Store a newly indexed model; its takeoff tables are built on first use."""
+    st.session_state.ifc_index = ifc_index
+    st.session_state.ifc_takeoff = None
+
+
+def get_takeoff():
+    """Build (once per model) the reference graph and quantity takeoff tables."""
+    if st.session_state.ifc_takeoff is None:
+        with st.spinner("Building quantity takeoff..."):
+            st.session_state.ifc_takeoff = build_takeoff(st.session_state.ifc_index)
+    return st.session_state.ifc_takeoff
+
+
+def show_index_preview(ifc_index):
+    """Show the schema and most common entity types of an indexed model."""
+    with st.expander("📄 Preview IFC Model"):
+        st.markdown(f"**Schema:** {ifc_index.schema}")
+        st.text("\n".join(
+            f"{entity_type}: {count}" for entity_type, count in ifc_index.type_counts.most_common(25)
+        ))
 
 
 def show():
@@ -25,11 +62,15 @@ def show():
     # Initialize session state
     if 'ifc_text' not in st.session_state:
         st.session_state.ifc_text = None
+    if 'ifc_index' not in st.session_state:
+        st.session_state.ifc_index = None
+    if 'ifc_takeoff' not in st.session_state:
+        st.session_state.ifc_takeoff = None
 
     # Settings in expander
     with st.expander("⚙️ Settings", expanded=False):
-        # Initialize LM Studio client
-        lm_client = LMStudioClient()
+        # Get the shared LM Studio client
+        lm_client = get_lm_client()
 
         # Get available models
         models = lm_client.get_available_models()
@@ -55,11 +96,28 @@ def show():
         )
         st.session_state.ifc_custom_instructions = custom_instructions
 
+        # Response cache bypass
+        st.session_state.ifc_use_response_cache = st.checkbox(
+            "Reuse cached AI responses",
+            value=True,
+            help="Replay the saved result when the same model, prompt and settings were run before. Uncheck to force a fresh run."
+        )
+
     st.markdown("---")
 
     # File upload section
     st.markdown("### Upload IFC Data")
 
+    mode = st.radio(
+        "Mode",
+        ["Single Model", "Compare Revisions"],
+        horizontal=True,
+        help="Compare Revisions diffs two versions of the same model by GlobalId and analyzes only what changed"
+    )
+    if mode == "Compare Revisions":
+        show_revision_comparison()
+        return
+
     # Option to upload file or paste text
     input_method = st.radio(
         "Input Method",
@@ -76,18 +134,33 @@ def show():
 
         if ifc_file:
             try:
-                # Read file content
-                file_content = ifc_file.read().decode('utf-8', errors='ignore')
-                st.session_state.ifc_text = file_content
-
-                st.success(f"✅ {ifc_file.name} loaded")
-                st.caption(f"Size: {len(file_content)} characters")
+                # Spool and index each upload once; the session keeps the handle
+                if st.session_state.get('ifc_file_id') != ifc_file.file_id:
+                    release_ifc_file()
+                    with st.spinner("Indexing IFC model..."):
+                        ifc_handle = IFCFile.spool(ifc_file)
+                        if is_step_file(ifc_handle.head()):
+                            set_ifc_index(IFCIndex.from_buffer(ifc_handle.mapping))
+                            st.session_state.ifc_text = None
+                        else:
+                            set_ifc_index(None)
+                            st.session_state.ifc_text = ifc_handle.read_text()
+                    st.session_state.ifc_file = ifc_handle
+                    st.session_state.ifc_file_id = ifc_file.file_id
+                ifc_handle = st.session_state.ifc_file
+
+                st.success(f"✅ {ifc_handle.name} loaded")
+                if st.session_state.ifc_index is not None:
+                    st.caption(f"Size: {ifc_handle.size / 1024:.1f} KB | {len(st.session_state.ifc_index)} entities")
+                    show_index_preview(st.session_state.ifc_index)
+                else:
+                    st.caption(f"Size: {len(st.session_state.ifc_text)} characters")
 
                 # Show preview
                 with st.expander("📄 Preview IFC Data"):
                     st.text_area(
                         "IFC Content Preview",
-                        value=file_content[:2000] + ("..." if len(file_content) > 2000 else ""),
+                        value=ifc_handle.preview(),
                         height=200,
                         disabled=True
                     )
@@ -102,8 +175,20 @@ def show():
         )
 
         if ifc_text_input:
-            st.session_state.ifc_text = ifc_text_input
-            st.success(f"✅ IFC data loaded ({len(ifc_text_input)} characters)")
+            if st.session_state.get('ifc_file') is not None:
+                release_ifc_file()
+            if is_step_file(ifc_text_input):
+                # Index pasted text again only when it changes
+                if st.session_state.ifc_index is None or st.session_state.get('ifc_pasted_text') != ifc_text_input:
+                    set_ifc_index(IFCIndex.from_text(ifc_text_input))
+                    st.session_state.ifc_pasted_text = ifc_text_input
+                st.session_state.ifc_text = None
+                st.success(f"✅ IFC model loaded ({len(st.session_state.ifc_index)} entities)")
+                show_index_preview(st.session_state.ifc_index)
+            else:
+                st.session_state.ifc_text = ifc_text_input
+                set_ifc_index(None)
+                st.success(f"✅ IFC data loaded ({len(ifc_text_input)} characters)")
 
     st.markdown("---")
 
@@ -123,13 +208,26 @@ def show():
         help="Select the type of analysis to perform"
     )
 
+    # Takeoff tables answering the selected analysis type
+    if st.session_state.ifc_index is not None:
+        try:
+            takeoff = get_takeoff()
+            with st.expander("📊 Quantity Takeoff", expanded=True):
+                st.caption(f"{takeoff['elements']} elements | Units: {format_units(takeoff['units'])}")
+                for title, table in analysis_tables(takeoff["tables"], analysis_type).items():
+                    st.markdown(f"**{title}**")
+                    st.dataframe(table, use_container_width=True, hide_index=True)
+        except Exception as e:
+            st.error(f"Error building takeoff tables: {str(e)}")
+
     # Check if we have the required data
-    can_analyze = (st.session_state.ifc_text is not None and
+    has_data = st.session_state.ifc_text is not None or st.session_state.ifc_index is not None
+    can_analyze = (has_data and
                   st.session_state.ifc_selected_model is not None)
 
     if not can_analyze:
         missing_items = []
-        if st.session_state.ifc_text is None:
+        if not has_data:
             missing_items.append("IFC Data")
         if st.session_state.ifc_selected_model is None:
             missing_items.append("LM Studio connection")
@@ -137,21 +235,12 @@ def show():
         st.warning(f"⚠️ Please provide {', '.join(missing_items)} to run analysis")
 
     if st.button("🚀 Run IFC Analysis", disabled=not can_analyze, use_container_width=True):
-        # Create the prompt based on analysis type
-        analysis_prompts = {
-            "General Overview": "Provide a comprehensive overview of this IFC building model, including key information about the structure, components, and systems.",
-            "Material Analysis": "Analyze the materials specified in this IFC model. List all materials, their properties, and where they are used in the building.",
-            "Structural Components": "Analyze the structural components in this IFC model. Identify beams, columns, walls, floors, and their specifications.",
-            "Building Systems": "Analyze the building systems (HVAC, electrical, plumbing, etc.) defined in this IFC model.",
-            "Custom Analysis": st.session_state.ifc_custom_instructions or "Analyze this IFC model and provide insights."
-        }
-
-        prompt = f"""{analysis_prompts[analysis_type]}
-
-IFC DATA:
-{st.session_state.ifc_text}
-
-Please provide a detailed analysis in a clear, structured format."""
+        if st.session_state.ifc_index is not None:
+            # Precomputed takeoff tables instead of the raw STEP text
+            model_data = takeoff_to_text(st.session_state.ifc_index, get_takeoff(), analysis_type)
+        else:
+            model_data = f"IFC DATA:\n{st.session_state.ifc_text}"
+        prompt = create_ifc_prompt(analysis_type, model_data, st.session_state.ifc_custom_instructions)
 
         # Run analysis
         st.markdown("### IFC Analysis Results")
@@ -159,18 +248,19 @@ Please provide a detailed analysis in a clear, structured format."""
 
         # Create placeholder for streaming results
         result_placeholder = st.empty()
-        full_response = ""
 
         try:
-            lm_client = LMStudioClient()
+            lm_client = get_lm_client()
 
             with st.spinner("Analyzing IFC data..."):
-                for chunk in lm_client.analyze_documents(prompt, st.session_state.ifc_selected_model, stream=True):
-                    full_response += chunk
-                    result_placeholder.markdown(full_response)
+                response_stream = lm_client.analyze_documents(prompt, st.session_state.ifc_selected_model, stream=True,
+                                                              use_cache=st.session_state.ifc_use_response_cache)
+                renderer = StreamingRenderer(result_placeholder)
+                full_response = renderer.render(response_stream)
 
             # Display final result
             st.success("✅ IFC analysis complete!")
+            st.caption(renderer.summary())
 
             # Download button
             st.download_button(
@@ -186,5 +276,124 @@ Please provide a detailed analysis in a clear, structured format."""
 
     # Reset button
     if st.button("🔄 Reset", use_container_width=True):
+        release_ifc_file()
         st.session_state.ifc_text = None
         st.rerun()
+
+
+def load_revision(ifc_file, slot):
+    """
+    Spool and index an uploaded revision once, keeping it under a session slot.
+
+    Args:
+        ifc_file: File object from Streamlit file uploader
+        slot: Session key prefix ("ifc_old" or "ifc_new")
+
+    Returns:
+        IFCIndex: Index of the revision
+    """
+    if st.session_state.get(f"{slot}_file_id") != ifc_file.file_id:
+        release_revision(slot)
+        with st.spinner(f"Indexing {ifc_file.name}..."):
+            ifc_handle = IFCFile.spool(ifc_file)
+            if not is_step_file(ifc_handle.head()):
+                ifc_handle.close()
+                raise Exception("not an IFC (ISO-10303-21) file")
+            st.session_state[f"{slot}_index"] = IFCIndex.from_buffer(ifc_handle.mapping)
+        st.session_state[f"{slot}_file"] = ifc_handle
+        st.session_state[f"{slot}_file_id"] = ifc_file.file_id
+        st.session_state.ifc_diff = None
+    return st.session_state[f"{slot}_index"]
+
+
+def release_revision(slot):
+    """Drop a revision's index and delete its spooled file."""
+    ifc_handle = st.session_state.get(f"{slot}_file")
+    st.session_state[f"{slot}_index"] = None
+    st.session_state[f"{slot}_file"] = None
+    st.session_state[f"{slot}_file_id"] = None
+    st.session_state.ifc_diff = None
+    if ifc_handle is not None:
+        ifc_handle.close()
+
+
+def show_revision_comparison():
+    """Diff two revisions of a model and analyze what changed."""
+    indexes = {}
+    col1, col2 = st.columns(2)
+    for column, slot, label in ((col1, "ifc_old", "Previous Revision"), (col2, "ifc_new", "New Revision")):
+        with column:
+            st.markdown(f"#### {label}")
+            ifc_file = st.file_uploader(f"Upload {label} (IFC)", type=['ifc'], key=f"{slot}_upload")
+            if ifc_file:
+                try:
+                    indexes[slot] = load_revision(ifc_file, slot)
+                    st.success(f"✅ {ifc_file.name} loaded")
+                    st.caption(f"Size: {ifc_file.size / 1024:.1f} KB | {len(indexes[slot])} entities")
+                except Exception as e:
+                    st.error(f"Error reading file: {str(e)}")
+            elif st.session_state.get(f"{slot}_file") is not None:
+                release_revision(slot)
+
+    st.markdown("---")
+    st.markdown("### Run Revision Comparison")
+
+    can_compare = len(indexes) == 2
+    if not can_compare:
+        st.warning("⚠️ Please upload both revisions to compare them")
+        return
+
+    if st.session_state.get("ifc_diff") is None:
+        with st.spinner("Comparing revisions..."):
+            st.session_state.ifc_diff = diff_models(indexes["ifc_old"], indexes["ifc_new"])
+    diff = st.session_state.ifc_diff
+
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("Added", len(diff["added"]))
+    col2.metric("Removed", len(diff["removed"]))
+    col3.metric("Changed", len(diff["changed"]))
+    col4.metric("Unchanged", diff["unchanged"])
+
+    with st.expander("📊 Changed Elements", expanded=True):
+        for section in ("added", "removed", "changed"):
+            if diff[section]:
+                st.markdown(f"**{section.title()}**")
+                rows = [
+                    {key: (", ".join(value) if isinstance(value, list) else value)
+                     for key, value in item.items() if key in ("global_id", "type", "name", "components")}
+                    for item in diff[section]
+                ]
+                st.dataframe(rows, use_container_width=True, hide_index=True)
+
+    can_analyze = st.session_state.ifc_selected_model is not None
+    if not can_analyze:
+        st.warning("⚠️ Please provide LM Studio connection to run analysis")
+
+    if st.button("🚀 Analyze Changes", disabled=not can_analyze, use_container_width=True):
+        prompt = create_ifc_revision_prompt(diff_to_text(diff), st.session_state.ifc_custom_instructions)
+
+        st.markdown("### Revision Analysis Results")
+        result_placeholder = st.empty()
+
+        try:
+            lm_client = get_lm_client()
+
+            with st.spinner("Analyzing changes..."):
+                response_stream = lm_client.analyze_documents(prompt, st.session_state.ifc_selected_model, stream=True,
+                                                              use_cache=st.session_state.ifc_use_response_cache)
+                renderer = StreamingRenderer(result_placeholder)
+                full_response = renderer.render(response_stream)
+
+            st.success("✅ Revision analysis complete!")
+            st.caption(renderer.summary())
+
+            st.download_button(
+                label="📥 Download Analysis Report",
+                data=full_response,
+                file_name="ifc_revision_report.txt",
+                mime="text/plain",
+                use_container_width=True
+            )
+
+        except Exception as e:
+            st.error(f"❌ Error during analysis: {str(e)}")
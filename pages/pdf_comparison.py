@@ -6,8 +6,66 @@ from pathlib import Path
 # Add parent directory to path for imports
 sys.path.insert(0, str(Path(__file__).parent.parent))
 
-from utils.pdf_utils import extract_text_from_pdf, get_pdf_info
-from utils.ai_utils import LMStudioClient, create_comparison_prompt
+from utils.pdf_utils import load_pdf_document
+from utils.ui_utils import extract_text_with_progress, build_prompt_within_context, get_token_planner, show_token_plan, StreamingRenderer
+from utils.ai_utils import get_lm_client, create_comparison_prompt, create_section_diff_prompt
+from utils.diff_utils import diff_sections, section_diff_to_text, MAX_DELTA_RATIO
+from utils.similarity_utils import collapse_boilerplate
+from utils.cache_utils import make_cache_key
+
+
+def get_boilerplate(documents):
+    """
+    Collapse shared boilerplate, reusing the result while the documents are unchanged.
+
+    Args:
+        documents: dict of label -> document text
+
+    Returns:
+        dict: Result of collapse_boilerplate
+    """
+    key = make_cache_key(*[part for item in documents.items() for part in item])
+    memo = st.session_state.get("boilerplate_memo")
+    if memo is None or memo["key"] != key:
+        memo = st.session_state.boilerplate_memo = {"key": key, "result": collapse_boilerplate(documents)}
+    return memo["result"]
+
+
+def show_boilerplate_report(result):
+    """
+    Show how much repeated text was collapsed out of the prompt.
+
+    Args:
+        result: Result of collapse_boilerplate
+    """
+    before = sum(tokens[0] for tokens in result["tokens"].values())
+    after = sum(tokens[1] for tokens in result["tokens"].values())
+    verified = all(result["verified"].values())
+    with st.expander(f"🧹 Shared Boilerplate: ~{before - after:,} tokens removed", expanded=not verified):
+        st.caption(
+            "Paragraphs repeated across the proposals are sent once as shared text and referenced where they "
+            "appear. Occurrences with different wording keep their edits inline, so no wording is dropped."
+        )
+        if verified:
+            st.success("✅ Verified: every proposal was rebuilt word for word from the shared text and inline edits.")
+        else:
+            failed = ", ".join(label.title() for label, ok in result["verified"].items() if not ok)
+            st.warning(f"⚠️ {failed} could not be rebuilt exactly from the collapsed text; the proposals are sent in full.")
+        st.dataframe(
+            [{"Document": label.title(), "Tokens Before": tokens[0], "Tokens After": tokens[1],
+              "Rebuilds Exactly": {True: "Yes", False: "No"}.get(result["verified"].get(label), "-")}
+             for label, tokens in result["tokens"].items()],
+            use_container_width=True,
+            hide_index=True
+        )
+        st.dataframe(
+            [{"Shared Text": cluster["id"], "Appears In": ", ".join(cluster["labels"]),
+              "Occurrences": cluster["occurrences"], "Identical": cluster["exact"],
+              "Words": cluster["words"], "Starts With": cluster["preview"]}
+             for cluster in result["clusters"]],
+            use_container_width=True,
+            hide_index=True
+        )
 
 
 def show():
@@ -27,8 +85,8 @@ def show():
 
     # Settings in expander
     with st.expander("⚙️ Settings", expanded=False):
-        # Initialize LM Studio client
-        lm_client = LMStudioClient()
+        # Get the shared LM Studio client
+        lm_client = get_lm_client()
 
         # Get available models
         models = lm_client.get_available_models()
@@ -54,6 +112,27 @@ def show():
         )
         st.session_state.custom_instructions = custom_instructions
 
+        # Response cache bypass
+        st.session_state.use_response_cache = st.checkbox(
+            "Reuse cached AI responses",
+            value=True,
+            help="Replay the saved result when the same model, prompt and settings were run before. Uncheck to force a fresh run."
+        )
+
+        # Section diff pre-pass
+        st.session_state.send_differences_only = st.checkbox(
+            "Send only differing sections",
+            value=True,
+            help="Align the proposals by section heading and send only the sections that differ, as diffs. Falls back to full text when the proposals share little."
+        )
+
+        # Boilerplate collapse for full-text comparisons
+        st.session_state.collapse_boilerplate = st.checkbox(
+            "Collapse shared boilerplate",
+            value=True,
+            help="When proposals are sent in full, send paragraphs repeated across them (terms, disclaimers, company history) only once."
+        )
+
     # Comparison mode toggle
     st.markdown("### Comparison Mode")
     col1, col2 = st.columns(2)
@@ -95,15 +174,14 @@ def show():
 
             if pdf_a:
                 try:
-                    pdf_info = get_pdf_info(pdf_a)
-                    st.success(f"✅ {pdf_info['file_name']}")
-                    st.caption(f"Pages: {pdf_info['page_count']} | Size: {pdf_info['file_size'] / 1024:.1f} KB")
+                    pdf_doc = load_pdf_document(pdf_a)
+                    st.success(f"✅ {pdf_doc.file_name}")
+                    st.caption(f"Pages: {pdf_doc.page_count} | Size: {pdf_doc.file_size / 1024:.1f} KB")
 
                     # Extract text
                     if st.session_state.pdf_a_text is None or st.button("Re-extract Text A", key="reextract_a"):
-                        with st.spinner("Extracting text from Proposal A..."):
-                            st.session_state.pdf_a_text = extract_text_from_pdf(pdf_a)
-                            st.success(f"Extracted {len(st.session_state.pdf_a_text)} characters")
+                        st.session_state.pdf_a_text = extract_text_with_progress(pdf_doc, "Extracting text from Proposal A...", max_chars=None)
+                        st.success(f"Extracted {len(st.session_state.pdf_a_text)} characters")
                 except Exception as e:
                     st.error(f"Error processing Proposal A: {str(e)}")
 
@@ -118,15 +196,14 @@ def show():
 
             if pdf_b:
                 try:
-                    pdf_info = get_pdf_info(pdf_b)
-                    st.success(f"✅ {pdf_info['file_name']}")
-                    st.caption(f"Pages: {pdf_info['page_count']} | Size: {pdf_info['file_size'] / 1024:.1f} KB")
+                    pdf_doc = load_pdf_document(pdf_b)
+                    st.success(f"✅ {pdf_doc.file_name}")
+                    st.caption(f"Pages: {pdf_doc.page_count} | Size: {pdf_doc.file_size / 1024:.1f} KB")
 
                     # Extract text
                     if st.session_state.pdf_b_text is None or st.button("Re-extract Text B", key="reextract_b"):
-                        with st.spinner("Extracting text from Proposal B..."):
-                            st.session_state.pdf_b_text = extract_text_from_pdf(pdf_b)
-                            st.success(f"Extracted {len(st.session_state.pdf_b_text)} characters")
+                        st.session_state.pdf_b_text = extract_text_with_progress(pdf_doc, "Extracting text from Proposal B...", max_chars=None)
+                        st.success(f"Extracted {len(st.session_state.pdf_b_text)} characters")
                 except Exception as e:
                     st.error(f"Error processing Proposal B: {str(e)}")
 
@@ -145,15 +222,14 @@ def show():
 
             if pdf_a:
                 try:
-                    pdf_info = get_pdf_info(pdf_a)
-                    st.success(f"✅ {pdf_info['file_name']}")
-                    st.caption(f"Pages: {pdf_info['page_count']} | Size: {pdf_info['file_size'] / 1024:.1f} KB")
+                    pdf_doc = load_pdf_document(pdf_a)
+                    st.success(f"✅ {pdf_doc.file_name}")
+                    st.caption(f"Pages: {pdf_doc.page_count} | Size: {pdf_doc.file_size / 1024:.1f} KB")
 
                     # Extract text
                     if st.session_state.pdf_a_text is None or st.button("Re-extract Text A", key="reextract_a_3way"):
-                        with st.spinner("Extracting text..."):
-                            st.session_state.pdf_a_text = extract_text_from_pdf(pdf_a)
-                            st.success(f"Extracted {len(st.session_state.pdf_a_text)} characters")
+                        st.session_state.pdf_a_text = extract_text_with_progress(pdf_doc, "Extracting text...", max_chars=None)
+                        st.success(f"Extracted {len(st.session_state.pdf_a_text)} characters")
                 except Exception as e:
                     st.error(f"Error: {str(e)}")
 
@@ -168,15 +244,14 @@ def show():
 
             if pdf_b:
                 try:
-                    pdf_info = get_pdf_info(pdf_b)
-                    st.success(f"✅ {pdf_info['file_name']}")
-                    st.caption(f"Pages: {pdf_info['page_count']} | Size: {pdf_info['file_size'] / 1024:.1f} KB")
+                    pdf_doc = load_pdf_document(pdf_b)
+                    st.success(f"✅ {pdf_doc.file_name}")
+                    st.caption(f"Pages: {pdf_doc.page_count} | Size: {pdf_doc.file_size / 1024:.1f} KB")
 
                     # Extract text
                     if st.session_state.pdf_b_text is None or st.button("Re-extract Text B", key="reextract_b_3way"):
-                        with st.spinner("Extracting text..."):
-                            st.session_state.pdf_b_text = extract_text_from_pdf(pdf_b)
-                            st.success(f"Extracted {len(st.session_state.pdf_b_text)} characters")
+                        st.session_state.pdf_b_text = extract_text_with_progress(pdf_doc, "Extracting text...", max_chars=None)
+                        st.success(f"Extracted {len(st.session_state.pdf_b_text)} characters")
                 except Exception as e:
                     st.error(f"Error: {str(e)}")
 
@@ -191,15 +266,14 @@ def show():
 
             if pdf_c:
                 try:
-                    pdf_info = get_pdf_info(pdf_c)
-                    st.success(f"✅ {pdf_info['file_name']}")
-                    st.caption(f"Pages: {pdf_info['page_count']} | Size: {pdf_info['file_size'] / 1024:.1f} KB")
+                    pdf_doc = load_pdf_document(pdf_c)
+                    st.success(f"✅ {pdf_doc.file_name}")
+                    st.caption(f"Pages: {pdf_doc.page_count} | Size: {pdf_doc.file_size / 1024:.1f} KB")
 
                     # Extract text
                     if st.session_state.pdf_c_text is None or st.button("Re-extract Text C", key="reextract_c_3way"):
-                        with st.spinner("Extracting text..."):
-                            st.session_state.pdf_c_text = extract_text_from_pdf(pdf_c)
-                            st.success(f"Extracted {len(st.session_state.pdf_c_text)} characters")
+                        st.session_state.pdf_c_text = extract_text_with_progress(pdf_doc, "Extracting text...", max_chars=None)
+                        st.success(f"Extracted {len(st.session_state.pdf_c_text)} characters")
                 except Exception as e:
                     st.error(f"Error: {str(e)}")
 
@@ -233,33 +307,85 @@ def show():
 
         st.warning(f"⚠️ Please upload {', '.join(missing_items)} to run analysis")
 
-    if st.button("🚀 Run Comparison Analysis", disabled=not can_analyze, use_container_width=True):
-        # Create the prompt
-        prompt = create_comparison_prompt(
-            st.session_state.pdf_a_text,
-            st.session_state.pdf_b_text,
-            st.session_state.pdf_c_text if st.session_state.comparison_mode == 'three_way' else None,
+    documents = {
+        "PROPOSAL A": st.session_state.pdf_a_text,
+        "PROPOSAL B": st.session_state.pdf_b_text
+    }
+    if st.session_state.comparison_mode == 'three_way':
+        documents["PROPOSAL C"] = st.session_state.pdf_c_text
+
+    def build_full_prompt(texts):
+        return create_comparison_prompt(
+            texts["PROPOSAL A"],
+            texts["PROPOSAL B"],
+            texts.get("PROPOSAL C"),
+            st.session_state.custom_instructions or "",
+            texts.get("SHARED TEXT", "")
+        )
+
+    def build_diff_prompt(texts):
+        return create_section_diff_prompt(
+            texts["SECTION DIFFERENCES"],
+            labels,
             st.session_state.custom_instructions or ""
         )
 
+    labels = list(documents)
+    build_prompt = build_full_prompt
+    sent_in_full = True
+    if can_analyze and st.session_state.send_differences_only:
+        section_diff = diff_sections(documents)
+        section_differences = section_diff_to_text(section_diff)
+        full_chars = sum(len(text) for text in documents.values())
+        if len(section_differences) <= MAX_DELTA_RATIO * full_chars:
+            st.caption(
+                f"Section pre-pass: {len(section_diff['identical'])} identical sections summarized, "
+                f"{len(section_diff['differing'])} differing sections sent "
+                f"({len(section_differences):,} of {full_chars:,} characters)"
+            )
+            documents = {"SECTION DIFFERENCES": section_differences}
+            build_prompt = build_diff_prompt
+            sent_in_full = False
+        else:
+            st.caption("Section pre-pass: the proposals share too little text to diff; sending them in full")
+
+    if can_analyze and sent_in_full and st.session_state.collapse_boilerplate:
+        boilerplate = get_boilerplate(documents)
+        if boilerplate["shared"]:
+            show_boilerplate_report(boilerplate)
+            if all(boilerplate["verified"].values()):
+                documents = dict(boilerplate["documents"], **{"SHARED TEXT": boilerplate["shared"]})
+
+    if can_analyze:
+        planner = get_token_planner(get_lm_client(), st.session_state.selected_model)
+        show_token_plan(planner, documents, build_prompt)
+
+    if st.button("🚀 Run Comparison Analysis", disabled=not can_analyze, use_container_width=True):
         # Run analysis
         st.markdown("### Analysis Results")
         st.info("🤖 AI analysis in progress... This may take several minutes.")
 
         # Create placeholder for streaming results
         result_placeholder = st.empty()
-        full_response = ""
 
         try:
-            lm_client = LMStudioClient()
+            lm_client = get_lm_client()
+
+            # Create the prompt, condensing documents too long for one request
+            prompt = build_prompt_within_context(
+                lm_client, st.session_state.selected_model, documents, build_prompt, planner,
+                use_cache=st.session_state.use_response_cache
+            )
 
             with st.spinner("Analyzing documents..."):
-                for chunk in lm_client.analyze_documents(prompt, st.session_state.selected_model, stream=True):
-                    full_response += chunk
-                    result_placeholder.markdown(full_response)
+                response_stream = lm_client.analyze_documents(prompt, st.session_state.selected_model, stream=True,
+                                                              max_tokens=planner.max_tokens_for(prompt), use_cache=st.session_state.use_response_cache)
+                renderer = StreamingRenderer(result_placeholder)
+                full_response = renderer.render(response_stream)
 
             # Display final result
             st.success("✅ Analysis complete!")
+            st.caption(renderer.summary())
 
             # Provide download button for HTML report
             if "<html" in full_response.lower() or "<!doctype" in full_response.lower():
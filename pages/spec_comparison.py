@@ -6,8 +6,50 @@ from pathlib import Path
 # Add parent directory to path for imports
 sys.path.insert(0, str(Path(__file__).parent.parent))
 
-from utils.pdf_utils import extract_text_from_pdf, get_pdf_info
-from utils.ai_utils import LMStudioClient, create_spec_comparison_prompt
+from utils.pdf_utils import load_pdf_document
+from utils.ui_utils import (
+    extract_text_with_progress,
+    extract_texts_with_progress,
+    build_prompt_within_context,
+    condense_documents,
+    fit_documents_to_context,
+    get_token_planner,
+    show_token_plan,
+    check_requirements_with_progress,
+    show_directive_report,
+    StreamingRenderer,
+)
+from utils.ai_utils import get_lm_client, create_spec_comparison_prompt, AsyncLMStudioClient, DEFAULT_MAX_CONCURRENCY
+from utils.spec_utils import (
+    RequirementIndex,
+    build_batch_prompt,
+    render_compliance_report,
+    merge_html_reports,
+    finalize_html_report,
+)
+from utils.directive_utils import evaluate_directives
+from utils.chunked_analysis import prompt_token_budget
+
+
+def volume_labels(file_names):
+    """
+    Label SPEC volumes by file name, numbering repeated names.
+
+    Args:
+        file_names: File name of each uploaded volume, in upload order
+
+    Returns:
+        list: Unique labels, e.g. "Specs.pdf" and "Specs.pdf (2)"
+    """
+    labels = []
+    for name in file_names:
+        label = name
+        number = 1
+        while label in labels:
+            number += 1
+            label = f"{name} ({number})"
+        labels.append(label)
+    return labels
 
 
 def show():
@@ -16,15 +58,19 @@ def show():
     st.markdown("Analyze specification documents against proposal documents for compliance.")
 
     # Initialize session state
-    if 'spec_text' not in st.session_state:
-        st.session_state.spec_text = None
+    if 'spec_texts' not in st.session_state:
+        st.session_state.spec_texts = {}
+    if 'spec_extracted' not in st.session_state:
+        st.session_state.spec_extracted = {}
     if 'proposal_text' not in st.session_state:
         st.session_state.proposal_text = None
+    if 'spec_requirement_run' not in st.session_state:
+        st.session_state.spec_requirement_run = None
 
     # Settings in expander
     with st.expander("⚙️ Settings", expanded=False):
-        # Initialize LM Studio client
-        lm_client = LMStudioClient()
+        # Get the shared LM Studio client
+        lm_client = get_lm_client()
 
         # Get available models
         models = lm_client.get_available_models()
@@ -50,6 +96,28 @@ def show():
         )
         st.session_state.spec_custom_instructions = custom_instructions
 
+        # Response cache bypass
+        st.session_state.spec_use_response_cache = st.checkbox(
+            "Reuse cached AI responses",
+            value=True,
+            help="Replay the saved result when the same model, prompt and settings were run before. Uncheck to force a fresh run."
+        )
+
+        # Analysis method
+        st.session_state.spec_analysis_method = st.radio(
+            "Analysis Method",
+            options=["Requirement by requirement", "Whole document"],
+            help="Requirement by requirement splits the SPEC into numbered requirements and checks them in parallel batches. "
+                 "Whole document sends each SPEC volume with the Proposal in a single request."
+        )
+        st.session_state.spec_parallel_requests = st.number_input(
+            "Parallel requests",
+            min_value=1,
+            max_value=32,
+            value=DEFAULT_MAX_CONCURRENCY,
+            help="Requirement batches or SPEC volumes sent to LM Studio at once. Set this to the number of parallel slots LM Studio serves."
+        )
+
     st.markdown("---")
 
     # File upload section
@@ -58,27 +126,43 @@ def show():
     col1, col2 = st.columns(2)
 
     with col1:
-        st.markdown("#### Specification Document (SPEC)")
-        spec_file = st.file_uploader(
-            "Upload SPEC Document (PDF)",
+        st.markdown("#### Specification Documents (SPEC)")
+        spec_files = st.file_uploader(
+            "Upload SPEC Documents (PDF)",
             type=['pdf'],
-            key="spec_file",
-            help="Upload the specification/requirements document"
+            accept_multiple_files=True,
+            key="spec_files",
+            help="Upload one or more specification/requirements volumes"
         )
 
-        if spec_file:
+        if spec_files:
             try:
-                pdf_info = get_pdf_info(spec_file)
-                st.success(f"✅ {pdf_info['file_name']}")
-                st.caption(f"Pages: {pdf_info['page_count']} | Size: {pdf_info['file_size'] / 1024:.1f} KB")
-
-                # Extract text
-                if st.session_state.spec_text is None or st.button("Re-extract SPEC Text", key="reextract_spec"):
-                    with st.spinner("Extracting text from SPEC document..."):
-                        st.session_state.spec_text = extract_text_from_pdf(spec_file)
-                        st.success(f"Extracted {len(st.session_state.spec_text)} characters")
+                pdf_docs = [load_pdf_document(spec_file) for spec_file in spec_files]
+                for pdf_doc in pdf_docs:
+                    st.success(f"✅ {pdf_doc.file_name}")
+                    st.caption(f"Pages: {pdf_doc.page_count} | Size: {pdf_doc.file_size / 1024:.1f} KB")
+
+                # Extracted text is kept per upload, so volumes with the same
+                # file name do not overwrite each other
+                file_ids = [spec_file.file_id for spec_file in spec_files]
+                extracted = {file_id: text for file_id, text in st.session_state.spec_extracted.items()
+                             if file_id in file_ids}
+                pending = [index for index, file_id in enumerate(file_ids) if file_id not in extracted]
+                if st.button("Re-extract SPEC Text", key="reextract_spec"):
+                    pending = list(range(len(pdf_docs)))
+                if pending:
+                    texts = extract_texts_with_progress([pdf_docs[index] for index in pending],
+                                                        "Extracting text from SPEC documents...", max_chars=None)
+                    extracted.update(zip([file_ids[index] for index in pending], texts))
+                    st.success(f"Extracted {sum(len(text) for text in texts)} characters from {len(pending)} document(s)")
+                st.session_state.spec_extracted = extracted
+                labels = volume_labels([pdf_doc.file_name for pdf_doc in pdf_docs])
+                st.session_state.spec_texts = {label: extracted[file_id] for label, file_id in zip(labels, file_ids)}
             except Exception as e:
-                st.error(f"Error processing SPEC document: {str(e)}")
+                st.error(f"Error processing SPEC documents: {str(e)}")
+        else:
+            st.session_state.spec_extracted = {}
+            st.session_state.spec_texts = {}
 
     with col2:
         st.markdown("#### Proposal Document")
@@ -91,15 +175,14 @@ def show():
 
         if proposal_file:
             try:
-                pdf_info = get_pdf_info(proposal_file)
-                st.success(f"✅ {pdf_info['file_name']}")
-                st.caption(f"Pages: {pdf_info['page_count']} | Size: {pdf_info['file_size'] / 1024:.1f} KB")
+                pdf_doc = load_pdf_document(proposal_file)
+                st.success(f"✅ {pdf_doc.file_name}")
+                st.caption(f"Pages: {pdf_doc.page_count} | Size: {pdf_doc.file_size / 1024:.1f} KB")
 
                 # Extract text
                 if st.session_state.proposal_text is None or st.button("Re-extract Proposal Text", key="reextract_proposal"):
-                    with st.spinner("Extracting text from Proposal document..."):
-                        st.session_state.proposal_text = extract_text_from_pdf(proposal_file)
-                        st.success(f"Extracted {len(st.session_state.proposal_text)} characters")
+                    st.session_state.proposal_text = extract_text_with_progress(pdf_doc, "Extracting text from Proposal document...", max_chars=None)
+                    st.success(f"Extracted {len(st.session_state.proposal_text)} characters")
             except Exception as e:
                 st.error(f"Error processing Proposal document: {str(e)}")
 
@@ -109,14 +192,14 @@ def show():
     st.markdown("### Run Compliance Analysis")
 
     # Check if we have the required documents
-    can_analyze = (st.session_state.spec_text is not None and
+    can_analyze = (bool(st.session_state.spec_texts) and
                   st.session_state.proposal_text is not None and
                   st.session_state.spec_selected_model is not None)
 
     if not can_analyze:
         missing_items = []
-        if st.session_state.spec_text is None:
-            missing_items.append("SPEC Document")
+        if not st.session_state.spec_texts:
+            missing_items.append("SPEC Document(s)")
         if st.session_state.proposal_text is None:
             missing_items.append("Proposal Document")
         if st.session_state.spec_selected_model is None:
@@ -134,39 +217,89 @@ def show():
         - Flag areas needing clarification
         - Generate a comprehensive HTML report with detailed tables
 
-        **Special Analysis Features:**
+        **Special Analysis Features** (each included only when the documents call for it):
         - Welded Component Material Assumptions
         - Multi-Module Connection Verification
         - ADA Compliance Checking
         - Detailed status indicators and color-coded results
         """)
 
-    if st.button("🚀 Run Compliance Analysis", disabled=not can_analyze, use_container_width=True):
-        # Create the prompt
-        prompt = create_spec_comparison_prompt(
-            st.session_state.spec_text,
-            st.session_state.proposal_text,
-            st.session_state.spec_custom_instructions or ""
+    requirement_index = None
+    if st.session_state.spec_texts and st.session_state.spec_analysis_method == "Requirement by requirement":
+        requirement_index = RequirementIndex.from_volumes(st.session_state.spec_texts)
+        if len(requirement_index):
+            repeated = f" ({len(requirement_index.duplicates)} repeated across volumes are checked once)" if requirement_index.duplicates else ""
+            st.caption(f"📑 {len(requirement_index)} numbered requirements found in "
+                       f"{len(st.session_state.spec_texts)} SPEC document(s){repeated}")
+        else:
+            st.info("No numbered requirements (e.g. \"3.2.1 ...\") found in the SPEC; the whole document will be analyzed in one request.")
+            requirement_index = None
+
+    if requirement_index is not None:
+        show_requirement_analysis(requirement_index, can_analyze)
+    elif len(st.session_state.spec_texts) > 1:
+        show_volume_analysis(can_analyze)
+    else:
+        show_document_analysis(can_analyze)
+
+    # Reset button
+    if st.button("🔄 Reset All", use_container_width=True):
+        st.session_state.spec_texts = {}
+        st.session_state.spec_extracted = {}
+        st.session_state.proposal_text = None
+        st.session_state.spec_requirement_run = None
+        st.rerun()
+
+
+def show_document_analysis(can_analyze):
+    """Analyze the whole SPEC and Proposal in one request."""
+    documents = {
+        "SPECIFICATION": next(iter(st.session_state.spec_texts.values()), None),
+        "PROPOSAL": st.session_state.proposal_text
+    }
+    # Decided on the full documents; the prompt may be built from condensed ones
+    directives = evaluate_directives(documents["SPECIFICATION"], documents["PROPOSAL"], local_styles=True)
+
+    def build_prompt(texts):
+        return create_spec_comparison_prompt(
+            texts["SPECIFICATION"],
+            texts["PROPOSAL"],
+            st.session_state.spec_custom_instructions or "",
+            directives=directives
         )
 
+    if can_analyze:
+        planner = get_token_planner(get_lm_client(), st.session_state.spec_selected_model)
+        show_token_plan(planner, documents, build_prompt)
+        show_directive_report(directives)
+
+    if st.button("🚀 Run Compliance Analysis", disabled=not can_analyze, use_container_width=True):
         # Run analysis
         st.markdown("### Compliance Analysis Results")
         st.info("🤖 AI analysis in progress... This may take several minutes due to the detailed nature of compliance checking.")
 
         # Create placeholder for streaming results
         result_placeholder = st.empty()
-        full_response = ""
 
         try:
-            lm_client = LMStudioClient()
+            lm_client = get_lm_client()
+
+            # Create the prompt, condensing documents too long for one request
+            prompt = build_prompt_within_context(
+                lm_client, st.session_state.spec_selected_model, documents, build_prompt, planner,
+                use_cache=st.session_state.spec_use_response_cache
+            )
 
             with st.spinner("Analyzing compliance..."):
-                for chunk in lm_client.analyze_documents(prompt, st.session_state.spec_selected_model, stream=True):
-                    full_response += chunk
-                    result_placeholder.markdown(full_response)
+                response_stream = lm_client.analyze_documents(prompt, st.session_state.spec_selected_model, stream=True,
+                                                              max_tokens=planner.max_tokens_for(prompt), use_cache=st.session_state.spec_use_response_cache)
+                renderer = StreamingRenderer(result_placeholder)
+                full_response = renderer.render(response_stream)
 
             # Display final result
             st.success("✅ Compliance analysis complete!")
+            st.caption(renderer.summary())
+            full_response = finalize_html_report(full_response, directives)
 
             # Display the HTML report directly if it contains HTML
             if "<html" in full_response.lower() or "<!doctype" in full_response.lower():
@@ -194,8 +327,190 @@ def show():
         except Exception as e:
             st.error(f"❌ Error during analysis: {str(e)}")
 
-    # Reset button
-    if st.button("🔄 Reset All", use_container_width=True):
-        st.session_state.spec_text = None
-        st.session_state.proposal_text = None
-        st.rerun()
+
+def show_volume_analysis(can_analyze):
+    """Analyze each SPEC volume against the Proposal concurrently and merge the reports."""
+    volumes = st.session_state.spec_texts
+    custom_instructions = st.session_state.spec_custom_instructions or ""
+    # One decision for all volumes, so every volume prompt shares the same instructions
+    directives = evaluate_directives("\n".join(volumes.values()), st.session_state.proposal_text, local_styles=True)
+
+    def build_prompt(texts):
+        return create_spec_comparison_prompt(texts["SPECIFICATION"], texts["PROPOSAL"], custom_instructions,
+                                             directives=directives)
+
+    st.caption(f"{len(volumes)} SPEC volumes are analyzed separately, "
+               f"{st.session_state.spec_parallel_requests} at a time, and merged into one report.")
+    if can_analyze:
+        show_directive_report(directives)
+
+    if st.button("🚀 Run Compliance Analysis", disabled=not can_analyze, use_container_width=True):
+        st.markdown("### Compliance Analysis Results")
+        st.info("🤖 AI analysis in progress... Volumes are analyzed in parallel.")
+
+        try:
+            lm_client = get_lm_client()
+            model_id = st.session_state.spec_selected_model
+            planner = get_token_planner(lm_client, model_id)
+            use_cache = st.session_state.spec_use_response_cache
+            parallel_requests = st.session_state.spec_parallel_requests
+            planner.calibrate(st.session_state.proposal_text)
+
+            # Every volume prompt carries the proposal: condense it once, leaving
+            # room for the largest volume (or half the context if that is too big)
+            token_budget = prompt_token_budget(
+                build_prompt, ["SPECIFICATION", "PROPOSAL"], planner.context_tokens, count_tokens=planner.count
+            )
+            largest_volume = max(planner.count(text) for text in volumes.values())
+            proposal = condense_documents(
+                lm_client, model_id, {"PROPOSAL": st.session_state.proposal_text},
+                max(token_budget - largest_volume, token_budget // 2), planner, use_cache, parallel_requests
+            )["PROPOSAL"]
+
+            # Then condense the volumes that still do not fit, all at once;
+            # each volume has its own prompt, so none may use more than volume_budget
+            volume_budget = prompt_token_budget(
+                lambda texts: build_prompt({"SPECIFICATION": texts["SPECIFICATION"], "PROPOSAL": proposal}),
+                ["SPECIFICATION"], planner.context_tokens, count_tokens=planner.count
+            )
+            specs = condense_documents(
+                lm_client, model_id, volumes, volume_budget * len(volumes), planner, use_cache, parallel_requests,
+                max_document_tokens=volume_budget
+            )
+            prompts = [build_prompt({"SPECIFICATION": specs[name], "PROPOSAL": proposal}) for name in volumes]
+
+            progress = st.progress(0.0, text="Analyzing SPEC volumes...")
+            done = 0
+
+            def on_result(index, result):
+                nonlocal done
+                done += 1
+                progress.progress(done / len(prompts), text=f"Analyzing SPEC volumes... {done}/{len(prompts)} complete")
+
+            try:
+                responses = AsyncLMStudioClient(lm_client, max_concurrency=parallel_requests).complete_all(
+                    prompts, model_id, max_tokens=[planner.max_tokens_for(prompt) for prompt in prompts],
+                    use_cache=use_cache, return_exceptions=True, on_result=on_result
+                )
+            finally:
+                progress.empty()
+
+            reports = {}
+            for name, response in zip(volumes, responses):
+                if isinstance(response, Exception):
+                    st.error(f"❌ {name}: {str(response)}")
+                    response = f"Analysis failed: {str(response)}"
+                reports[name] = response
+            full_response = merge_html_reports(reports, directives=directives)
+
+            st.success("✅ Compliance analysis complete!")
+            st.markdown("---")
+            st.markdown("### 📊 Compliance Report")
+            st.components.v1.html(full_response, height=800, scrolling=True)
+            st.download_button(
+                label="📥 Download HTML Report",
+                data=full_response,
+                file_name="spec_compliance_report.html",
+                mime="text/html",
+                use_container_width=True
+            )
+
+        except Exception as e:
+            st.error(f"❌ Error during analysis: {str(e)}")
+
+
+def show_requirement_analysis(requirement_index, can_analyze):
+    """Check SPEC requirements against the Proposal in parallel batches."""
+    batches = dict(enumerate(requirement_index.batches(), start=1))
+    st.caption(f"Requirements are checked in {len(batches)} batches, "
+               f"{st.session_state.spec_parallel_requests} at a time.")
+
+    run = st.session_state.spec_requirement_run
+    if run is not None and (run["spec_texts"] != st.session_state.spec_texts or
+                            run["proposal_text"] != st.session_state.proposal_text):
+        # Documents changed since the last run
+        run = st.session_state.spec_requirement_run = None
+
+    directives = evaluate_directives("\n".join(st.session_state.spec_texts.values()),
+                                     st.session_state.proposal_text, local_styles=True)
+    if can_analyze:
+        show_directive_report(directives)
+
+    if st.button("🚀 Run Compliance Analysis", disabled=not can_analyze, use_container_width=True):
+        st.info("🤖 Checking requirements in parallel batches...")
+        try:
+            lm_client = get_lm_client()
+            model_id = st.session_state.spec_selected_model
+            custom_instructions = st.session_state.spec_custom_instructions or ""
+            planner = get_token_planner(lm_client, model_id)
+
+            # Every batch carries the proposal: condense it once if it
+            # leaves no room for the largest batch
+            largest_batch = max(batches.values(), key=lambda batch: planner.count(build_batch_prompt(batch, "")))
+            proposal = fit_documents_to_context(
+                lm_client, model_id, {"PROPOSAL": st.session_state.proposal_text},
+                lambda texts: build_batch_prompt(largest_batch, texts["PROPOSAL"], custom_instructions, directives),
+                planner, use_cache=st.session_state.spec_use_response_cache,
+                max_concurrency=st.session_state.spec_parallel_requests
+            )["PROPOSAL"]
+
+            verdicts, failures = check_requirements_with_progress(
+                lm_client, model_id, batches, proposal, custom_instructions,
+                max_concurrency=st.session_state.spec_parallel_requests,
+                use_cache=st.session_state.spec_use_response_cache, directives=directives
+            )
+            run = st.session_state.spec_requirement_run = {
+                "spec_texts": st.session_state.spec_texts,
+                "proposal_text": st.session_state.proposal_text,
+                "proposal": proposal,
+                "model_id": model_id,
+                "custom_instructions": custom_instructions,
+                "directives": directives,
+                "verdicts": verdicts,
+                "failures": failures
+            }
+        except Exception as e:
+            st.error(f"❌ Error during analysis: {str(e)}")
+
+    if run is None:
+        return
+
+    if run["failures"]:
+        st.warning(f"⚠️ {len(run['failures'])} of {len(batches)} batches failed; their requirements are marked as not checked.")
+        with st.expander("Failed batches"):
+            for number, error in sorted(run["failures"].items()):
+                st.markdown(f"- Batch {number}: {error}")
+
+        if st.button("🔁 Retry Failed Batches", use_container_width=True):
+            try:
+                verdicts, failures = check_requirements_with_progress(
+                    get_lm_client(), run["model_id"],
+                    {number: batches[number] for number in run["failures"]},
+                    run["proposal"], run["custom_instructions"],
+                    max_concurrency=st.session_state.spec_parallel_requests,
+                    use_cache=False, directives=run["directives"]
+                )
+                run["verdicts"].update(verdicts)
+                run["failures"] = failures
+                st.rerun()
+            except Exception as e:
+                st.error(f"❌ Error during retry: {str(e)}")
+    else:
+        st.success("✅ Compliance analysis complete!")
+
+    report = render_compliance_report(
+        requirement_index, run["verdicts"],
+        spec_name=", ".join(requirement_index.volumes),
+        proposal_name=getattr(st.session_state.get("proposal_file"), "name", "the Proposal document"),
+        directives=run["directives"]
+    )
+    st.markdown("---")
+    st.markdown("### 📊 Compliance Report")
+    st.components.v1.html(report, height=800, scrolling=True)
+    st.download_button(
+        label="📥 Download HTML Report",
+        data=report,
+        file_name="spec_compliance_report.html",
+        mime="text/html",
+        use_container_width=True
+    )
@@ -0,0 +1,684 @@
+"""
+Run proposal, spec, contract and IFC analyses in bulk without Streamlit.
+
+Usage:
+    python scripts/batch_analyze.py compare TENDER_DIR [TENDER_DIR ...] --out reports
+    python scripts/batch_analyze.py spec TENDER_DIR --out reports
+    python scripts/batch_analyze.py contract CONTRACTS_DIR --analysis "Risk Assessment" --out reports
+    python scripts/batch_analyze.py ifc MODELS_DIR --out reports
+    python scripts/batch_analyze.py manifest jobs.jsonl --out reports
+
+Directory inputs:
+    compare   each directory holds the 2 or 3 proposal PDFs of one comparison
+    spec      each directory holds the SPEC volumes in a "spec" subdirectory;
+              every PDF next to it is a proposal checked in its own job
+    contract  every PDF, DOCX or TXT file is analyzed on its own
+    ifc       every IFC file is analyzed on its own
+
+Manifests are JSON Lines, one job per line, with paths relative to the manifest:
+    {"type": "compare", "files": ["a.pdf", "b.pdf", "c.pdf"]}
+    {"type": "spec", "spec": ["vol1.pdf", "vol2.pdf"], "files": ["proposal.pdf"]}
+    {"type": "contract", "files": ["contract.docx"], "analysis": "Risk Assessment"}
+    {"type": "contract", "files": ["v1.pdf", "v2.pdf"]}
+    {"type": "ifc", "files": ["rev1.ifc", "rev2.ifc"]}
+Two contracts are compared with each other, two IFC files as revisions.
+Optional keys: "id", "analysis", "instructions".
+
+Each job writes OUT/<job id>.html (or .md) and appends one line of timing
+and token stats to OUT/stats.jsonl. Jobs recorded there as complete, with
+unchanged inputs and settings, are skipped: rerun the same command to
+resume an interrupted batch. Model responses are cached as in the app, so
+the finished parts of an interrupted job replay instantly.
+"""
+import argparse
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timezone
+from pathlib import Path
+
+# Add parent directory to path for imports
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from utils.ai_utils import (
+    DEFAULT_BASE_URL,
+    DEFAULT_MAX_CONCURRENCY,
+    CONTRACT_ANALYSIS_PROMPTS,
+    IFC_ANALYSIS_PROMPTS,
+    AsyncLMStudioClient,
+    LMStudioClient,
+    create_comparison_prompt,
+    create_contract_comparison_prompt,
+    create_contract_prompt,
+    create_ifc_prompt,
+    create_ifc_revision_prompt,
+    create_section_diff_prompt,
+    create_spec_comparison_prompt,
+)
+from utils.cache_utils import make_cache_key
+from utils.chunked_analysis import CHARS_PER_TOKEN, MapReduceAnalyzer, estimate_tokens, prompt_token_budget
+from utils.diff_utils import MAX_DELTA_RATIO, diff_sections, section_diff_to_text
+from utils.directive_utils import evaluate_directives
+from utils.docx_utils import extract_text_from_docx
+from utils.ifc_diff import diff_models, diff_to_text
+from utils.ifc_takeoff import build_takeoff, takeoff_to_text
+from utils.ifc_utils import IFCFile, IFCIndex, is_step_file
+from utils.pdf_utils import PDFDocument, extract_texts
+from utils.retrieval_utils import BM25Index, EXCERPT_LABEL, MIN_RETRIEVAL_TOKENS, analysis_query, format_passages
+from utils.similarity_utils import CLAUSE_COMPARISON_NOTE, clause_comparison_to_text, collapse_boilerplate, compare_contracts
+from utils.spec_utils import (
+    RequirementIndex,
+    build_batch_prompt,
+    check_requirements,
+    finalize_html_report,
+    merge_html_reports,
+    render_compliance_report,
+)
+from utils.token_utils import TokenPlanner
+
+# Streamlit creates its loggers, and sets their levels, when the utils import
+# it; silence its bare-mode warnings ("missing ScriptRunContext", "run it with
+# streamlit run") now that they exist
+for _name in [name for name in logging.root.manager.loggerDict if name.split(".")[0] == "streamlit"]:
+    logging.getLogger(_name).setLevel(logging.ERROR)
+
+
+STATS_FILE = "stats.jsonl"
+
+# Input files each job type reads, and how many a job takes
+JOB_SUFFIXES = {
+    "compare": (".pdf",),
+    "spec": (".pdf",),
+    "contract": (".pdf", ".docx", ".txt"),
+    "ifc": (".ifc",),
+}
+JOB_FILE_COUNTS = {"compare": (2, 3), "spec": (1, 1), "contract": (1, 2), "ifc": (1, 2)}
+
+# Default analysis type of single-document jobs
+DEFAULT_ANALYSIS = {"contract": "Contract Summary", "ifc": "General Overview"}
+ANALYSIS_TYPES = {"contract": CONTRACT_ANALYSIS_PROMPTS, "ifc": IFC_ANALYSIS_PROMPTS}
+
+# PDFs extracted per worker pool, bounding the PDF bytes held in memory at once
+PREFETCH_DOCUMENTS_PER_WORKER = 4
+
+SPEC_SUBDIRECTORY = "spec"
+
+UNSAFE_ID_CHARS = re.compile(r"[^A-Za-z0-9._-]+")
+
+
+class MeteredClient:
+    """
+    LMStudioClient proxy shared by the jobs of a batch.
+
+    A semaphore caps requests in flight across all jobs, whichever client
+    (sync, async or map-reduce) sends them, and each job's calls and
+    estimated tokens are counted.
+    """
+
+    def __init__(self, client, slots):
+        """
+        Initialize the proxy.
+
+        Args:
+            client: LMStudioClient to send requests through
+            slots: threading.Semaphore shared by all jobs
+        """
+        self.client = client
+        self.slots = slots
+        self.calls = 0
+        self.prompt_chars = 0
+        self.completion_chars = 0
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+    def analyze_documents(self, prompt, *args, **kwargs):
+        """Stream a response as LMStudioClient.analyze_documents, holding a request slot."""
+        completion_chars = 0
+        try:
+            with self.slots:
+                for chunk in self.client.analyze_documents(prompt, *args, **kwargs):
+                    completion_chars += len(chunk)
+                    yield chunk
+        finally:
+            with self._lock:
+                self.calls += 1
+                self.prompt_chars += len(prompt)
+                self.completion_chars += completion_chars
+
+    def stats(self):
+        """Calls made and estimated tokens sent and received."""
+        return {
+            "llm_calls": self.calls,
+            "prompt_tokens": int(self.prompt_chars / CHARS_PER_TOKEN),
+            "completion_tokens": int(self.completion_chars / CHARS_PER_TOKEN),
+        }
+
+
+class BatchContext:
+    """Settings and shared resources for the jobs of one batch."""
+
+    def __init__(self, lm_client, model_id, args):
+        """
+        Initialize the context.
+
+        Args:
+            lm_client: LMStudioClient to send requests through
+            model_id: The model ID to use
+            args: Parsed command-line arguments
+        """
+        self.lm_client = lm_client
+        self.model_id = model_id
+        self.parallel = args.parallel
+        self.use_cache = not args.no_cache
+        self.full_text = args.full_text
+        self.whole_document = args.whole_document
+        self.planner = TokenPlanner(lm_client, model_id)
+        self.slots = threading.BoundedSemaphore(args.parallel)
+        self._calibrate_lock = threading.Lock()
+
+    def client_for_job(self):
+        """A metered client for one job, sharing the batch's request slots."""
+        return MeteredClient(self.lm_client, self.slots)
+
+    def fit_documents(self, client, documents, build_prompt):
+        """
+        Condense documents that do not fit the context (map step), headless.
+
+        Args:
+            client: MeteredClient of the job
+            documents: dict of label -> document text
+            build_prompt: Callable taking a dict of label -> text and returning the prompt
+
+        Returns:
+            dict: label -> text that fits the prompt
+        """
+        with self._calibrate_lock:
+            self.planner.calibrate(next((text for text in documents.values() if text), ""))
+        token_budget = prompt_token_budget(
+            build_prompt, documents, self.planner.context_tokens, count_tokens=self.planner.count
+        )
+        if sum(self.planner.count(text) for text in documents.values()) <= token_budget:
+            return documents
+        return MapReduceAnalyzer(
+            AsyncLMStudioClient(client, max_concurrency=self.parallel), self.model_id,
+            chunk_tokens=self.planner.chunk_tokens, count_tokens=self.planner.count, use_cache=self.use_cache
+        ).condense(documents, token_budget)
+
+    def complete(self, client, prompt):
+        """Send one prompt and return the full response."""
+        return "".join(client.analyze_documents(
+            prompt, self.model_id, stream=True, max_tokens=self.planner.max_tokens_for(prompt),
+            use_cache=self.use_cache
+        ))
+
+
+def read_document(path):
+    """
+    Read a document's text the way the app's upload pages do.
+
+    PDFs come from the extraction cache when prefetch_pdfs extracted them.
+
+    Args:
+        path: Path of a PDF, DOCX or TXT file
+
+    Returns:
+        str: Document text
+    """
+    suffix = path.suffix.lower()
+    if suffix == ".pdf":
+        return PDFDocument(path.read_bytes(), path.name).extract_text(max_chars=None)
+    if suffix == ".docx":
+        with open(path, "rb") as docx_file:
+            return extract_text_from_docx(docx_file)
+    return path.read_text(encoding="utf-8", errors="ignore")
+
+
+def open_ifc_index(path):
+    """
+    Index an IFC file in place.
+
+    Returns:
+        tuple: (IFCFile handle to close after use, IFCIndex or None if the
+            file is not a STEP file)
+    """
+    handle = IFCFile(str(path))
+    if not is_step_file(handle.head()):
+        return handle, None
+    return handle, IFCIndex.from_buffer(handle.mapping)
+
+
+def run_compare(job, context, client):
+    """Compare 2 or 3 proposals, as on the PDF Comparison page."""
+    labels = ["PROPOSAL A", "PROPOSAL B", "PROPOSAL C"][:len(job["files"])]
+    documents = {label: read_document(path) for label, path in zip(labels, job["files"])}
+    instructions = job["instructions"]
+    details = {"sent": "full text"}
+
+    def build_full_prompt(texts):
+        return create_comparison_prompt(
+            texts["PROPOSAL A"], texts["PROPOSAL B"], texts.get("PROPOSAL C"), instructions,
+            texts.get("SHARED TEXT", "")
+        )
+
+    def build_diff_prompt(texts):
+        return create_section_diff_prompt(texts["SECTION DIFFERENCES"], labels, instructions)
+
+    build_prompt = build_full_prompt
+    if not context.full_text:
+        section_differences = section_diff_to_text(diff_sections(documents))
+        if len(section_differences) <= MAX_DELTA_RATIO * sum(len(text) for text in documents.values()):
+            documents = {"SECTION DIFFERENCES": section_differences}
+            details["sent"] = "section differences"
+            build_prompt = build_diff_prompt
+        else:
+            boilerplate = collapse_boilerplate(documents)
+            if boilerplate["shared"]:
+                # Collapsed text is only sent when every proposal rebuilds from it word for word
+                details["boilerplate_verified"] = all(boilerplate["verified"].values())
+                if details["boilerplate_verified"]:
+                    documents = dict(boilerplate["documents"], **{"SHARED TEXT": boilerplate["shared"]})
+                    details["sent"] = "full text, shared boilerplate once"
+
+    prompt = build_prompt(context.fit_documents(client, documents, build_prompt))
+    return context.complete(client, prompt), details
+
+
+def run_spec(job, context, client):
+    """Check a proposal against SPEC volumes, as on the Spec Compliance page."""
+    spec_texts = {path.name: read_document(path) for path in job["spec"]}
+    proposal_path = job["files"][0]
+    proposal_text = read_document(proposal_path)
+    instructions = job["instructions"]
+    directives = evaluate_directives("\n".join(spec_texts.values()), proposal_text, local_styles=True)
+    details = {"directives": [name for name, decision in directives.items() if decision["included"]]}
+
+    index = RequirementIndex.from_volumes(spec_texts)
+    if len(index) and not context.whole_document:
+        batches = dict(enumerate(index.batches(), start=1))
+        # Every batch carries the proposal: condense it once if it leaves no room for the largest batch
+        largest_batch = max(batches.values(), key=lambda batch: context.planner.count(build_batch_prompt(batch, "")))
+        proposal = context.fit_documents(
+            client, {"PROPOSAL": proposal_text},
+            lambda texts: build_batch_prompt(largest_batch, texts["PROPOSAL"], instructions, directives)
+        )["PROPOSAL"]
+        verdicts, failures = check_requirements(
+            AsyncLMStudioClient(client, max_concurrency=context.parallel), context.model_id, batches, proposal,
+            instructions, use_cache=context.use_cache, directives=directives
+        )
+        details.update({"requirements": len(index), "batches": len(batches), "failed_batches": len(failures)})
+        report = render_compliance_report(
+            index, verdicts, spec_name=", ".join(index.volumes), proposal_name=proposal_path.name,
+            directives=directives
+        )
+        return report, details
+
+    def build_prompt(texts):
+        return create_spec_comparison_prompt(texts["SPECIFICATION"], texts["PROPOSAL"], instructions,
+                                             directives=directives)
+
+    prompts = [
+        build_prompt(context.fit_documents(client, {"SPECIFICATION": text, "PROPOSAL": proposal_text}, build_prompt))
+        for text in spec_texts.values()
+    ]
+    responses = AsyncLMStudioClient(client, max_concurrency=context.parallel).complete_all(
+        prompts, context.model_id, max_tokens=[context.planner.max_tokens_for(prompt) for prompt in prompts],
+        use_cache=context.use_cache, return_exceptions=len(prompts) > 1
+    )
+    reports = {name: f"Analysis failed: {str(response)}" if isinstance(response, Exception) else response
+               for name, response in zip(spec_texts, responses)}
+    details["failed_batches"] = sum(isinstance(response, Exception) for response in responses)
+    if len(reports) == 1:
+        return finalize_html_report(responses[0], directives), details
+    return merge_html_reports(reports, directives=directives), details
+
+
+def run_contract(job, context, client):
+    """Analyze one contract or compare two, as on the Contract Helper page."""
+    texts = [read_document(path) for path in job["files"]]
+    instructions = job["instructions"]
+
+    if len(texts) == 2:
+        if context.full_text:
+            contracts_content = f"CONTRACT 1:\n{texts[0]}\n\nCONTRACT 2:\n{texts[1]}"
+            details = {"sent": "full text"}
+        else:
+            comparison = compare_contracts(texts[0], texts[1])
+            contracts_content = f"{CLAUSE_COMPARISON_NOTE}\n\nCLAUSE COMPARISON:\n{clause_comparison_to_text(comparison)}"
+            details = {"sent": "clause comparison", "identical_clauses": len(comparison["identical"]),
+                       "changed_clauses": len(comparison["changed"])}
+        return context.complete(client, create_contract_comparison_prompt(contracts_content)), details
+
+    text = texts[0]
+    analysis = job["analysis"]
+    if context.full_text or estimate_tokens(text) < MIN_RETRIEVAL_TOKENS:
+        label, content = "CONTRACT DOCUMENT", text
+        details = {"sent": "full text"}
+    else:
+        index = BM25Index.from_text(text)
+        passages = index.retrieve(analysis_query(analysis, instructions))
+        label, content = EXCERPT_LABEL, format_passages(passages)
+        details = {"sent": f"{len(passages)} of {len(index)} passages"}
+    return context.complete(client, create_contract_prompt(analysis, label, content, instructions)), details
+
+
+def run_ifc(job, context, client):
+    """Analyze one IFC model or the changes between two revisions, as on the IFC Analysis page."""
+    handles = []
+    try:
+        indexes = []
+        for path in job["files"]:
+            handle, index = open_ifc_index(path)
+            handles.append(handle)
+            indexes.append(index)
+
+        if len(indexes) == 2:
+            if None in indexes:
+                raise Exception("revision comparison needs two IFC (ISO-10303-21) files")
+            diff = diff_models(indexes[0], indexes[1])
+            prompt = create_ifc_revision_prompt(diff_to_text(diff), job["instructions"])
+            details = {"sent": "revision delta"}
+        elif indexes[0] is not None:
+            model_data = takeoff_to_text(indexes[0], build_takeoff(indexes[0]), job["analysis"])
+            prompt = create_ifc_prompt(job["analysis"], model_data, job["instructions"])
+            details = {"sent": "takeoff tables", "entities": len(indexes[0])}
+        else:
+            prompt = create_ifc_prompt(job["analysis"], f"IFC DATA:\n{handles[0].read_text()}", job["instructions"])
+            details = {"sent": "raw text"}
+    finally:
+        for handle in handles:
+            handle.close()
+
+    return context.complete(client, prompt), details
+
+
+JOB_RUNNERS = {"compare": run_compare, "spec": run_spec, "contract": run_contract, "ifc": run_ifc}
+
+
+def _input_files(directory, job_type):
+    return [path for path in sorted(directory.iterdir())
+            if path.is_file() and path.suffix.lower() in JOB_SUFFIXES[job_type]]
+
+
+def discover_jobs(job_type, paths):
+    """
+    Build jobs from directories (and, for contract and ifc jobs, single files).
+
+    Args:
+        job_type: "compare", "spec", "contract" or "ifc"
+        paths: Directories or files given on the command line
+
+    Returns:
+        list: Job dicts with "type", "files" and, for spec jobs, "spec"
+    """
+    jobs = []
+    for path in map(Path, paths):
+        if job_type in ("contract", "ifc"):
+            files = [path] if path.is_file() else _input_files(path, job_type)
+            jobs.extend({"type": job_type, "files": [file]} for file in files)
+        elif job_type == "compare":
+            files = _input_files(path, job_type)
+            if not 2 <= len(files) <= 3:
+                print(f"Skipping {path}: a comparison needs 2 or 3 PDFs, found {len(files)}", file=sys.stderr)
+                continue
+            jobs.append({"type": job_type, "files": files})
+        else:
+            spec_dir = path / SPEC_SUBDIRECTORY
+            spec = _input_files(spec_dir, job_type) if spec_dir.is_dir() else []
+            if not spec:
+                print(f"Skipping {path}: no SPEC PDFs in {spec_dir}", file=sys.stderr)
+                continue
+            jobs.extend({"type": job_type, "spec": spec, "files": [file]} for file in _input_files(path, job_type))
+    return jobs
+
+
+def load_manifest(path):
+    """
+    Read jobs from a JSON Lines manifest.
+
+    Args:
+        path: Manifest path; job paths are relative to its directory
+
+    Returns:
+        list: Job dicts
+    """
+    base = Path(path).parent
+    jobs = []
+    with open(path, encoding="utf-8") as manifest:
+        for line_number, line in enumerate(manifest, start=1):
+            if not line.strip():
+                continue
+            try:
+                job = json.loads(line)
+            except json.JSONDecodeError as e:
+                raise Exception(f"Error in {path} line {line_number}: {str(e)}")
+            if job.get("type") not in JOB_RUNNERS:
+                raise Exception(f"Error in {path} line {line_number}: unknown job type {job.get('type')!r}")
+            job["files"] = [base / file for file in job.get("files", [])]
+            if job["type"] == "spec":
+                job["spec"] = [base / file for file in job.get("spec", [])]
+            job["line"] = f"{path}:{line_number}"
+            jobs.append(job)
+    return jobs
+
+
+def prepare_job(job, defaults):
+    """
+    Validate a job, fill in defaults and derive its id and fingerprint.
+
+    The id depends on the job's inputs and analysis, so a rerun writes the
+    same report file. The fingerprint also covers file sizes, modification
+    times and settings; a recorded job is only skipped while it matches.
+
+    Args:
+        job: Job dict from discover_jobs or load_manifest
+        defaults: dict with "analysis", "instructions" and "settings"
+
+    Returns:
+        dict: The completed job
+    """
+    where = job.get("line", job["files"][0] if job["files"] else "job")
+    low, high = JOB_FILE_COUNTS[job["type"]]
+    if not low <= len(job["files"]) <= high:
+        raise Exception(f"Error in {where}: {job['type']} jobs take {low} to {high} files, got {len(job['files'])}")
+    if job["type"] == "spec" and not job.get("spec"):
+        raise Exception(f"Error in {where}: spec jobs need at least one SPEC file")
+    inputs = job.get("spec", []) + job["files"]
+    missing = [str(path) for path in inputs if not path.is_file()]
+    if missing:
+        raise Exception(f"Error in {where}: missing {', '.join(missing)}")
+
+    analysis = job.get("analysis") or defaults["analysis"] or DEFAULT_ANALYSIS.get(job["type"], "")
+    if job["type"] in ANALYSIS_TYPES and analysis not in ANALYSIS_TYPES[job["type"]]:
+        raise Exception(f"Error in {where}: unknown {job['type']} analysis {analysis!r}")
+    job["analysis"] = analysis
+    job["instructions"] = job.get("instructions", defaults["instructions"]) or ""
+
+    identity = [job["type"], job["analysis"], job["instructions"]] + [str(path.resolve()) for path in inputs]
+    if not job.get("id"):
+        stems = "_vs_".join(path.stem for path in job["files"])[:60]
+        job["id"] = f"{job['type']}-{stems}-{make_cache_key(*identity)[:8]}"
+    job["id"] = UNSAFE_ID_CHARS.sub("_", str(job["id"]))
+
+    stat = [f"{path.stat().st_size}:{path.stat().st_mtime_ns}" for path in inputs]
+    job["fingerprint"] = make_cache_key(*identity, *stat, json.dumps(defaults["settings"], sort_keys=True))
+    return job
+
+
+def completed_jobs(out_dir):
+    """
+    Jobs recorded as complete in the stats file.
+
+    Returns:
+        dict: job id -> fingerprint of its last complete run
+    """
+    completed = {}
+    stats_path = out_dir / STATS_FILE
+    if not stats_path.exists():
+        return completed
+    with open(stats_path, encoding="utf-8") as stats_file:
+        for line in stats_file:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # A line cut short by an interruption
+                continue
+            if record.get("status") == "ok" and (out_dir / record.get("report", "")).is_file():
+                completed[record["id"]] = record["fingerprint"]
+            else:
+                completed.pop(record.get("id"), None)
+    return completed
+
+
+def prefetch_pdfs(jobs, max_workers):
+    """
+    Extract every PDF of the batch into the extraction cache with a worker pool.
+
+    Jobs then read their text from the cache. PDFs are extracted in groups
+    so only a group's bytes are held in memory at once.
+
+    Args:
+        jobs: Jobs to run
+        max_workers: Worker processes
+    """
+    paths = sorted({path for job in jobs for path in job.get("spec", []) + job["files"]
+                    if path.suffix.lower() == ".pdf"})
+    group_size = max_workers * PREFETCH_DOCUMENTS_PER_WORKER
+    started = time.perf_counter()
+    for start in range(0, len(paths), group_size):
+        group = paths[start:start + group_size]
+        documents = [PDFDocument(path.read_bytes(), path.name) for path in group]
+        extract_texts(documents, max_chars=None, max_workers=max_workers)
+        print(f"Extracted {min(start + group_size, len(paths))}/{len(paths)} PDFs", file=sys.stderr)
+    if paths:
+        print(f"PDF extraction took {time.perf_counter() - started:.1f} s", file=sys.stderr)
+
+
+def write_report(out_dir, job_id, report):
+    """Write a report atomically; returns its file name."""
+    lowered = report.lower()
+    name = f"{job_id}.html" if "<html" in lowered or "<!doctype" in lowered else f"{job_id}.md"
+    temporary = out_dir / f".{name}.tmp"
+    temporary.write_text(report, encoding="utf-8")
+    os.replace(temporary, out_dir / name)
+    return name
+
+
+def run_job(job, context, out_dir):
+    """
+    Run one job and write its report.
+
+    Returns:
+        dict: Stats record for the job
+    """
+    client = context.client_for_job()
+    record = {
+        "id": job["id"],
+        "type": job["type"],
+        "files": [str(path) for path in job.get("spec", []) + job["files"]],
+        "analysis": job["analysis"],
+        "model": context.model_id,
+        "started_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+    }
+    started = time.perf_counter()
+    try:
+        report, details = JOB_RUNNERS[job["type"]](job, context, client)
+        record["report"] = write_report(out_dir, job["id"], report)
+        # A job with failed requests is rerun on resume; its finished requests replay from the cache
+        record["status"] = "incomplete" if details.get("failed_batches") else "ok"
+        record.update(details)
+    except Exception as e:
+        record["status"] = "error"
+        record["error"] = str(e) or repr(e)
+    record["seconds"] = round(time.perf_counter() - started, 2)
+    record.update(client.stats())
+    record["fingerprint"] = job["fingerprint"]
+    return record
+
+
+def main():
+    summary, _, details = __doc__.strip().partition("\n")
+    parser = argparse.ArgumentParser(description=summary, epilog=details,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("type", choices=["compare", "spec", "contract", "ifc", "manifest"],
+                        help="Job type of the directories, or manifest for JSON Lines manifest files")
+    parser.add_argument("paths", nargs="+", help="Directories (or files) to process, or manifest files")
+    parser.add_argument("--out", default="batch_reports", help="Directory for reports and stats.jsonl")
+    parser.add_argument("--model", help="LM Studio model ID (default: the first model LM Studio lists)")
+    parser.add_argument("--base-url", default=DEFAULT_BASE_URL, help="LM Studio API base URL")
+    parser.add_argument("--analysis", help="Contract or IFC analysis type, e.g. \"Risk Assessment\"")
+    parser.add_argument("--instructions", default="", help="Custom analysis instructions for every job")
+    parser.add_argument("--parallel", type=int, default=DEFAULT_MAX_CONCURRENCY,
+                        help="LLM requests in flight across all jobs; match LM Studio's parallel slots")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="PDF extraction worker processes")
+    parser.add_argument("--full-text", action="store_true",
+                        help="Send documents in full: no section diffs, boilerplate collapsing, "
+                             "contract passage retrieval or clause matching")
+    parser.add_argument("--whole-document", action="store_true",
+                        help="Check specs in one request per volume instead of requirement by requirement")
+    parser.add_argument("--no-cache", action="store_true", help="Do not replay cached model responses")
+    parser.add_argument("--force", action="store_true", help="Rerun jobs already recorded as complete")
+    args = parser.parse_args()
+
+    # Connection errors from the utils are logged when no Streamlit session is running
+    logging.basicConfig(format="%(message)s")
+
+    try:
+        if args.type == "manifest":
+            jobs = [job for path in args.paths for job in load_manifest(path)]
+        else:
+            jobs = discover_jobs(args.type, args.paths)
+        defaults = {
+            "analysis": args.analysis,
+            "instructions": args.instructions,
+            "settings": {"model": args.model, "full_text": args.full_text, "whole_document": args.whole_document},
+        }
+        jobs = [prepare_job(job, defaults) for job in jobs]
+    except Exception as e:
+        parser.error(str(e))
+
+    # The same inputs listed twice run once
+    jobs = list({job["id"]: job for job in reversed(jobs)}.values())[::-1]
+
+    out_dir = Path(args.out)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    completed = {} if args.force else completed_jobs(out_dir)
+    pending = [job for job in jobs if completed.get(job["id"]) != job["fingerprint"]]
+    print(f"{len(jobs)} jobs, {len(jobs) - len(pending)} already complete, {len(pending)} to run", file=sys.stderr)
+    if not pending:
+        return
+
+    lm_client = LMStudioClient(args.base_url)
+    models = lm_client.get_available_models()
+    if not models:
+        sys.exit(f"Cannot connect to LM Studio at {args.base_url}; start it and load a model")
+    context = BatchContext(lm_client, args.model or models[0], args)
+
+    prefetch_pdfs(pending, args.workers)
+
+    failed = 0
+    with ThreadPoolExecutor(max_workers=args.parallel) as executor, \
+            open(out_dir / STATS_FILE, "a", encoding="utf-8") as stats_file:
+        futures = [executor.submit(run_job, job, context, out_dir) for job in pending]
+        for done, future in enumerate(as_completed(futures), start=1):
+            record = future.result()
+            stats_file.write(json.dumps(record) + "\n")
+            stats_file.flush()
+            failed += record["status"] != "ok"
+            outcome = record.get("error") or record.get("report", "")
+            print(f"[{done}/{len(pending)}] {record['id']}: {record['status']} in {record['seconds']:.1f} s, "
+                  f"{record['llm_calls']} LLM calls, ~{record['prompt_tokens']:,} prompt tokens -> {outcome}",
+                  file=sys.stderr)
+
+    if failed:
+        sys.exit(f"{failed} of {len(pending)} jobs did not complete; rerun the same command to retry them")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+Benchmark serial vs. parallel PDF text extraction.
+
+Usage:
+    python scripts/benchmark_pdf_extraction.py SPEC.pdf [--workers 1 2 4 8 16]
+
+Reports pages/sec for each worker count. The extraction cache is bypassed
+so every run does the full extraction.
+"""
+import argparse
+import os
+import sys
+import time
+from pathlib import Path
+
+# Add parent directory to path for imports
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from utils.pdf_utils import PDFDocument
+
+
+def benchmark(pdf_bytes, worker_counts, repeats):
+    """
+    Time full-document extraction for each worker count.
+
+    Args:
+        pdf_bytes: Raw PDF file contents
+        worker_counts: Iterable of worker process counts (1 = serial)
+        repeats: Runs per worker count; the fastest is reported
+
+    Returns:
+        list: (workers, seconds, pages_per_sec) tuples
+    """
+    page_count = PDFDocument(pdf_bytes).page_count
+    results = []
+    for workers in worker_counts:
+        best = None
+        for _ in range(repeats):
+            # Fresh document each run so no page text is reused
+            document = PDFDocument(pdf_bytes)
+            start = time.perf_counter()
+            document.extract_text(
+                max_chars=None,
+                use_cache=False,
+                parallel=workers > 1,
+                max_workers=workers
+            )
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        results.append((workers, best, page_count / best))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("pdf", help="PDF file to extract")
+    parser.add_argument("--workers", type=int, nargs="+",
+                        default=sorted({1, 2, 4, 8, 16, os.cpu_count() or 1}),
+                        help="Worker counts to benchmark")
+    parser.add_argument("--repeats", type=int, default=3, help="Runs per worker count")
+    args = parser.parse_args()
+
+    pdf_bytes = Path(args.pdf).read_bytes()
+    results = benchmark(pdf_bytes, args.workers, args.repeats)
+
+    print(f"{'workers':>8} {'seconds':>10} {'pages/sec':>10} {'speedup':>8}")
+    baseline = results[0][1]
+    for workers, seconds, pages_per_sec in results:
+        print(f"{workers:>8} {seconds:>10.2f} {pages_per_sec:>10.1f} {baseline / seconds:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
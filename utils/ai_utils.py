@@ -1,190 +1,1000 @@
 """AI integration utilities for LM Studio API."""
+import asyncio
 import requests
 import json
+import logging
+import os
+import threading
+import time
 import streamlit as st
+from pathlib import Path
+from requests.adapters import HTTPAdapter
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+from urllib3.util.retry import Retry
+
+from utils.cache_utils import get_cache, make_cache_key
+from utils.chunked_analysis import CHARS_PER_TOKEN
+from utils.directive_utils import evaluate_directives, render_template
+from utils.spec_utils import REPORT_CSS
+from utils.token_utils import get_model_profile, record_throughput
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BASE_URL = "http://127.0.0.1:1234/v1"
+
+# HTTP statuses LM Studio returns when it is busy or still loading a model
+RETRY_STATUSES = (429, 503)
+
+# Size cap for the LLM response cache (override with AI_PROJECT_LLM_CACHE_MB)
+RESPONSE_CACHE_MAX_BYTES = int(os.environ.get("AI_PROJECT_LLM_CACHE_MB", "256")) * 1024 * 1024
+
+# Characters per chunk when replaying a cached response
+REPLAY_CHUNK_CHARS = 256
+
+# Concurrent requests for the asyncio client; match LM Studio's parallel slots
+DEFAULT_MAX_CONCURRENCY = 4
+
+# Directory holding prompt templates such as "Prompt MATT.txt" (override with AI_PROJECT_PROMPT_DIR)
+PROMPT_DIR = Path(os.environ.get("AI_PROJECT_PROMPT_DIR", Path(__file__).resolve().parent.parent))
+SPEC_TEMPLATE_NAME = os.environ.get("AI_PROJECT_SPEC_TEMPLATE", "Prompt MATT.txt")
+
+# System message sent with every request; kept constant so every prompt shares a cacheable prefix
+DEFAULT_SYSTEM_PROMPT = "You are an expert technical document analyst specializing in proposal comparisons and compliance checking."
+
+# Static instructions placed before the documents, so back-to-back runs share a prompt prefix
+TWO_WAY_INSTRUCTIONS = """Please perform a detailed comparison between the two proposals that follow (PROPOSAL A and PROPOSAL B).
+
+Please analyze these proposals and identify:
+1. Key similarities and differences
+2. Strengths and weaknesses of each proposal
+3. Areas of alignment and divergence
+4. Critical discrepancies or gaps
+5. Recommendations based on the comparison
+
+Generate a comprehensive HTML report with detailed comparison tables."""
+
+THREE_WAY_INSTRUCTIONS = """Please perform a detailed three-way comparison between the proposals that follow (PROPOSAL A, PROPOSAL B and PROPOSAL C).
+
+Please analyze these three proposals and identify:
+1. Key similarities and differences across all three proposals
+2. Strengths and weaknesses of each proposal
+3. Areas where proposals align or diverge
+4. Critical discrepancies or gaps in any proposal
+5. Recommendations based on the comparison
+
+Generate a comprehensive HTML report with detailed comparison tables."""
+
+SECTION_DIFF_INSTRUCTIONS = """Please perform a detailed comparison between the proposals named below.
+
+The proposals were aligned section by section before this request. Sections listed as identical have the same text in every proposal and are not repeated. For every other section you are given its differences as unified diffs ("-" lines are from the first proposal named in the diff header, "+" lines from the other), or its full text when a proposal lacks the section.
+
+Please analyze these proposals and identify:
+1. Key differences, section by section, and what they mean in practice
+2. Strengths and weaknesses of each proposal
+3. Areas of alignment (including the identical sections) and divergence
+4. Critical discrepancies or gaps, including sections missing from a proposal
+5. Recommendations based on the comparison
+
+Generate a comprehensive HTML report with detailed comparison tables."""
+
+CONTRACT_ANALYSIS_PROMPTS = {
+    "Contract Summary": """Provide a comprehensive summary of this contract, including:
+- Main parties involved
+- Purpose and scope of the contract
+- Key terms and conditions
+- Duration and termination clauses
+- Important dates and milestones""",
+
+    "Key Clauses Extraction": """Extract and summarize the key clauses from this contract, including:
+- Payment terms
+- Delivery/Performance obligations
+- Warranties and guarantees
+- Liability and indemnification
+- Termination conditions
+- Dispute resolution""",
+
+    "Obligations & Responsibilities": """Analyze and list the obligations and responsibilities for each party:
+- Party A obligations
+- Party B obligations
+- Mutual obligations
+- Deadlines and milestones
+- Performance standards""",
+
+    "Risk Assessment": """Assess potential risks in this contract:
+- Legal risks
+- Financial risks
+- Operational risks
+- Compliance risks
+- Recommendations for risk mitigation""",
+
+    "Compliance Review": """Review the contract for compliance with standard practices:
+- Missing or unclear terms
+- Unusual or potentially problematic clauses
+- Recommendations for improvement
+- Areas needing legal review""",
+
+    "Custom Analysis": "Analyze this contract and provide insights."
+}
+
+CONTRACT_COMPARISON_INSTRUCTIONS = """Compare these two contracts and identify:
+1. Key differences in terms and conditions
+2. Differences in obligations and responsibilities
+3. Variations in payment terms
+4. Differences in liability and risk allocation
+5. Recommendations on which terms are more favorable"""
+
+IFC_ANALYSIS_PROMPTS = {
+    "General Overview": "Provide a comprehensive overview of this IFC building model, including key information about the structure, components, and systems.",
+    "Material Analysis": "Analyze the materials specified in this IFC model. List all materials, their properties, and where they are used in the building.",
+    "Structural Components": "Analyze the structural components in this IFC model. Identify beams, columns, walls, floors, and their specifications.",
+    "Building Systems": "Analyze the building systems (HVAC, electrical, plumbing, etc.) defined in this IFC model.",
+    "Custom Analysis": "Analyze this IFC model and provide insights."
+}
+
+IFC_REVISION_INSTRUCTIONS = """Two revisions of the same IFC building model have been compared locally by element GlobalId. Below is only the delta between them, not the models.
+
+Explain what changed between the revisions: summarize the scope of the changes, group related changes (by element type, storey or system where possible), call out changes with design, cost or schedule impact, and note anything that looks unintended."""
+
+# Templates read from PROMPT_DIR, kept for the life of the process
+_templates = {}
+_templates_lock = threading.Lock()
+
+# Marks the end of a stream pumped from a worker thread
+_STREAM_END = object()
+
+
+def _is_valid(text, validate):
+    """Whether a response passes an optional validate callable (see analyze_documents)."""
+    if validate is None:
+        return True
+    try:
+        validate(text)
+    except ValueError:
+        return False
+    return True
+
+
+def _abort_response(response):
+    """Close a streaming HTTP response from another thread, unblocking its reader."""
+    try:
+        # Wakes a read blocked on the socket; refused once the connection is back in the pool
+        response.raw.shutdown()
+    except (AttributeError, ValueError, RuntimeError):
+        pass
+    response.close()
+
+
+class CircuitBreaker:
+    """
+    Fail fast while a server is known to be down.
+
+    After failure_threshold consecutive failures the breaker opens and
+    allow_request() returns False. Once reset_timeout seconds have passed,
+    a single probe request is allowed through; its outcome closes the
+    breaker again or restarts the timeout.
+    """
+
+    def __init__(self, failure_threshold=2, reset_timeout=30):
+        """
+        Initialize the circuit breaker.
+
+        Args:
+            failure_threshold: Consecutive failures before opening
+            reset_timeout: Seconds to stay open before allowing a probe
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at = None
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self):
+        """Whether requests are currently being short-circuited."""
+        with self._lock:
+            return self._opened_at is not None
+
+    def allow_request(self):
+        """
+        Check whether a request may be sent now.
+
+        Returns:
+            bool: True if closed, or if open and due for a probe
+        """
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if time.monotonic() - self._opened_at >= self.reset_timeout:
+                # Let one probe through; push the next probe out by a full timeout
+                self._opened_at = time.monotonic()
+                return True
+            return False
+
+    def record_success(self):
+        """Close the breaker after a successful request."""
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+
+    def record_failure(self):
+        """Count a failed request, opening the breaker at the threshold."""
+        with self._lock:
+            self._failures += 1
+            if self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
 
 
 class LMStudioClient:
-    """Client for interacting with LM Studio API."""
+    """
+    Client for interacting with LM Studio API.
+
+    Requests go through a pooled keep-alive session, so one client can be
+    shared across pages and threads (see get_lm_client). Connection errors
+    and 429/503 responses are retried with jittered exponential backoff.
+    The model list is cached and refreshed in the background, and a
+    circuit breaker makes calls fail fast while LM Studio is down.
+    """
 
-    def __init__(self, base_url="http://127.0.0.1:1234/v1"):
-        """Initialize the LM Studio client."""
+    def __init__(self, base_url=DEFAULT_BASE_URL, pool_size=8, max_retries=3, backoff_factor=0.5,
+                 models_ttl=60, breaker_reset_timeout=30):
+        """
+        Initialize the LM Studio client.
+
+        Args:
+            base_url: LM Studio OpenAI-compatible API base URL
+            pool_size: Maximum number of pooled keep-alive connections
+            max_retries: Retries for connection errors and 429/503 responses
+            backoff_factor: Base delay in seconds for exponential backoff
+            models_ttl: Seconds before the cached model list is refreshed
+            breaker_reset_timeout: Seconds to fail fast after LM Studio is
+                found to be down
+        """
         self.base_url = base_url
         self.models_endpoint = f"{base_url}/models"
         self.chat_endpoint = f"{base_url}/chat/completions"
+        self.completions_endpoint = f"{base_url}/completions"
+        # LM Studio's native REST API reports per-model context lengths
+        self.native_models_endpoint = f"{base_url.rstrip('/').removesuffix('/v1')}/api/v0/models"
+        self.models_ttl = models_ttl
+        self.breaker = CircuitBreaker(reset_timeout=breaker_reset_timeout)
+
+        self._models = None
+        self._models_fetched_at = 0.0
+        self._models_attempted = False
+        self._models_lock = threading.Lock()
+        self._refresh_thread = None
+        self._context_lengths = {}
+
+        retry = Retry(
+            total=max_retries,
+            connect=max_retries,
+            # Never re-send a request the server may already be generating for
+            read=0,
+            status=max_retries,
+            status_forcelist=RETRY_STATUSES,
+            allowed_methods=None,
+            backoff_factor=backoff_factor,
+            backoff_jitter=backoff_factor,
+            respect_retry_after_header=True,
+            raise_on_status=False
+        )
+        adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=pool_size,
+            pool_block=True,
+            max_retries=retry
+        )
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        # Model list probes skip retries; the circuit breaker handles outages
+        self._probe_session = requests.Session()
+        self._probe_session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=1))
+        self._probe_session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=1))
 
     def get_available_models(self):
         """
         Get list of available models from LM Studio.
 
+        Only the first call waits on the server. Afterwards the cached list
+        is returned immediately, and a stale list is refreshed in a
+        background thread.
+
         Returns:
             list: List of available model IDs
         """
+        with self._models_lock:
+            models = self._models
+            age = time.monotonic() - self._models_fetched_at
+            attempted = self._models_attempted
+
+        if models is not None and age < self.models_ttl:
+            return list(models)
+
+        if attempted:
+            self._refresh_models_async()
+            return list(models or [])
+
         try:
-            response = requests.get(self.models_endpoint, timeout=5)
-            response.raise_for_status()
-            models_data = response.json()
-            return [model["id"] for model in models_data.get("data", [])]
+            return list(self._refresh_models())
         except requests.exceptions.RequestException as e:
-            st.error(f"Error connecting to LM Studio: {str(e)}")
+            if get_script_run_ctx(suppress_warning=True) is None:
+                # Not in a Streamlit session (e.g. scripts/batch_analyze.py)
+                logger.error("Error connecting to LM Studio: %s", e)
+            else:
+                st.error(f"Error connecting to LM Studio: {str(e)}")
             return []
 
-    def analyze_documents(self, prompt, model_id=None, stream=True):
+    def _refresh_models(self):
+        """Fetch the model list and update the cache."""
+        with self._models_lock:
+            self._models_attempted = True
+
+        if not self.breaker.allow_request():
+            raise requests.exceptions.ConnectionError("LM Studio is unavailable (circuit open)")
+
+        try:
+            response = self._probe_session.get(self.models_endpoint, timeout=5)
+            response.raise_for_status()
+            models_data = response.json()
+        except requests.exceptions.RequestException:
+            self.breaker.record_failure()
+            with self._models_lock:
+                # Drop the stale list once the server is known to be down
+                if self.breaker.is_open:
+                    self._models = None
+            raise
+
+        self.breaker.record_success()
+        models = [model["id"] for model in models_data.get("data", [])]
+        with self._models_lock:
+            self._models = models
+            self._models_fetched_at = time.monotonic()
+        return models
+
+    def _refresh_models_async(self):
+        """Start a background model list refresh unless one is running."""
+        with self._models_lock:
+            if self._refresh_thread is not None and self._refresh_thread.is_alive():
+                return
+            self._refresh_thread = threading.Thread(target=self._refresh_models_quietly, daemon=True)
+            self._refresh_thread.start()
+
+    def _refresh_models_quietly(self):
+        try:
+            self._refresh_models()
+        except requests.exceptions.RequestException:
+            pass
+
+    def get_model_context_length(self, model_id):
+        """
+        Get the context window of a model from LM Studio's native API.
+
+        Args:
+            model_id: The model ID
+
+        Failed lookups (older LM Studio versions without the native API,
+        timeouts) are cached like successful ones, so a page rerun does not
+        wait on the server again until models_ttl has passed.
+
+        Returns:
+            int: Loaded (or maximum) context length, or None if unavailable
+        """
+        with self._models_lock:
+            cached = self._context_lengths.get(model_id)
+        if cached is not None and time.monotonic() - cached[1] < self.models_ttl:
+            return cached[0]
+        if not model_id or self.breaker.is_open:
+            return None
+
+        try:
+            response = self._probe_session.get(f"{self.native_models_endpoint}/{model_id}", timeout=2)
+            response.raise_for_status()
+            data = response.json()
+        except (requests.exceptions.RequestException, ValueError):
+            data = {}
+
+        context_length = data.get("loaded_context_length") or data.get("max_context_length")
+        with self._models_lock:
+            self._context_lengths[model_id] = (context_length, time.monotonic())
+        return context_length
+
+    def count_prompt_tokens(self, text, model_id=None):
+        """
+        Count tokens with the loaded model's tokenizer.
+
+        Sends a one-token completion request and reads the prompt token
+        count from the usage statistics.
+
+        Args:
+            text: Text to tokenize
+            model_id: The model ID to use (optional)
+
+        Returns:
+            int: Token count, or None if LM Studio did not report usage
+        """
+        if not self.breaker.allow_request():
+            return None
+
+        payload = {"prompt": text, "max_tokens": 1, "temperature": 0, "stream": False}
+        if model_id:
+            payload["model"] = model_id
+        try:
+            response = self.session.post(self.completions_endpoint, json=payload, timeout=120)
+            response.raise_for_status()
+            # This may be the breaker's half-open probe; its outcome must be recorded
+            self.breaker.record_success()
+            return response.json().get("usage", {}).get("prompt_tokens") or None
+        except requests.exceptions.ConnectionError:
+            self.breaker.record_failure()
+            return None
+        except (requests.exceptions.RequestException, ValueError):
+            return None
+
+    def analyze_documents(self, prompt, model_id=None, stream=True, max_tokens=-1, use_cache=True,
+                          system_prompt=DEFAULT_SYSTEM_PROMPT, on_response=None, validate=None):
         """
         Send a prompt to LM Studio for analysis.
 
+        Streamed runs are timed, and the measured throughput is stored in
+        the model profile for runtime prediction (see utils.token_utils).
+        Completed responses are cached on disk keyed on the model, messages
+        and sampling settings; a cache hit is replayed as a stream.
+
         Args:
             prompt: The prompt to send
             model_id: The model ID to use (optional)
             stream: Whether to stream the response
+            max_tokens: Maximum tokens to generate (-1 for no limit)
+            use_cache: Whether to replay and store cached responses
+            system_prompt: System message; keep it constant across requests
+                so LM Studio can reuse the cached prompt prefix
+            on_response: Optional callback(response) with the HTTP response once
+                the request is sent, so another thread can abort it
+            validate: Optional callable(text) raising ValueError for a response
+                the caller cannot use; such a response is neither stored in
+                nor replayed from the cache
 
         Yields:
             str: Response chunks if streaming, full response otherwise
         """
+        messages = [
+            {
+                "role": "system",
+                "content": system_prompt
+            },
+            {
+                "role": "user",
+                "content": prompt
+            }
+        ]
+        temperature = 0.7
+
+        cache = get_cache("llm_responses", RESPONSE_CACHE_MAX_BYTES)
+        cache_key = make_cache_key(
+            model_id or "",
+            json.dumps(messages, sort_keys=True),
+            f"temperature={temperature}",
+            f"max_tokens={max_tokens}"
+        )
+        if use_cache and stream:
+            cached = cache.get(cache_key)
+            text = cached.decode("utf-8") if cached is not None else None
+            if text is not None and _is_valid(text, validate):
+                for start in range(0, len(text), REPLAY_CHUNK_CHARS):
+                    yield text[start:start + REPLAY_CHUNK_CHARS]
+                return
+
+        if not self.breaker.allow_request():
+            raise Exception("Error communicating with LM Studio: server is unavailable, retrying shortly")
+
         try:
             payload = {
-                "messages": [
-                    {
-                        "role": "system",
-                        "content": "You are an expert technical document analyst specializing in proposal comparisons and compliance checking."
-                    },
-                    {
-                        "role": "user",
-                        "content": prompt
-                    }
-                ],
-                "temperature": 0.7,
-                "max_tokens": -1,
+                "messages": messages,
+                "temperature": temperature,
+                "max_tokens": max_tokens,
                 "stream": stream
             }
 
             if model_id:
                 payload["model"] = model_id
 
-            response = requests.post(
+            started_at = time.monotonic()
+            response = self.session.post(
                 self.chat_endpoint,
                 json=payload,
                 stream=stream,
                 timeout=300
             )
+            if on_response:
+                on_response(response)
             response.raise_for_status()
+            self.breaker.record_success()
 
             if stream:
+                first_token_at = None
+                completion_tokens = 0
+                parts = []
+                finish_reason = None
+                finished = False
                 for line in response.iter_lines():
                     if line:
                         line_text = line.decode('utf-8')
                         if line_text.startswith('data: '):
                             data_text = line_text[6:]
                             if data_text.strip() == '[DONE]':
+                                finished = True
                                 break
                             try:
                                 data = json.loads(data_text)
                                 if 'choices' in data and len(data['choices']) > 0:
+                                    finish_reason = data['choices'][0].get('finish_reason') or finish_reason
                                     delta = data['choices'][0].get('delta', {})
                                     content = delta.get('content', '')
                                     if content:
+                                        if first_token_at is None:
+                                            first_token_at = time.monotonic()
+                                        # LM Studio streams about one token per delta
+                                        completion_tokens += 1
+                                        parts.append(content)
                                         yield content
                             except json.JSONDecodeError:
                                 continue
+
+                if first_token_at is not None:
+                    chars_per_token = get_model_profile(model_id).get("chars_per_token", CHARS_PER_TOKEN)
+                    record_throughput(
+                        model_id,
+                        prompt_tokens=len(prompt) / chars_per_token,
+                        prompt_seconds=first_token_at - started_at,
+                        completion_tokens=completion_tokens,
+                        generation_seconds=time.monotonic() - first_token_at
+                    )
+                    # Only cache answers the model finished: not streams that closed
+                    # early, hit max_tokens ("length") or ended in an error
+                    text = "".join(parts)
+                    if use_cache and finished and finish_reason == "stop" and _is_valid(text, validate):
+                        cache.set(cache_key, text.encode("utf-8"))
             else:
                 data = response.json()
                 if 'choices' in data and len(data['choices']) > 0:
                     return data['choices'][0]['message']['content']
                 return ""
 
+        except requests.exceptions.ConnectionError as e:
+            self.breaker.record_failure()
+            raise Exception(f"Error communicating with LM Studio: {str(e)}")
         except requests.exceptions.RequestException as e:
             raise Exception(f"Error communicating with LM Studio: {str(e)}")
 
+    def complete(self, prompt, model_id=None, use_cache=True, system_prompt=DEFAULT_SYSTEM_PROMPT):
+        """
+        Send a prompt and wait for the full response.
+
+        Args:
+            prompt: The prompt to send
+            model_id: The model ID to use (optional)
+            use_cache: Whether to replay and store cached responses
+            system_prompt: System message
+
+        Returns:
+            str: The complete response text
+        """
+        return "".join(self.analyze_documents(
+            prompt, model_id, stream=True, use_cache=use_cache, system_prompt=system_prompt
+        ))
+
+
+class AsyncLMStudioClient:
+    """
+    Asyncio client for running several LM Studio requests concurrently.
+
+    Each request streams through the pooled LMStudioClient on its own
+    worker thread, so responses, caching and retries behave exactly like
+    the sync client. A semaphore caps requests in flight and every request
+    has an overall timeout.
+    """
+
+    def __init__(self, client=None, max_concurrency=DEFAULT_MAX_CONCURRENCY, timeout=600):
+        """
+        Initialize the async client.
+
+        Args:
+            client: LMStudioClient to send requests through (default: new client)
+            max_concurrency: Maximum requests in flight at once
+            timeout: Seconds before a single request is abandoned
+        """
+        self.client = client or LMStudioClient()
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self._semaphores = {}
+
+    def _semaphore(self):
+        """Concurrency limit for the running event loop."""
+        loop = asyncio.get_running_loop()
+        if loop not in self._semaphores:
+            self._semaphores = {loop: asyncio.Semaphore(self.max_concurrency)}
+        return self._semaphores[loop]
+
+    async def analyze_documents(self, prompt, model_id=None, max_tokens=-1, use_cache=True,
+                                system_prompt=DEFAULT_SYSTEM_PROMPT, validate=None):
+        """
+        Send a prompt to LM Studio and stream the response.
+
+        Args:
+            prompt: The prompt to send
+            model_id: The model ID to use (optional)
+            max_tokens: Maximum tokens to generate (-1 for no limit)
+            use_cache: Whether to replay and store cached responses
+            system_prompt: System message
+            validate: Optional callable(text) raising ValueError for an unusable
+                response, which is then not cached
+
+        Yields:
+            str: Response chunks, as from LMStudioClient.analyze_documents
+        """
+        async with self._semaphore():
+            loop = asyncio.get_running_loop()
+            queue = asyncio.Queue()
+            stop = threading.Event()
+            responses = []
+
+            def pump():
+                stream = self.client.analyze_documents(
+                    prompt, model_id, stream=True, max_tokens=max_tokens, use_cache=use_cache,
+                    system_prompt=system_prompt, on_response=responses.append, validate=validate
+                )
+                try:
+                    for chunk in stream:
+                        if stop.is_set():
+                            break
+                        loop.call_soon_threadsafe(queue.put_nowait, chunk)
+                    item = _STREAM_END
+                except Exception as e:
+                    item = e
+                finally:
+                    stream.close()
+                if not stop.is_set():
+                    loop.call_soon_threadsafe(queue.put_nowait, item)
+
+            threading.Thread(target=pump, daemon=True).start()
+            deadline = loop.time() + self.timeout
+            finished = False
+            try:
+                while True:
+                    remaining = max(0, deadline - loop.time())
+                    try:
+                        item = await asyncio.wait_for(queue.get(), timeout=remaining)
+                    except asyncio.TimeoutError:
+                        raise Exception(f"Error communicating with LM Studio: request timed out after {self.timeout} s")
+                    if item is _STREAM_END:
+                        finished = True
+                        break
+                    if isinstance(item, Exception):
+                        finished = True
+                        raise item
+                    yield item
+            finally:
+                # Abandoned, failed or timed out: let the worker thread wind down
+                stop.set()
+                if not finished:
+                    # Close the request so LM Studio stops generating before the
+                    # semaphore lets another request in
+                    for response in responses:
+                        _abort_response(response)
+
+    async def complete(self, prompt, model_id=None, max_tokens=-1, use_cache=True,
+                       system_prompt=DEFAULT_SYSTEM_PROMPT, validate=None):
+        """
+        Send a prompt and wait for the full response.
+
+        Args:
+            prompt: The prompt to send
+            model_id: The model ID to use (optional)
+            max_tokens: Maximum tokens to generate (-1 for no limit)
+            use_cache: Whether to replay and store cached responses
+            system_prompt: System message
+            validate: Optional callable(text) raising ValueError for an unusable
+                response, which is then not cached
+
+        Returns:
+            str: The complete response text
+        """
+        parts = []
+        async for chunk in self.analyze_documents(prompt, model_id, max_tokens=max_tokens, use_cache=use_cache,
+                                                  system_prompt=system_prompt, validate=validate):
+            parts.append(chunk)
+        return "".join(parts)
+
+    async def gather(self, prompts, model_id=None, max_tokens=-1, use_cache=True,
+                     return_exceptions=False, on_result=None, validate=None):
+        """
+        Run several prompts concurrently.
+
+        Args:
+            prompts: List of prompts
+            model_id: The model ID to use (optional)
+            max_tokens: Maximum tokens to generate per request, or a list with
+                one limit per prompt
+            use_cache: Whether to replay and store cached responses
+            return_exceptions: Return failures in the result list instead of raising
+            on_result: Optional callback(index, result) as each request finishes
+            validate: Optional callable(text) raising ValueError for a response
+                that must not be cached, or a list with one per prompt
+
+        Returns:
+            list: Responses (or exceptions) in the same order as prompts
+        """
+        limits = max_tokens if isinstance(max_tokens, (list, tuple)) else [max_tokens] * len(prompts)
+        validators = validate if isinstance(validate, (list, tuple)) else [validate] * len(prompts)
+
+        async def run(index, prompt):
+            try:
+                result = await self.complete(prompt, model_id, max_tokens=limits[index], use_cache=use_cache,
+                                             validate=validators[index])
+            except Exception as e:
+                if not return_exceptions:
+                    raise
+                result = e
+            if on_result:
+                on_result(index, result)
+            return result
+
+        return await asyncio.gather(*(run(index, prompt) for index, prompt in enumerate(prompts)))
+
+    def complete_all(self, prompts, model_id=None, max_tokens=-1, use_cache=True,
+                     return_exceptions=False, on_result=None, validate=None):
+        """
+        Run several prompts concurrently from synchronous code (e.g. a Streamlit page).
+
+        Args:
+            prompts: List of prompts
+            model_id: The model ID to use (optional)
+            max_tokens: Maximum tokens to generate per request, or a list with
+                one limit per prompt
+            use_cache: Whether to replay and store cached responses
+            return_exceptions: Return failures in the result list instead of raising
+            on_result: Optional callback(index, result) as each request finishes;
+                called on the caller's thread
+            validate: Optional callable(text) raising ValueError for a response
+                that must not be cached, or a list with one per prompt
 
-def create_comparison_prompt(doc_a_text, doc_b_text, doc_c_text=None, custom_instructions=""):
+        Returns:
+            list: Responses (or exceptions) in the same order as prompts
+        """
+        return asyncio.run(self.gather(
+            prompts,
+            model_id,
+            max_tokens=max_tokens,
+            use_cache=use_cache,
+            return_exceptions=return_exceptions,
+            on_result=on_result,
+            validate=validate
+        ))
+
+
+@st.cache_resource
+def get_lm_client(base_url=DEFAULT_BASE_URL):
+    """
+    Get the process-wide LM Studio client for a server.
+
+    Args:
+        base_url: LM Studio OpenAI-compatible API base URL
+
+    Returns:
+        LMStudioClient: Shared client with a pooled connection session
+    """
+    return LMStudioClient(base_url)
+
+
+def load_template(name):
+    """
+    Load a prompt template from PROMPT_DIR, reading it only once per process.
+
+    Args:
+        name: Template file name (e.g. SPEC_TEMPLATE_NAME)
+
+    Returns:
+        str: Template text, or "" if the file cannot be read
+    """
+    with _templates_lock:
+        if name not in _templates:
+            try:
+                _templates[name] = (PROMPT_DIR / name).read_text(encoding="utf-8")
+            except OSError:
+                _templates[name] = ""
+        return _templates[name]
+
+
+def _custom_section(custom_instructions):
+    return f"\n\nADDITIONAL INSTRUCTIONS:\n{custom_instructions}" if custom_instructions else ""
+
+
+def create_comparison_prompt(doc_a_text, doc_b_text, doc_c_text=None, custom_instructions="", shared_text=""):
     """
     Create a prompt for document comparison.
 
+    The instructions come first and never change between runs, so LM
+    Studio can reuse its cached prefix; documents and custom instructions
+    follow.
+
     Args:
         doc_a_text: Text from document A
         doc_b_text: Text from document B
         doc_c_text: Text from document C (optional, for 3-way comparison)
         custom_instructions: Custom analysis instructions
+        shared_text: Boilerplate collapsed out of the documents (optional,
+            from collapse_boilerplate)
 
     Returns:
         str: Formatted prompt for AI analysis
     """
+    shared_section = ""
+    if shared_text:
+        shared_section = f"""SHARED TEXT (paragraphs repeated across the proposals, given once; each proposal shows [Shared text S<n>] where one appears, with any wording differences as [-shared wording-] {{+this proposal's wording+}}):
+{shared_text}
+
+"""
+
     if doc_c_text:
         # Three-way comparison
-        prompt = f"""Please perform a detailed three-way comparison between the following proposals:
+        prompt = f"""{THREE_WAY_INSTRUCTIONS}
 
-PROPOSAL A:
+{shared_section}PROPOSAL A:
 {doc_a_text}
 
 PROPOSAL B:
 {doc_b_text}
 
 PROPOSAL C:
-{doc_c_text}
-
-{custom_instructions if custom_instructions else ''}
-
-Please analyze these three proposals and identify:
-1. Key similarities and differences across all three proposals
-2. Strengths and weaknesses of each proposal
-3. Areas where proposals align or diverge
-4. Critical discrepancies or gaps in any proposal
-5. Recommendations based on the comparison
-
-Generate a comprehensive HTML report with detailed comparison tables."""
+{doc_c_text}{_custom_section(custom_instructions)}"""
     else:
         # Two-way comparison
-        prompt = f"""Please perform a detailed comparison between the following two proposals:
+        prompt = f"""{TWO_WAY_INSTRUCTIONS}
 
-PROPOSAL A:
+{shared_section}PROPOSAL A:
 {doc_a_text}
 
 PROPOSAL B:
-{doc_b_text}
+{doc_b_text}{_custom_section(custom_instructions)}"""
 
-{custom_instructions if custom_instructions else ''}
+    return prompt
 
-Please analyze these proposals and identify:
-1. Key similarities and differences
-2. Strengths and weaknesses of each proposal
-3. Areas of alignment and divergence
-4. Critical discrepancies or gaps
-5. Recommendations based on the comparison
 
-Generate a comprehensive HTML report with detailed comparison tables."""
+def create_section_diff_prompt(section_differences, labels, custom_instructions=""):
+    """
+    Create a prompt for comparing proposals from their section-aligned differences.
+
+    Args:
+        section_differences: Output of section_diff_to_text
+        labels: Proposal labels, in order (two or three)
+        custom_instructions: Custom analysis instructions
+
+    Returns:
+        str: Formatted prompt for AI analysis
+    """
+    names = ", ".join(labels[:-1]) + f" and {labels[-1]}"
+    prompt = f"""{SECTION_DIFF_INSTRUCTIONS}
+
+PROPOSALS: {names}
+
+SECTION DIFFERENCES:
+{section_differences}{_custom_section(custom_instructions)}"""
 
     return prompt
 
 
-def create_spec_comparison_prompt(spec_text, proposal_text, custom_instructions=""):
+def create_spec_comparison_prompt(spec_text, proposal_text, custom_instructions="", directives=None):
     """
     Create a prompt for spec vs proposal comparison.
 
+    Template sections whose directive does not apply are left out; they
+    all sit at the end of the template, so the instructions before them
+    are the same for every document pair and stay in LM Studio's prompt
+    cache. The report CSS is inserted from REPORT_CSS.
+
     Args:
         spec_text: Text from specification document
         proposal_text: Text from proposal document
         custom_instructions: Custom analysis instructions
+        directives: Result of evaluate_directives (default: evaluated on
+            spec_text and proposal_text). Evaluate on the full documents
+            when they may be condensed before the prompt is built.
 
     Returns:
         str: Formatted prompt for AI analysis
     """
-    # Read the detailed analysis instructions
-    try:
-        with open('/home/user/AI-Project/Prompt MATT.txt', 'r') as f:
-            analysis_template = f.read()
-    except:
-        analysis_template = ""
+    if directives is None:
+        directives = evaluate_directives(spec_text, proposal_text)
+    template = render_template(load_template(SPEC_TEMPLATE_NAME), directives, {"report_css": REPORT_CSS})
+    prompt = f"""{template}
 
-    prompt = f"""{analysis_template}
+Please generate a complete HTML report following the exact template and format specified in the instructions above.
 
 SPECIFICATION Document (SPEC):
 {spec_text}
 
 PROPOSAL Document:
-{proposal_text}
+{proposal_text}{_custom_section(custom_instructions)}"""
 
-{custom_instructions if custom_instructions else ''}
+    return prompt
 
-Please generate a complete HTML report following the exact template and format specified in the instructions above."""
 
-    return prompt
+def create_contract_prompt(analysis_type, contract_label, contract_content, custom_instructions=""):
+    """
+    Create a prompt for a single-contract analysis.
+
+    Args:
+        analysis_type: Key of CONTRACT_ANALYSIS_PROMPTS
+        contract_label: Heading for the contract text (full text or excerpts)
+        contract_content: Contract text or retrieved passages
+        custom_instructions: Custom instructions, used only for Custom Analysis
+
+    Returns:
+        str: Formatted prompt for AI analysis
+    """
+    custom_section = _custom_section(custom_instructions) if analysis_type == "Custom Analysis" else ""
+    return f"""{CONTRACT_ANALYSIS_PROMPTS[analysis_type]}
+
+{contract_label}:
+{contract_content}{custom_section}
+
+Please provide a detailed, structured analysis."""
+
+
+def create_contract_comparison_prompt(contracts_content):
+    """
+    Create a prompt comparing two contracts.
+
+    Args:
+        contracts_content: Both contracts in full, or their clause comparison
+
+    Returns:
+        str: Formatted prompt for AI analysis
+    """
+    return f"""{CONTRACT_COMPARISON_INSTRUCTIONS}
+
+{contracts_content}
+
+Provide a detailed comparison in a structured format."""
+
+
+def create_ifc_prompt(analysis_type, model_data, custom_instructions=""):
+    """
+    Create a prompt for a single IFC model analysis.
+
+    Args:
+        analysis_type: Key of IFC_ANALYSIS_PROMPTS
+        model_data: Takeoff tables (from takeoff_to_text) or raw IFC data section
+        custom_instructions: Custom instructions, used only for Custom Analysis
+
+    Returns:
+        str: Formatted prompt for AI analysis
+    """
+    custom_section = _custom_section(custom_instructions) if analysis_type == "Custom Analysis" else ""
+    return f"""{IFC_ANALYSIS_PROMPTS[analysis_type]}
+
+{model_data}{custom_section}
+
+Please provide a detailed analysis in a clear, structured format."""
+
+
+def create_ifc_revision_prompt(revision_delta, custom_instructions=""):
+    """
+    Create a prompt explaining the changes between two IFC revisions.
+
+    Args:
+        revision_delta: Output of diff_to_text
+        custom_instructions: Custom analysis instructions
+
+    Returns:
+        str: Formatted prompt for AI analysis
+    """
+    return f"""{IFC_REVISION_INSTRUCTIONS}
+
+REVISION DELTA:
+{revision_delta}{_custom_section(custom_instructions)}
+
+Please provide a detailed analysis in a clear, structured format."""
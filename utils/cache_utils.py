@@ -0,0 +1,175 @@
+"""Disk-backed, size-capped LRU cache shared by all pages and sessions."""
+import hashlib
+import os
+import tempfile
+import threading
+from pathlib import Path
+
+
+# Root directory for all on-disk caches (override with AI_PROJECT_CACHE_DIR)
+CACHE_ROOT = Path(os.environ.get(
+    "AI_PROJECT_CACHE_DIR",
+    Path.home() / ".cache" / "hunter-ai-analysis"
+))
+
+
+def make_cache_key(*parts):
+    """
+    Build a content-addressed cache key.
+
+    Args:
+        *parts: bytes or str values that together identify the cached item
+
+    Returns:
+        str: Hex SHA-256 digest of all parts
+    """
+    digest = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, str):
+            part = part.encode("utf-8")
+        # Length-prefix each part so ("ab", "c") and ("a", "bc") differ
+        digest.update(len(part).to_bytes(8, "big"))
+        digest.update(part)
+    return digest.hexdigest()
+
+
+class DiskCache:
+    """
+    A directory of cache entries with a total size cap and LRU eviction.
+
+    Entries are stored as one file per key. Reads refresh the file's mtime,
+    so eviction removes the least recently used entries first. Writes go
+    through a temp file and an atomic rename, which makes the cache safe
+    to share between Streamlit sessions and processes.
+    """
+
+    def __init__(self, directory, max_bytes):
+        """
+        Initialize the cache.
+
+        Args:
+            directory: Directory to hold cache entries (created if missing)
+            max_bytes: Maximum total size of all entries in bytes
+        """
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._size = None
+
+    def _path(self, key):
+        return self.directory / key[:2] / key
+
+    def get(self, key):
+        """
+        Look up an entry.
+
+        Args:
+            key: Cache key from make_cache_key
+
+        Returns:
+            bytes: The cached value, or None on a miss
+        """
+        path = self._path(key)
+        try:
+            data = path.read_bytes()
+            os.utime(path)
+            return data
+        except OSError:
+            return None
+
+    def set(self, key, value):
+        """
+        Store an entry and evict old entries if over the size cap.
+
+        Args:
+            key: Cache key from make_cache_key
+            value: bytes to store
+        """
+        if len(value) > self.max_bytes:
+            return
+
+        path = self._path(key)
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=".tmp-")
+            with os.fdopen(fd, "wb") as f:
+                f.write(value)
+            os.replace(tmp_path, path)
+        except OSError:
+            # A cache that cannot be written is just a cache miss next time
+            return
+
+        with self._lock:
+            if self._size is None:
+                self._size = self._scan_size()
+            else:
+                self._size += len(value)
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def clear(self):
+        """Remove all entries."""
+        with self._lock:
+            for path in self._entries():
+                try:
+                    path.unlink()
+                except OSError:
+                    pass
+            self._size = 0
+
+    def _entries(self):
+        if not self.directory.exists():
+            return []
+        return [p for p in self.directory.glob("??/*") if not p.name.startswith(".tmp-")]
+
+    def _scan_size(self):
+        total = 0
+        for path in self._entries():
+            try:
+                total += path.stat().st_size
+            except OSError:
+                pass
+        return total
+
+    def _evict(self):
+        """Delete least recently used entries until under the size cap."""
+        entries = []
+        for path in self._entries():
+            try:
+                stat = path.stat()
+                entries.append((stat.st_mtime, stat.st_size, path))
+            except OSError:
+                pass
+        entries.sort()
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                path.unlink()
+                total -= size
+            except OSError:
+                pass
+        self._size = total
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_cache(name, max_bytes):
+    """
+    Get the process-wide cache with the given name.
+
+    Args:
+        name: Subdirectory of CACHE_ROOT for this cache
+        max_bytes: Size cap used when the cache is first created
+
+    Returns:
+        DiskCache: The shared cache instance
+    """
+    with _caches_lock:
+        if name not in _caches:
+            _caches[name] = DiskCache(CACHE_ROOT / name, max_bytes)
+        return _caches[name]
@@ -0,0 +1,290 @@
+"""Map-reduce analysis for documents larger than the model context."""
+import re
+
+
+# Rough characters per token for English technical text
+CHARS_PER_TOKEN = 4
+
+# Context window assumed when the loaded model's is unknown
+DEFAULT_CONTEXT_TOKENS = 16384
+
+# Tokens kept free in the context for the model's answer
+RESPONSE_RESERVE_TOKENS = 4096
+
+# Size of each map-step chunk; small chunks keep per-call latency low
+DEFAULT_CHUNK_TOKENS = 3000
+
+# Smallest answer a map call is allowed; shorter notes lose too much detail
+MIN_NOTE_TOKENS = 64
+
+# Lines that start a new section: "3.2.1 Title", "SECTION 4", "ARTICLE V",
+# "PART 2 - PRODUCTS", "A. Title", or short all-caps headings
+SECTION_HEADING = re.compile(
+    r"^\s*(?:"
+    r"\d+(?:\.\d+)*\.?\s+\S"
+    r"|(?:SECTION|ARTICLE|PART|APPENDIX|EXHIBIT|SCHEDULE)\b"
+    r"|[A-Z]\.\s+[A-Z]"
+    r"|[A-Z][A-Z0-9 ,&/\-]{3,60}$"
+    r")"
+)
+
+MAP_INSTRUCTIONS = """You are condensing one part of a larger document so it can be analyzed later without the original text.
+
+Rewrite the text below as compact notes. Keep every requirement, specification value, quantity, dimension, material, rating, price, date, inclusion, exclusion, obligation and commitment. Keep section numbers, headings and page references exactly as written. Drop only boilerplate, repeated headers and filler. Do not add commentary or conclusions. Keep the notes under about {words} words.
+
+{label} (part {part} of {parts}):
+{text}"""
+
+
+def estimate_tokens(text):
+    """
+    Estimate the number of tokens in a text.
+
+    Args:
+        text: Text to measure
+
+    Returns:
+        int: Approximate token count
+    """
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def allocate_budget(sizes, token_budget, max_document_tokens=None):
+    """
+    Split a token budget between documents without leaving any of it unused.
+
+    Documents smaller than an even share keep their size, and what they
+    leave over is shared between the larger documents.
+
+    Args:
+        sizes: dict of label -> document tokens
+        token_budget: Tokens available for all documents together
+        max_document_tokens: Cap on any one document's share (e.g. when each
+            document goes into a prompt of its own)
+
+    Returns:
+        dict: label -> tokens the document may use
+    """
+    cap = token_budget if max_document_tokens is None else min(token_budget, max_document_tokens)
+    shares = {}
+    remaining = dict(sizes)
+    while remaining:
+        share = max(0, min(cap, token_budget // len(remaining)))
+        fitting = {label: size for label, size in remaining.items() if size <= share}
+        if not fitting:
+            shares.update({label: share for label in remaining})
+            break
+        for label, size in fitting.items():
+            shares[label] = size
+            token_budget -= size
+            del remaining[label]
+    return {label: shares[label] for label in sizes}
+
+
+def _split_blocks(text):
+    """Split text into blocks that each start at a section heading or paragraph break."""
+    blocks = []
+    current = []
+    for line in text.splitlines():
+        starts_block = not line.strip() or SECTION_HEADING.match(line)
+        if starts_block and current:
+            blocks.append("\n".join(current))
+            current = []
+        if line.strip():
+            current.append(line)
+    if current:
+        blocks.append("\n".join(current))
+    return blocks
+
+
+def _split_oversized(block, max_chars):
+    """Split a block that alone exceeds max_chars on line, then character, boundaries."""
+    pieces = []
+    current = ""
+    for line in block.splitlines():
+        while len(line) > max_chars:
+            if current:
+                pieces.append(current)
+                current = ""
+            pieces.append(line[:max_chars])
+            line = line[max_chars:]
+        if current and len(current) + len(line) + 1 > max_chars:
+            pieces.append(current)
+            current = ""
+        current = f"{current}\n{line}" if current else line
+    if current:
+        pieces.append(current)
+    return pieces
+
+
+def split_into_chunks(document, max_tokens=DEFAULT_CHUNK_TOKENS):
+    """
+    Split a document into context-sized chunks without dropping any text.
+
+    Chunks break at page boundaries, section headings and paragraph
+    breaks where possible. A new chunk is started at a page or heading
+    once the current chunk is at least half full, so sections tend to
+    stay together.
+
+    Args:
+        document: Document text, or a list of page texts
+        max_tokens: Maximum estimated tokens per chunk
+
+    Returns:
+        list: Chunk strings, in document order
+    """
+    max_chars = max(1, max_tokens * CHARS_PER_TOKEN)
+    pages = [document] if isinstance(document, str) else list(document)
+
+    chunks = []
+    current = []
+    current_chars = 0
+
+    def flush():
+        nonlocal current, current_chars
+        if current:
+            chunks.append("\n\n".join(current))
+        current = []
+        current_chars = 0
+
+    for page_index, page in enumerate(pages):
+        for block_index, block in enumerate(_split_blocks(page)):
+            is_boundary = (block_index == 0 and page_index > 0) or SECTION_HEADING.match(block)
+            if is_boundary and current_chars >= max_chars // 2:
+                flush()
+
+            for piece in _split_oversized(block, max_chars):
+                if current and current_chars + len(piece) + 2 > max_chars:
+                    flush()
+                current.append(piece)
+                current_chars += len(piece) + 2
+    flush()
+
+    return chunks
+
+
+class MapReduceAnalyzer:
+    """
+    Condense documents that do not fit in one prompt.
+
+    The map step sends every chunk of every document to the model
+    concurrently (bounded by the async client's concurrency limit) and
+    keeps the condensed notes in order. Notes that are still over budget
+    are condensed again, so the final (reduce) prompt can be built with
+    the existing prompt builders.
+    """
+
+    def __init__(self, async_client, model_id, chunk_tokens=DEFAULT_CHUNK_TOKENS,
+                 max_rounds=3, count_tokens=estimate_tokens, use_cache=True):
+        """
+        Initialize the analyzer.
+
+        Args:
+            async_client: AsyncLMStudioClient used for the map step
+            model_id: The model ID to use
+            chunk_tokens: Estimated tokens per map-step chunk
+            max_rounds: Maximum times a document's notes are re-condensed
+            count_tokens: Token counting function (e.g. TokenPlanner.count)
+            use_cache: Whether map calls replay and store cached responses
+        """
+        self.async_client = async_client
+        self.model_id = model_id
+        self.chunk_tokens = chunk_tokens
+        self.max_rounds = max_rounds
+        self.count_tokens = count_tokens
+        self.use_cache = use_cache
+
+    def condense(self, documents, token_budget, on_progress=None, max_document_tokens=None):
+        """
+        Condense documents until together they fit the token budget.
+
+        The budget is split with allocate_budget, so room a short document
+        does not need goes to the long ones. Each map call may answer with
+        at most its chunk's share of the document's budget.
+
+        Args:
+            documents: dict of label -> document text (or list of page texts)
+            token_budget: Estimated tokens available for all documents together
+            on_progress: Optional callback(done, total) after each map call
+            max_document_tokens: Cap on any one document (e.g. when each
+                document goes into a prompt of its own)
+
+        Returns:
+            dict: label -> text that fits the budget (unchanged if it already did)
+
+        Raises:
+            ValueError: If a document is still over its share after max_rounds
+        """
+        texts = {
+            label: document if isinstance(document, str) else "\n".join(document)
+            for label, document in documents.items()
+        }
+        sizes = {label: self.count_tokens(text) for label, text in texts.items()}
+        shares = allocate_budget(sizes, token_budget, max_document_tokens)
+        pending = {label: documents[label] for label in documents if sizes[label] > shares[label]}
+
+        for _ in range(self.max_rounds):
+            if not pending:
+                break
+
+            jobs = []
+            for label, document in pending.items():
+                chunks = split_into_chunks(document, self.chunk_tokens)
+                for index, chunk in enumerate(chunks):
+                    # The notes of all chunks together must fit the document's share
+                    limit = max(MIN_NOTE_TOKENS, shares[label] * self.count_tokens(chunk) // sizes[label])
+                    jobs.append((label, index + 1, len(chunks), chunk, limit))
+
+            prompts = [
+                MAP_INSTRUCTIONS.format(label=label, part=part, parts=parts, text=text, words=limit * 3 // 4)
+                for label, part, parts, text, limit in jobs
+            ]
+            done = 0
+
+            def on_result(index, result):
+                nonlocal done
+                done += 1
+                if on_progress:
+                    on_progress(done, len(jobs))
+
+            responses = self.async_client.complete_all(
+                prompts, self.model_id, max_tokens=[job[4] for job in jobs], use_cache=self.use_cache,
+                on_result=on_result
+            )
+            notes = {label: [] for label in pending}
+            for job, response in zip(jobs, responses):
+                notes[job[0]].append(response)
+
+            for label, parts in notes.items():
+                texts[label] = "\n\n".join(parts)
+                sizes[label] = self.count_tokens(texts[label])
+            shares = allocate_budget(sizes, token_budget, max_document_tokens)
+            pending = {label: texts[label] for label in pending if sizes[label] > shares[label]}
+
+        if pending:
+            # A prompt built from these would not fit the context and fail at run time
+            label = next(iter(pending))
+            raise ValueError(
+                f"{label} is still about {sizes[label]:,} tokens after {self.max_rounds} rounds of condensing, "
+                f"over its {shares[label]:,}-token share of the context; load the model with a larger "
+                f"context or analyze fewer documents at once"
+            )
+
+        return texts
+
+
+def prompt_token_budget(build_prompt, labels, context_tokens=DEFAULT_CONTEXT_TOKENS, count_tokens=estimate_tokens):
+    """
+    Tokens left for document text once a prompt's fixed parts are counted.
+
+    Args:
+        build_prompt: Callable taking a dict of label -> text and returning the prompt
+        labels: Document labels passed to build_prompt
+        context_tokens: Context window of the model
+        count_tokens: Token counting function (e.g. TokenPlanner.count)
+
+    Returns:
+        int: Estimated tokens available for all documents together
+    """
+    overhead = count_tokens(build_prompt({label: "" for label in labels}))
+    return max(0, context_tokens - RESPONSE_RESERVE_TOKENS - overhead)
@@ -0,0 +1,200 @@
+"""Section-aligned diff pre-pass for proposal comparison."""
+import difflib
+import re
+
+from utils.chunked_analysis import SECTION_HEADING
+
+
+# Leading numbering removed from headings before alignment: "3.2", "A.", "SECTION 4 -", "(b)"
+HEADING_NUMBER = re.compile(
+    r"^\s*(?:(?:SECTION|ARTICLE|PART|APPENDIX|EXHIBIT|SCHEDULE)\s+)?"
+    r"(?:\d+(?:\.\d+)*|[A-Z]|[IVXLC]+|\([a-z0-9]+\))?[.):]?\s*[-–—:]?\s*",
+    re.IGNORECASE
+)
+
+NON_WORD = re.compile(r"[^a-z0-9]+")
+
+# Context lines kept around each change in a section diff
+DIFF_CONTEXT_LINES = 1
+
+# Label of text before the first heading
+PREAMBLE = "(Opening text)"
+
+# The pre-pass is used only when it sends at most this share of the full documents
+MAX_DELTA_RATIO = 0.8
+
+
+def heading_key(heading):
+    """
+    Normalize a heading for alignment, ignoring its numbering.
+
+    Args:
+        heading: Heading line
+
+    Returns:
+        str: Lowercase words of the heading ("3.2 Scope of Work" -> "scope of work")
+    """
+    stripped = HEADING_NUMBER.sub("", heading, count=1)
+    key = NON_WORD.sub(" ", stripped.lower()).strip()
+    return key or NON_WORD.sub(" ", heading.lower()).strip()
+
+
+def split_sections(text):
+    """
+    Split a document into sections at its headings.
+
+    Args:
+        text: Document text
+
+    Returns:
+        list: dicts with "heading", "key" and "lines" (whitespace-normalized body lines)
+    """
+    sections = []
+    current = {"heading": PREAMBLE, "key": "", "lines": []}
+    for line in text.splitlines():
+        stripped = line.strip()
+        if not stripped:
+            continue
+        if SECTION_HEADING.match(line) and len(stripped) <= 120:
+            if current["lines"] or current["heading"] != PREAMBLE:
+                sections.append(current)
+            current = {"heading": " ".join(stripped.split()), "key": heading_key(stripped), "lines": []}
+        else:
+            current["lines"].append(" ".join(stripped.split()))
+    if current["lines"] or current["heading"] != PREAMBLE:
+        sections.append(current)
+    return sections
+
+
+def align_sections(documents):
+    """
+    Align the sections of two or three documents by heading.
+
+    The first document sets the order. Each further document is matched
+    against the rows aligned so far with difflib, so renumbered sections
+    still align and sections missing from a document leave a gap.
+
+    Args:
+        documents: dict of label -> document text, in comparison order
+
+    Returns:
+        list: Rows, each a dict with "key", "heading" and "sections"
+            (label -> section dict, absent where the document lacks it)
+    """
+    rows = []
+    for label, text in documents.items():
+        sections = split_sections(text)
+        matcher = difflib.SequenceMatcher(
+            None, [row["key"] for row in rows], [section["key"] for section in sections], autojunk=False
+        )
+        merged = []
+        for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+            if tag == "equal":
+                for row, section in zip(rows[i1:i2], sections[j1:j2]):
+                    row["sections"][label] = section
+                    merged.append(row)
+                continue
+            merged.extend(rows[i1:i2])
+            for section in sections[j1:j2]:
+                merged.append({"key": section["key"], "heading": section["heading"], "sections": {label: section}})
+        rows = merged
+    return rows
+
+
+def diff_sections(documents, context=DIFF_CONTEXT_LINES):
+    """
+    Align documents by section and diff each aligned section.
+
+    Args:
+        documents: dict of label -> document text (two or three documents)
+        context: Context lines around each change
+
+    Returns:
+        dict: "labels", "identical" (headings present and equal in all
+            documents) and "differing" (rows with "heading", "present",
+            "missing", "groups" of labels with equal text, "base" lines of
+            the first variant, "diffs" of each other variant against it and
+            "rewritten" when a diff was replaced by the variant's text)
+    """
+    labels = list(documents)
+    identical = []
+    differing = []
+    for row in align_sections(documents):
+        present = [label for label in labels if label in row["sections"]]
+        variants = {}
+        for label in present:
+            variants.setdefault(tuple(row["sections"][label]["lines"]), []).append(label)
+
+        if len(present) == len(labels) and len(variants) == 1:
+            identical.append(row["heading"])
+            continue
+
+        groups = list(variants.values())
+        base_label = groups[0][0]
+        base_lines = row["sections"][base_label]["lines"]
+        diffs = []
+        rewritten = False
+        for group in groups[1:]:
+            lines = row["sections"][group[0]]["lines"]
+            diff = list(difflib.unified_diff(
+                base_lines, lines, fromfile=base_label, tofile=" = ".join(group), n=context, lineterm=""
+            ))
+            # A diff longer than the text itself says nothing the text does not
+            if sum(len(line) for line in diff) > sum(len(line) for line in lines):
+                diff = [f"{' = '.join(group)} (rewritten):"] + lines
+                rewritten = True
+            diffs.append(diff)
+
+        differing.append({
+            "heading": row["heading"],
+            "present": present,
+            "missing": [label for label in labels if label not in present],
+            "groups": groups,
+            "base": base_lines,
+            "diffs": diffs,
+            "rewritten": rewritten,
+        })
+
+    return {"labels": labels, "identical": identical, "differing": differing}
+
+
+def section_diff_to_text(result):
+    """
+    Render a section diff for a prompt.
+
+    Identical sections are listed by heading only. Each differing section
+    gives unified diffs of its variants against the first one, plus the
+    first variant's full text when a proposal lacks the section or a
+    variant was rewritten.
+
+    Args:
+        result: Result of diff_sections
+
+    Returns:
+        str: Alignment summary followed by the differing sections
+    """
+    labels = result["labels"]
+    total = len(result["identical"]) + len(result["differing"])
+    lines = [
+        f"ALIGNMENT: {total} sections aligned across {', '.join(labels)}; "
+        f"{len(result['identical'])} identical in all, {len(result['differing'])} differ or are missing."
+    ]
+    if result["identical"]:
+        lines.append("IDENTICAL SECTIONS (same text in every proposal, not repeated): "
+                     + "; ".join(result["identical"]))
+
+    for section in result["differing"]:
+        lines.append("")
+        lines.append(f"=== SECTION: {section['heading']} ===")
+        if section["missing"]:
+            lines.append(f"Only in {', '.join(section['present'])}; missing from {', '.join(section['missing'])}.")
+        if len(section["groups"]) > 1 or len(section["groups"][0]) > 1:
+            lines.append("Same text: " + "; ".join(" = ".join(group) for group in section["groups"]))
+        # Diffs carry their own context; full text only where there is nothing to diff against
+        if section["missing"] or section["rewritten"]:
+            lines.append(f"{' = '.join(section['groups'][0])} text:")
+            lines.extend(section["base"] or ["(heading only)"])
+        for diff in section["diffs"]:
+            lines.append("")
+            lines.extend(diff)
+    return "\n".join(lines)
@@ -0,0 +1,184 @@
+"""Conditional analysis directives for the spec comparison prompts."""
+import re
+
+
+# Directives that apply only to some documents, in template order
+DIRECTIVES = {
+    "welded": "Welded component material assumption",
+    "multi_module": "Multi-module connection verification",
+    "ada": "ADA compliance",
+    "css": "Report CSS",
+}
+
+# Template section markers, each on its own line: "[[if ada]]", "[[if not css]]", "[[end]]"
+CONDITION = re.compile(r"^\s*\[\[if (not )?(\w+)\]\]\s*$")
+END = re.compile(r"^\s*\[\[end\]\]\s*$")
+
+# Text supplied by the caller, on its own line: "[[insert report_css]]"
+INSERT = re.compile(r"^\s*\[\[insert (\w+)\]\]\s*$")
+
+# ADA requirements in the SPEC
+ADA_KEYWORD = re.compile(r"\bADA(?:AG)?\b|Americans with Disabilities|\bANSI\s*A117\.1\b")
+
+# Welds or stainless/carbon steel choices in either document
+WELDED_KEYWORD = re.compile(r"\bweld(?:s|ed|ing|ment)?\b|\bstainless\b", re.IGNORECASE)
+
+# Module quantity field of the proposal ("Total Mod Qty: 3")
+MODULE_QUANTITY = re.compile(r"\bTotal\s+Mod(?:ule)?s?\.?\s+(?:Qty|Quantity)\.?\s*[:=\-]?\s*(\d{1,3})\b", re.IGNORECASE)
+
+# Module counts in running text ("3 modules", "two-module building", "single module")
+NUMBER_WORDS = {
+    "single": 1, "one": 1, "two": 2, "three": 3, "four": 4, "five": 5,
+    "six": 6, "seven": 7, "eight": 8, "nine": 9, "ten": 10,
+}
+MODULE_COUNT = re.compile(
+    r"\b(\d{1,2}|" + "|".join(NUMBER_WORDS) + r")[\s-]+(?:\(\d{1,2}\)[\s-]+)?mod(?:ule)?s?\b",
+    re.IGNORECASE
+)
+
+# Characters of context quoted around a keyword match
+CONTEXT_CHARS = 40
+
+
+def _quote(text, match):
+    """Short excerpt around a match, for the reason of a decision."""
+    start = max(0, match.start() - CONTEXT_CHARS)
+    excerpt = " ".join(text[start:match.end() + CONTEXT_CHARS].split())
+    return f'"...{excerpt}..."'
+
+
+def _module_quantity(proposal_text):
+    """
+    Read the module quantity from the proposal.
+
+    Returns:
+        tuple: (quantity or None if not stated, match it was read from)
+    """
+    matches = list(MODULE_QUANTITY.finditer(proposal_text))
+    if matches:
+        match = max(matches, key=lambda match: int(match.group(1)))
+        return int(match.group(1)), match
+    counts = [
+        (int(word) if word.isdigit() else NUMBER_WORDS[word.lower()], match)
+        for match in MODULE_COUNT.finditer(proposal_text)
+        for word in [match.group(1)]
+    ]
+    if counts:
+        return max(counts, key=lambda count: count[0])
+    return None, None
+
+
+def evaluate_directives(spec_text, proposal_text, local_styles=False):
+    """
+    Decide which conditional directives apply to a SPEC and proposal.
+
+    Triggers are evaluated locally on the extracted text:
+        welded: either document mentions welds or stainless steel
+        multi_module: the proposal states more than one module; included
+            when no module quantity is found, since it cannot be ruled out
+        ada: the SPEC mentions ADA
+        css: the report stylesheet must come from the model (local_styles
+            is False); otherwise it is added to the report afterwards
+
+    Args:
+        spec_text: Text from specification document(s)
+        proposal_text: Text from proposal document
+        local_styles: Whether the caller adds the report CSS itself
+
+    Returns:
+        dict: directive name -> {"title", "included", "reason"}, in DIRECTIVES order
+    """
+    spec_text = spec_text or ""
+    proposal_text = proposal_text or ""
+    decisions = {}
+
+    def decide(name, included, reason):
+        decisions[name] = {"title": DIRECTIVES[name], "included": included, "reason": reason}
+
+    for label, text in (("SPEC", spec_text), ("Proposal", proposal_text)):
+        match = WELDED_KEYWORD.search(text)
+        if match:
+            decide("welded", True, f'{label} mentions "{match.group()}": {_quote(text, match)}')
+            break
+    else:
+        decide("welded", False, "Neither document mentions welds or stainless steel")
+
+    quantity, match = _module_quantity(proposal_text)
+    if quantity is None:
+        decide("multi_module", True, "Proposal module quantity not found; included to be safe")
+    elif quantity > 1:
+        decide("multi_module", True, f"Proposal has {quantity} modules: {_quote(proposal_text, match)}")
+    else:
+        decide("multi_module", False, f"Proposal is a single module: {_quote(proposal_text, match)}")
+
+    match = ADA_KEYWORD.search(spec_text)
+    if match:
+        decide("ada", True, f'SPEC mentions "{match.group()}": {_quote(spec_text, match)}')
+    else:
+        decide("ada", False, "SPEC does not mention ADA")
+
+    if local_styles:
+        decide("css", False, "Report styles are added locally after generation")
+    else:
+        decide("css", True, "The model writes the complete HTML report, styles included")
+
+    return decisions
+
+
+def render_template(template, decisions=None, inserts=None):
+    """
+    Keep the template sections whose trigger applies.
+
+    Lines between "[[if name]]" and "[[end]]" are kept when the directive
+    is included, lines between "[[if not name]]" and "[[end]]" when it is
+    not. Sections may nest. Unknown names count as included, and with no
+    decisions every "[[if name]]" section is kept. An "[[insert name]]"
+    line in a kept section is replaced by inserts[name], or left out when
+    no such text is given.
+
+    Args:
+        template: Template text with section markers
+        decisions: Result of evaluate_directives, or None to include all
+        inserts: dict of name -> text for "[[insert name]]" lines
+
+    Returns:
+        str: Template text without markers or excluded sections
+    """
+    decisions = decisions or {}
+    inserts = inserts or {}
+    kept = []
+    active = []
+    for line in template.split("\n"):
+        match = CONDITION.match(line)
+        insert = INSERT.match(line)
+        if match:
+            included = decisions.get(match.group(2), {"included": True})["included"]
+            active.append(included != bool(match.group(1)))
+        elif END.match(line):
+            if active:
+                active.pop()
+        elif not all(active):
+            continue
+        elif insert:
+            if insert.group(1) in inserts:
+                kept.append(inserts[insert.group(1)])
+        else:
+            kept.append(line)
+    return "\n".join(kept)
+
+
+def format_directive_report(decisions):
+    """
+    List directive decisions as markdown bullet lines.
+
+    Args:
+        decisions: Result of evaluate_directives
+
+    Returns:
+        str: One line per directive, included ones first
+    """
+    ordered = sorted(decisions.values(), key=lambda decision: not decision["included"])
+    return "\n".join(
+        f"- {'Included' if decision['included'] else 'Skipped'}: **{decision['title']}** - {decision['reason']}"
+        for decision in ordered
+    )
@@ -0,0 +1,42 @@
+"""DOCX processing utilities for extracting text from Word files."""
+from io import BytesIO
+
+from docx import Document
+
+from utils.text_utils import DEFAULT_STEPS, normalize_text
+
+
+def read_docx(docx_file, normalize=True):
+    """
+    Extract text from a DOCX file along with the token savings of normalization.
+
+    Args:
+        docx_file: File object from Streamlit file uploader
+        normalize: Normalize unicode, hyphenation and whitespace (see normalize_pages)
+
+    Returns:
+        tuple: (text, report) where report is from normalize_pages, or None
+            if the text was not normalized
+    """
+    try:
+        doc = Document(BytesIO(docx_file.getvalue() if hasattr(docx_file, "getvalue") else docx_file.read()))
+        text = "\n".join([paragraph.text for paragraph in doc.paragraphs])
+        if normalize and DEFAULT_STEPS:
+            return normalize_text(text)
+        return text, None
+    except Exception as e:
+        raise Exception(f"Error extracting text from DOCX: {str(e)}")
+
+
+def extract_text_from_docx(docx_file, normalize=True):
+    """
+    Extract text from a DOCX file.
+
+    Args:
+        docx_file: File object from Streamlit file uploader
+        normalize: Normalize unicode, hyphenation and whitespace (see normalize_pages)
+
+    Returns:
+        str: Extracted text from the document body
+    """
+    return read_docx(docx_file, normalize)[0]
@@ -0,0 +1,431 @@
+"""Revision diff of two IFC models by GlobalId and content hash."""
+import hashlib
+import re
+from collections import Counter
+
+from utils.ifc_utils import GLOBAL_ID_PREFIX_BYTES, EntityRef
+
+
+# References outside quoted strings: group 1 is the instance number
+REFERENCE = re.compile(rb"'(?:[^']|'')*'|#(\d+)")
+
+# References in arguments without quoted strings (points, loops, placements)
+REFERENCE_NUMBER = re.compile(rb"#(\d+)")
+
+# Tokens that decide an argument's position: strings, references (group 1)
+# and punctuation (group 2)
+ARGUMENT_PUNCTUATION = re.compile(rb"'(?:[^']|'')*'|#(\d+)|([(),])")
+
+# Attribute names of IfcRoot / IfcObject / IfcProduct / IfcElement by position
+ROOT_ATTRIBUTES = ["GlobalId", "OwnerHistory", "Name", "Description", "ObjectType",
+                   "ObjectPlacement", "Representation", "Tag"]
+PLACEMENT_POSITION = 5
+REPRESENTATION_POSITION = 6
+
+# Parts of an element compared separately, so a change can be described
+COMPONENTS = ["attributes", "placement", "geometry", "properties", "material", "container", "type"]
+
+# Relationships folded into the elements they relate:
+# type -> (component, related objects position, relating position, hash relating by content)
+RELATIONSHIPS = {
+    "IFCRELDEFINESBYPROPERTIES": ("properties", 4, 5, True),
+    "IFCRELASSOCIATESMATERIAL": ("material", 4, 5, True),
+    "IFCRELCONTAINEDINSPATIALSTRUCTURE": ("container", 4, 5, False),
+    "IFCRELDEFINESBYTYPE": ("type", 4, 5, False),
+}
+
+# Rooted types that describe other elements rather than being diffed themselves
+NON_DIFF_PREFIXES = ("IFCREL", "IFCPROPERTYSET", "IFCELEMENTQUANTITY", "IFCPROPERTYDEFINITION")
+
+# Items of each list rendered into the prompt
+MAX_PROMPT_ITEMS = 150
+
+_EMPTY = b"\0" * 16
+
+
+def _digest(*parts):
+    return hashlib.blake2b(b"\x1f".join(parts), digest_size=16).digest()
+
+
+def _argument_references(raw, positions):
+    """
+    Instance numbers referenced by top-level arguments, without parsing them.
+
+    Args:
+        raw: Argument bytes of an entity
+        positions: Top-level argument positions to read
+
+    Returns:
+        dict: position -> list of instance numbers referenced at that
+            position, directly or inside a list
+    """
+    found = {}
+    last = max(positions)
+    depth = 0
+    position = 0
+    for match in ARGUMENT_PUNCTUATION.finditer(raw):
+        punctuation = match.group(2)
+        if punctuation == b",":
+            if depth == 0:
+                position += 1
+                if position > last:
+                    break
+        elif punctuation == b"(":
+            depth += 1
+        elif punctuation == b")":
+            depth -= 1
+        elif match.group(1) is not None and position in positions:
+            found.setdefault(position, []).append(int(match.group(1)))
+    return found
+
+
+def _split_references(raw):
+    """Split argument bytes into the text with references blanked to "#" and the referenced instance numbers."""
+    if b"'" not in raw:
+        parts = REFERENCE_NUMBER.split(raw)
+        return b"#".join(parts[::2]), parts[1::2]
+    pieces = []
+    numbers = []
+    last = 0
+    for match in REFERENCE.finditer(raw):
+        if match.group(1) is not None:
+            pieces.append(raw[last:match.start()])
+            numbers.append(match.group(1))
+            last = match.end()
+    pieces.append(raw[last:])
+    return b"#".join(pieces), numbers
+
+
+class ContentHasher:
+    """
+    Hash entities by content, independent of instance numbers.
+
+    Instance numbers change between exports, so a reference is hashed as
+    the GlobalId of a rooted entity, or recursively as the content of any
+    other entity (placements, geometry, property values). Owner history
+    (export timestamps) is ignored. A leaf entity (point, direction,
+    value) stands for itself, type and arguments, without hashing.
+
+    Every entity is hashed at most once. hash_all() does it in a single
+    pass in instance-number order; exporters write an entity before the
+    entities that reference it, so references are memo hits and only
+    forward references are looked up.
+    """
+
+    def __init__(self, index):
+        """
+        Initialize the hasher.
+
+        Args:
+            index: IFCIndex of the model
+        """
+        self.index = index
+        # instance number -> reference hash, for every entity reached
+        self._memo = {}
+        # instance number -> content hash of rooted entities (shared property sets)
+        self._rooted = {}
+        self._type_bytes = {}
+
+    def global_id(self, entity_id):
+        """GlobalId bytes of a rooted entity, or None."""
+        raw = self.index.raw_bytes(entity_id)
+        match = GLOBAL_ID_PREFIX_BYTES.match(raw[:32]) if raw else None
+        return match.group(0).strip() if match else None
+
+    def _hash_arguments(self, entity_type, raw, depth):
+        """Hash of an entity's type and arguments, with references replaced by their hashes."""
+        type_bytes = self._type_bytes.get(entity_type)
+        if type_bytes is None:
+            type_bytes = self._type_bytes[entity_type] = entity_type.encode()
+        if b"#" not in raw:
+            return type_bytes + raw
+        if depth > 100:
+            # Cut off deep chains
+            return _digest(type_bytes, raw)
+        text, numbers = _split_references(raw)
+        numbers = list(map(int, numbers))
+        hashes = list(map(self._memo.get, numbers))
+        if None in hashes:
+            # Forward references, not reached yet
+            hashes = [digest or self.reference_hash(number, depth + 1) for digest, number in zip(hashes, numbers)]
+        return _digest(type_bytes, text, *hashes)
+
+    def _reference_digest(self, entity_id, entity_type, raw, depth):
+        """Reference hash of an entity from its record (see reference_hash)."""
+        if entity_type == "IFCOWNERHISTORY":
+            return b"owner"
+        if entity_type in self.index.rooted_types:
+            match = GLOBAL_ID_PREFIX_BYTES.match(raw, 0, 32)
+            if match:
+                return match.group(0).strip()
+        self._memo[entity_id] = b"cycle"
+        return self._hash_arguments(entity_type, raw, depth)
+
+    def hash_all(self):
+        """Compute the reference hash of every entity in one pass over the model."""
+        memo = self._memo
+        for entity_id, entity_type, raw in self.index.records():
+            if entity_id not in memo:
+                memo[entity_id] = self._reference_digest(entity_id, entity_type, raw, 0)
+
+    def reference_hash(self, entity_id, depth=0):
+        """Hash standing in for a reference to an entity."""
+        digest = self._memo.get(entity_id)
+        if digest is not None:
+            return digest
+        record = self.index.record(entity_id)
+        if record is None:
+            return b"missing"
+        digest = self._memo[entity_id] = self._reference_digest(entity_id, *record, depth)
+        return digest
+
+    def content_hash(self, entity_id, depth=0):
+        """
+        Hash an entity's type and attributes, following references.
+
+        Args:
+            entity_id: Instance number
+            depth: Current reference depth (deep chains are cut off)
+
+        Returns:
+            bytes: Digest (or, for a leaf entity, its type and arguments)
+        """
+        if entity_id in self._rooted:
+            return self._rooted[entity_id]
+        record = self.index.record(entity_id)
+        if record is None:
+            return b"missing"
+        if record[0] not in self.index.rooted_types:
+            return self.reference_hash(entity_id, depth)
+        self._rooted[entity_id] = b"cycle"
+        digest = self._rooted[entity_id] = self._hash_arguments(*record, depth)
+        return digest
+
+
+def _is_diffable(entity_type):
+    return not entity_type.startswith(NON_DIFF_PREFIXES)
+
+
+def model_signatures(index):
+    """
+    Index a model's rooted entities by GlobalId with per-component hashes.
+
+    One hashing pass over the whole model (ContentHasher.hash_all), then
+    one over the relationships and one over the rooted entities, which
+    are read as raw bytes rather than parsed.
+
+    Args:
+        index: IFCIndex of the model
+
+    Returns:
+        dict: GlobalId -> (entity id, type, tuple of component digests in
+            COMPONENTS order)
+    """
+    hasher = ContentHasher(index)
+    hasher.hash_all()
+
+    related = {}
+    for relation_type, (component, related_position, relating_position, by_content) in RELATIONSHIPS.items():
+        slot = COMPONENTS.index(component)
+        for relation_id in index.ids_by_type.get(relation_type, ()):
+            references = _argument_references(index.raw_bytes(relation_id), (related_position, relating_position))
+            relating = references.get(relating_position)
+            if not relating:
+                continue
+            relating_hash = hasher.content_hash(relating[0]) if by_content else hasher.reference_hash(relating[0])
+            for element in references.get(related_position, []):
+                related.setdefault(element, [[] for _ in COMPONENTS])[slot].append(relating_hash)
+
+    signatures = {}
+    for entity_type in index.rooted_types:
+        if not _is_diffable(entity_type):
+            continue
+        for entity_id in index.ids_by_type[entity_type]:
+            raw = index.raw_bytes(entity_id)
+            match = GLOBAL_ID_PREFIX_BYTES.match(raw, 0, 32)
+            if match is None:
+                continue
+            # Own attributes with every reference normalized away
+            attributes = _digest(entity_type.encode(), _split_references(raw)[0])
+            references = _argument_references(raw, (PLACEMENT_POSITION, REPRESENTATION_POSITION))
+            placement = references.get(PLACEMENT_POSITION)
+            representation = references.get(REPRESENTATION_POSITION)
+
+            parts = related.get(entity_id)
+            components = [
+                attributes,
+                hasher.content_hash(placement[0]) if placement else _EMPTY,
+                hasher.content_hash(representation[0]) if representation else _EMPTY,
+            ]
+            for slot in range(3, len(COMPONENTS)):
+                hashes = sorted(parts[slot]) if parts else []
+                components.append(_digest(*hashes) if hashes else _EMPTY)
+            signatures[match.group(0).strip().strip(b"'").decode("ascii")] = (entity_id, entity_type, tuple(components))
+    return signatures
+
+
+def _property_values(index, entity_ids):
+    """
+    Flattened "Pset.Property" -> value for a few elements, in one pass.
+
+    Args:
+        index: IFCIndex of the model
+        entity_ids: Instance numbers of the elements
+
+    Returns:
+        dict: entity id -> {"Pset.Property": value}
+    """
+    wanted = set(entity_ids)
+    values = {entity_id: {} for entity_id in wanted}
+    definitions = {}
+    for relation in index.entities("IFCRELDEFINESBYPROPERTIES"):
+        targets = wanted.intersection(index.attribute(relation, 4, []) or [])
+        if not targets:
+            continue
+        definition_id = index.attribute(relation, 5)
+        if definition_id not in definitions:
+            definition = index.entity(definition_id)
+            flattened = {}
+            if definition is not None:
+                set_name = index.attribute(definition, 2, "")
+                members = index.attribute(definition, 4 if definition.type == "IFCPROPERTYSET" else 5, []) or []
+                for member in index.entities_by_id(m for m in members if isinstance(m, EntityRef)):
+                    value = index.attribute(member, 2 if member.type == "IFCPROPERTYSINGLEVALUE" else 3)
+                    flattened[f"{set_name}.{index.attribute(member, 0, '?')}"] = value
+            definitions[definition_id] = flattened
+        for target in targets:
+            values[target].update(definitions[definition_id])
+    return values
+
+
+def _attribute_changes(old_index, old_id, new_index, new_id):
+    old_args = old_index.entity(old_id).args
+    new_args = new_index.entity(new_id).args
+    changes = {}
+    for position in range(max(len(old_args), len(new_args))):
+        old_value = old_args[position] if position < len(old_args) else None
+        new_value = new_args[position] if position < len(new_args) else None
+        if isinstance(old_value, EntityRef) or isinstance(new_value, EntityRef) or old_value == new_value:
+            continue
+        name = ROOT_ATTRIBUTES[position] if position < len(ROOT_ATTRIBUTES) else f"Attribute {position}"
+        changes[name] = (old_value, new_value)
+    return changes
+
+
+def diff_models(old_index, new_index, detail_limit=MAX_PROMPT_ITEMS):
+    """
+    Compare two revisions of a model by GlobalId.
+
+    Elements are matched by GlobalId and compared by component hash, so
+    the comparison itself is a single pass over both signature tables.
+    Attribute and property details are resolved only for changed elements.
+
+    Args:
+        old_index: IFCIndex of the previous revision
+        new_index: IFCIndex of the new revision
+        detail_limit: Maximum changed elements to resolve details for
+
+    Returns:
+        dict: added, removed and changed lists of element dicts,
+            unchanged count and type_counts (type -> Counter of
+            added/removed/changed)
+    """
+    old = model_signatures(old_index)
+    new = model_signatures(new_index)
+
+    added = []
+    removed = []
+    changed = []
+    unchanged = 0
+    type_counts = {}
+
+    for global_id, (new_id, entity_type, new_components) in new.items():
+        previous = old.pop(global_id, None)
+        if previous is None:
+            added.append({"global_id": global_id, "type": entity_type, "name": new_index.name(new_id)})
+            type_counts.setdefault(entity_type, Counter())["added"] += 1
+        elif previous[2] != new_components:
+            components = [name for name, a, b in zip(COMPONENTS, previous[2], new_components) if a != b]
+            if previous[1] != entity_type:
+                components.insert(0, f"type {previous[1]} -> {entity_type}")
+            changed.append({"global_id": global_id, "type": entity_type, "name": new_index.name(new_id),
+                            "components": components, "old_id": previous[0], "new_id": new_id})
+            type_counts.setdefault(entity_type, Counter())["changed"] += 1
+        else:
+            unchanged += 1
+
+    for global_id, (old_id, entity_type, _) in old.items():
+        removed.append({"global_id": global_id, "type": entity_type, "name": old_index.name(old_id)})
+        type_counts.setdefault(entity_type, Counter())["removed"] += 1
+
+    detailed = changed[:detail_limit]
+    with_properties = [item for item in detailed if "properties" in item["components"]]
+    old_properties = _property_values(old_index, [item["old_id"] for item in with_properties])
+    new_properties = _property_values(new_index, [item["new_id"] for item in with_properties])
+    for item in detailed:
+        if "attributes" in item["components"]:
+            item["attributes"] = _attribute_changes(old_index, item["old_id"], new_index, item["new_id"])
+        if "properties" in item["components"]:
+            old_values = old_properties[item["old_id"]]
+            new_values = new_properties[item["new_id"]]
+            item["properties"] = {
+                key: (old_values.get(key), new_values.get(key))
+                for key in sorted(set(old_values) | set(new_values))
+                if old_values.get(key) != new_values.get(key)
+            }
+
+    return {
+        "added": added,
+        "removed": removed,
+        "changed": changed,
+        "unchanged": unchanged,
+        "type_counts": type_counts
+    }
+
+
+def _format(value):
+    return "(none)" if value is None else str(value)
+
+
+def diff_to_text(diff, max_items=MAX_PROMPT_ITEMS):
+    """
+    Render a revision diff compactly for a prompt.
+
+    Args:
+        diff: Result of diff_models
+        max_items: Maximum elements listed per section
+
+    Returns:
+        str: Delta summary text
+    """
+    lines = [
+        f"SUMMARY: {len(diff['added'])} added, {len(diff['removed'])} removed, "
+        f"{len(diff['changed'])} changed, {diff['unchanged']} unchanged",
+        "",
+        "CHANGES BY TYPE (type,added,removed,changed)",
+    ]
+    for entity_type, counts in sorted(diff["type_counts"].items(), key=lambda item: -sum(item[1].values())):
+        lines.append(f"{entity_type},{counts['added']},{counts['removed']},{counts['changed']}")
+
+    for section in ("added", "removed"):
+        items = diff[section]
+        if not items:
+            continue
+        lines.extend(["", f"{section.upper()} ELEMENTS"])
+        for item in items[:max_items]:
+            lines.append(f"- {item['type']} '{item['name']}' ({item['global_id']})")
+        if len(items) > max_items:
+            lines.append(f"... {len(items) - max_items} more")
+
+    if diff["changed"]:
+        lines.extend(["", "CHANGED ELEMENTS"])
+        for item in diff["changed"][:max_items]:
+            lines.append(f"- {item['type']} '{item['name']}' ({item['global_id']}): {', '.join(item['components'])} changed")
+            for name, (old_value, new_value) in item.get("attributes", {}).items():
+                lines.append(f"  {name}: {_format(old_value)} -> {_format(new_value)}")
+            for name, (old_value, new_value) in item.get("properties", {}).items():
+                lines.append(f"  {name}: {_format(old_value)} -> {_format(new_value)}")
+        if len(diff["changed"]) > max_items:
+            lines.append(f"... {len(diff['changed']) - max_items} more")
+
+    return "\n".join(lines)
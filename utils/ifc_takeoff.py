@@ -0,0 +1,369 @@
+"""IFC reference graph and quantity takeoff tables."""
+from collections import defaultdict
+
+import numpy as np
+import pandas as pd
+
+from utils.ifc_utils import EntityRef, SPATIAL_TYPES, STRUCTURAL_TYPES, SYSTEM_TYPE_PREFIXES, summarize_ifc
+
+
+# Quantity entity -> takeoff column (the value is attribute 3 in IFC2X3 and IFC4)
+QUANTITY_KINDS = {
+    "IFCQUANTITYLENGTH": "length",
+    "IFCQUANTITYAREA": "area",
+    "IFCQUANTITYVOLUME": "volume",
+    "IFCQUANTITYWEIGHT": "weight",
+    "IFCQUANTITYCOUNT": "count",
+}
+QUANTITY_COLUMNS = ["length", "area", "volume", "weight", "count"]
+
+# Named quantities each column takes, first match wins. Other quantities of
+# the same kind (Width, Height, Perimeter, NetFootprintArea, ...) measure
+# something else and are never summed into the column
+QUANTITY_NAMES = {
+    "length": ["Length", "NetLength", "GrossLength"],
+    "area": ["NetSideArea", "GrossSideArea", "NetArea", "GrossArea", "NetFloorArea", "GrossFloorArea", "Area"],
+    "volume": ["NetVolume", "GrossVolume", "Volume"],
+    "weight": ["NetWeight", "GrossWeight", "Weight"],
+    "count": ["Count"],
+}
+
+# Rooted types that are not physical elements
+NON_TAKEOFF_TYPES = {
+    "IFCOPENINGELEMENT", "IFCVIRTUALELEMENT", "IFCANNOTATION", "IFCGRID",
+    "IFCSYSTEM", "IFCDISTRIBUTIONSYSTEM", "IFCBUILDINGSYSTEM", "IFCGROUP", "IFCZONE",
+    "IFCPRESENTATIONLAYERASSIGNMENT", "IFCTASK", "IFCACTOR", "IFCPERSON",
+}
+NON_TAKEOFF_PREFIXES = ("IFCREL", "IFCPROPERTY", "IFCELEMENTQUANTITY", "IFCOWNERHISTORY", "IFCSTRUCTURALANALYSIS")
+
+# Maximum rows of each table sent to the model
+MAX_PROMPT_ROWS = 60
+
+
+def _is_takeoff_type(entity_type):
+    return not (
+        entity_type in NON_TAKEOFF_TYPES
+        or entity_type in SPATIAL_TYPES
+        or entity_type.startswith(NON_TAKEOFF_PREFIXES)
+        or entity_type.endswith(("TYPE", "STYLE"))
+    )
+
+
+def _refs(value):
+    """References in an attribute that may be a single reference or a list."""
+    if isinstance(value, EntityRef):
+        return [value]
+    if isinstance(value, list):
+        return [item for item in value if isinstance(item, EntityRef)]
+    return []
+
+
+def _quantity_rank(row):
+    """Sort key for (set name, name, kind, value): standard Qto sets first, then QUANTITY_NAMES order."""
+    set_name, name, kind, value = row
+    standard = (set_name or "").startswith("Qto_") or set_name == "BaseQuantities"
+    return not standard, QUANTITY_NAMES[kind].index(name)
+
+
+class IFCGraph:
+    """
+    Resolved relationships between the elements of an IFC model.
+
+    Built once from an IFCIndex by reading only relationship, quantity and
+    element entities: spatial containment and aggregation, material and
+    type assignments, element quantities and system membership.
+    """
+
+    def __init__(self, index):
+        """
+        Build the graph.
+
+        Args:
+            index: IFCIndex of the model
+        """
+        self.index = index
+        self.parent = {}
+        self.container = {}
+        self.element_type = {}
+        self.materials = defaultdict(list)
+        self.systems = defaultdict(list)
+        self.quantities = defaultdict(list)
+        self._names = {}
+
+        self._resolve_structure()
+        self._resolve_materials()
+        self._resolve_quantities()
+        self._resolve_groups()
+
+    def _resolve_structure(self):
+        index = self.index
+        for relation in index.entities("IFCRELAGGREGATES", "IFCRELNESTS"):
+            for child in _refs(index.attribute(relation, 5)):
+                self.parent[child] = index.attribute(relation, 4)
+        for relation in index.entities("IFCRELCONTAINEDINSPATIALSTRUCTURE"):
+            structure = index.attribute(relation, 5)
+            for element in _refs(index.attribute(relation, 4)):
+                self.container[element] = structure
+        for relation in index.entities("IFCRELDEFINESBYTYPE"):
+            relating_type = index.attribute(relation, 5)
+            for element in _refs(index.attribute(relation, 4)):
+                self.element_type[element] = relating_type
+
+    def _resolve_materials(self):
+        index = self.index
+        names_by_material = {}
+        for relation in index.entities("IFCRELASSOCIATESMATERIAL"):
+            relating = index.attribute(relation, 5)
+            if not isinstance(relating, EntityRef):
+                continue
+            if relating not in names_by_material:
+                names_by_material[relating] = list(dict.fromkeys(index.material_names(relating)))
+            for element in _refs(index.attribute(relation, 4)):
+                self.materials[element].extend(names_by_material[relating])
+
+    def _resolve_quantities(self):
+        index = self.index
+        for relation in index.entities("IFCRELDEFINESBYPROPERTIES"):
+            definition = index.attribute(relation, 5)
+            if not isinstance(definition, EntityRef) or index.type_of(definition) != "IFCELEMENTQUANTITY":
+                continue
+            quantity_set = index.entity(definition)
+            set_name = index.attribute(quantity_set, 2, "")
+            rows = []
+            for quantity in index.entities_by_id(_refs(index.attribute(quantity_set, 5))):
+                kind = QUANTITY_KINDS.get(quantity.type)
+                value = index.attribute(quantity, 3)
+                if kind and isinstance(value, (int, float)):
+                    rows.append((set_name, index.attribute(quantity, 0, ""), kind, float(value)))
+            for element in _refs(index.attribute(relation, 4)):
+                self.quantities[element].extend(rows)
+
+    def _resolve_groups(self):
+        index = self.index
+        for relation in index.entities("IFCRELASSIGNSTOGROUP"):
+            group = index.attribute(relation, 6)
+            if not isinstance(group, EntityRef):
+                continue
+            group_name = index.name(group) or "Unnamed"
+            for element in _refs(index.attribute(relation, 4)):
+                self.systems[element].append(group_name)
+
+    def name(self, entity_id):
+        """Readable name of an entity, memoized for shared spatial and type entities."""
+        if entity_id not in self._names:
+            self._names[entity_id] = self.index.name(entity_id) or "Unnamed"
+        return self._names[entity_id]
+
+    def storey_of(self, element_id):
+        """
+        Find the storey (or other spatial structure) holding an element.
+
+        Follows aggregation upward, so parts of a stair or curtain wall get
+        the storey of their parent.
+
+        Args:
+            element_id: Instance number
+
+        Returns:
+            str: Name of the containing spatial structure, or "Unassigned"
+        """
+        seen = set()
+        current = element_id
+        while current is not None and current not in seen:
+            seen.add(current)
+            if current in self.container:
+                return self.name(self.container[current])
+            current = self.parent.get(current)
+        return "Unassigned"
+
+    def units(self):
+        """
+        Get the model's SI units.
+
+        Returns:
+            dict: unit type (e.g. "LENGTHUNIT") -> unit (e.g. "MILLI METRE")
+        """
+        units = {}
+        for unit in self.index.entities("IFCSIUNIT"):
+            unit_type = self.index.attribute(unit, 1)
+            if unit_type:
+                prefix = self.index.attribute(unit, 2)
+                units[unit_type] = " ".join(part for part in (prefix, self.index.attribute(unit, 3)) if part)
+        return units
+
+    def elements_frame(self):
+        """
+        One row per physical element, with resolved relationships and quantities.
+
+        Returns:
+            DataFrame: id, global_id, ifc_type, name, type_name, storey,
+                material, system, and the length, area, volume, weight and
+                count quantities named in QUANTITY_NAMES (NaN where the
+                model has none)
+        """
+        index = self.index
+        element_types = sorted(t for t in index.rooted_types if _is_takeoff_type(t))
+        rows = []
+        for entity_type in element_types:
+            for element in index.entities(entity_type):
+                element_id = element.id
+                relating_type = self.element_type.get(element_id)
+                materials = self.materials.get(element_id)
+                if not materials and relating_type is not None:
+                    materials = self.materials.get(relating_type)
+
+                # One named quantity per column (see QUANTITY_NAMES)
+                quantities = [row for row in self.quantities.get(element_id, ()) if row[1] in QUANTITY_NAMES[row[2]]]
+                chosen = {}
+                for set_name, name, kind, value in sorted(quantities, key=_quantity_rank):
+                    chosen.setdefault(kind, value)
+
+                rows.append({
+                    "id": element_id,
+                    "global_id": index.attribute(element, 0, ""),
+                    "ifc_type": entity_type,
+                    "name": index.attribute(element, 2) or "Unnamed",
+                    "type_name": self.name(relating_type) if relating_type is not None else "",
+                    "storey": self.storey_of(element_id),
+                    "material": " / ".join(dict.fromkeys(materials)) if materials else "Unassigned",
+                    "system": ", ".join(dict.fromkeys(self.systems.get(element_id, []))) or "",
+                    "length": chosen.get("length", np.nan),
+                    "area": chosen.get("area", np.nan),
+                    "volume": chosen.get("volume", np.nan),
+                    "weight": chosen.get("weight", np.nan),
+                    "count": chosen.get("count", np.nan),
+                })
+
+        columns = ["id", "global_id", "ifc_type", "name", "type_name", "storey", "material", "system",
+                   "length", "area", "volume", "weight", "count"]
+        return pd.DataFrame(rows, columns=columns)
+
+
+def _summarize(frame, keys):
+    """Element count and quantity totals per group, largest groups first."""
+    if frame.empty:
+        return pd.DataFrame(columns=keys + ["elements"] + QUANTITY_COLUMNS)
+    grouped = frame.groupby(keys, sort=False, dropna=False)
+    table = grouped.size().rename("elements").to_frame()
+    # Sum only where a quantity exists; groups with none stay NaN
+    table = table.join(grouped[QUANTITY_COLUMNS].sum(min_count=1))
+    table = table.reset_index().sort_values("elements", ascending=False, kind="stable")
+    # Drop quantity columns the model never provides
+    empty = [column for column in QUANTITY_COLUMNS if table[column].isna().all()]
+    return table.drop(columns=empty).reset_index(drop=True)
+
+
+def takeoff_tables(elements):
+    """
+    Precompute the quantity takeoff tables from the elements frame.
+
+    Args:
+        elements: DataFrame from IFCGraph.elements_frame
+
+    Returns:
+        dict: table name -> DataFrame ("by_type", "by_storey", "by_material",
+            "structural", "systems")
+    """
+    structural = elements[elements["ifc_type"].isin(STRUCTURAL_TYPES)]
+    systems = elements[elements["ifc_type"].str.startswith(SYSTEM_TYPE_PREFIXES) | (elements["system"] != "")]
+    return {
+        "by_type": _summarize(elements, ["ifc_type", "type_name"]),
+        "by_storey": _summarize(elements, ["storey", "ifc_type"]),
+        "by_material": _summarize(elements, ["material", "ifc_type"]),
+        "structural": _summarize(structural, ["storey", "ifc_type", "material"]),
+        "systems": _summarize(systems, ["system", "ifc_type"]),
+    }
+
+
+# Tables answering each analysis type, with their titles
+ANALYSIS_TABLES = {
+    "General Overview": [("Elements by type", "by_type"), ("Elements by storey", "by_storey")],
+    "Material Analysis": [("Quantities by material", "by_material")],
+    "Structural Components": [("Structural elements by storey, type and material", "structural")],
+    "Building Systems": [("System elements by system and type", "systems")],
+    "Custom Analysis": [("Elements by type", "by_type"), ("Elements by storey", "by_storey"),
+                        ("Quantities by material", "by_material")],
+}
+
+
+def analysis_tables(tables, analysis_type):
+    """
+    Select the takeoff tables for an analysis type.
+
+    Args:
+        tables: Tables from takeoff_tables
+        analysis_type: One of the IFC page's analysis types
+
+    Returns:
+        dict: title -> DataFrame
+    """
+    selection = ANALYSIS_TABLES.get(analysis_type, ANALYSIS_TABLES["Custom Analysis"])
+    return {title: tables[name] for title, name in selection}
+
+
+def tables_to_text(tables, max_rows=MAX_PROMPT_ROWS):
+    """
+    Render tables compactly for a prompt.
+
+    Args:
+        tables: dict of title -> DataFrame
+        max_rows: Maximum rows per table
+
+    Returns:
+        str: Each table as a titled CSV block
+    """
+    blocks = []
+    for title, table in tables.items():
+        shown = table.head(max_rows)
+        text = shown.to_csv(index=False, float_format="%.6g").strip()
+        if len(table) > max_rows:
+            text += f"\n... {len(table) - max_rows} smaller groups omitted"
+        blocks.append(f"{title.upper()}\n{text if len(table) else '(none)'}")
+    return "\n\n".join(blocks)
+
+
+def build_takeoff(index):
+    """
+    Resolve the reference graph of a model and build its takeoff tables.
+
+    Args:
+        index: IFCIndex of the model
+
+    Returns:
+        dict: "tables" (from takeoff_tables), "units" and "elements" (count)
+    """
+    graph = IFCGraph(index)
+    elements = graph.elements_frame()
+    return {
+        "tables": takeoff_tables(elements),
+        "units": graph.units(),
+        "elements": len(elements)
+    }
+
+
+def format_units(units):
+    """Format model units for display, e.g. "LENGTHUNIT: MILLI METRE"."""
+    return ", ".join(f"{unit_type}: {unit}" for unit_type, unit in units.items()) or "not specified"
+
+
+def takeoff_to_text(index, takeoff, analysis_type):
+    """
+    Render the model data section of an IFC analysis prompt.
+
+    Args:
+        index: IFCIndex of the model
+        takeoff: Result of build_takeoff
+        analysis_type: One of the IFC page's analysis types
+
+    Returns:
+        str: Takeoff note, model line and the tables for the analysis type
+    """
+    tables = tables_to_text(analysis_tables(takeoff["tables"], analysis_type))
+    if analysis_type == "Custom Analysis":
+        # Custom questions may need names and property values too
+        tables += f"\n\nMODEL SUMMARY\n{summarize_ifc(index, analysis_type)}"
+    return f"""The IFC model has been parsed locally into quantity takeoff tables (element counts and summed quantities per group; empty cells mean the model has no such quantity). Length is the Length base quantity, area is the side area of walls and the net (else gross) area of other elements, volume and weight are net (else gross). Base the analysis on these tables, not on assumptions about the raw file.
+
+MODEL: schema {index.schema}, {takeoff['elements']} elements, units: {format_units(takeoff['units'])}
+
+{tables}"""
@@ -0,0 +1,879 @@
+"""IFC (ISO-10303-21 STEP) parsing and compact model summaries."""
+import mmap
+import os
+import re
+import shutil
+import tempfile
+import weakref
+from array import array
+from bisect import bisect_left
+from collections import Counter, defaultdict, namedtuple
+
+
+# Header statements: "FILE_SCHEMA(('IFC4'));"
+HEADER_RECORD = re.compile(r"([A-Za-z_]+)\s*\((.*)\)\s*;\s*$", re.DOTALL)
+
+# Start of an entity record, up to its opening parenthesis
+ENTITY_PREFIX = re.compile(rb"#(\d+)\s*=\s*([A-Za-z0-9_]+)\s*\(")
+
+# Complete statements within a buffer holding several (quotes respected)
+STATEMENT_BYTES = re.compile(rb"(?:[^;']|'[^']*')*;")
+
+# Instances of IfcRoot start with a 22-character GlobalId
+GLOBAL_ID_PREFIX_BYTES = re.compile(rb"\s*'[0-9A-Za-z_$]{22}'")
+
+ARGUMENT_TOKEN = re.compile(
+    r"\s*(?:"
+    r"(?P<string>'(?:[^']|'')*')"
+    r"|(?P<ref>#\d+)"
+    r"|(?P<null>[$*])"
+    r"|(?P<enum>\.[A-Za-z0-9_]+\.)"
+    r"|(?P<typed>[A-Za-z][A-Za-z0-9_]*)\s*\("
+    r"|(?P<open>\()"
+    r"|(?P<close>\))"
+    r"|(?P<comma>,)"
+    r"|(?P<binary>\"[0-9A-Fa-f]*\")"
+    r"|(?P<number>[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)"
+    r")"
+)
+
+# Element types reported for each analysis type
+STRUCTURAL_TYPES = {
+    "IFCBEAM", "IFCBEAMSTANDARDCASE", "IFCCOLUMN", "IFCCOLUMNSTANDARDCASE",
+    "IFCWALL", "IFCWALLSTANDARDCASE", "IFCWALLELEMENTEDCASE", "IFCSLAB",
+    "IFCSLABSTANDARDCASE", "IFCSLABELEMENTEDCASE", "IFCFOOTING", "IFCPILE",
+    "IFCMEMBER", "IFCMEMBERSTANDARDCASE", "IFCPLATE", "IFCPLATESTANDARDCASE",
+    "IFCROOF", "IFCSTAIR", "IFCSTAIRFLIGHT", "IFCRAMP", "IFCRAMPFLIGHT",
+    "IFCRAILING", "IFCCOVERING", "IFCCURTAINWALL", "IFCBUILDINGELEMENTPROXY",
+    "IFCREINFORCINGBAR", "IFCREINFORCINGMESH", "IFCTENDON", "IFCDOOR",
+    "IFCWINDOW", "IFCMECHANICALFASTENER", "IFCFASTENER", "IFCDISCRETEACCESSORY",
+}
+SYSTEM_TYPE_PREFIXES = (
+    "IFCFLOW", "IFCDISTRIBUTION", "IFCENERGYCONVERSION", "IFCPIPE", "IFCDUCT",
+    "IFCCABLE", "IFCAIRTERMINAL", "IFCSANITARY", "IFCLIGHTFIXTURE", "IFCLAMP",
+    "IFCOUTLET", "IFCPUMP", "IFCFAN", "IFCBOILER", "IFCCHILLER", "IFCVALVE",
+    "IFCDAMPER", "IFCSWITCHINGDEVICE", "IFCELECTRIC", "IFCUNITARYEQUIPMENT",
+    "IFCTANK", "IFCSYSTEM", "IFCPROTECTIVEDEVICE", "IFCCOIL", "IFCCOMPRESSOR",
+    "IFCCONDENSER", "IFCCOOLINGTOWER", "IFCEVAPORATOR", "IFCHEATEXCHANGER",
+    "IFCHUMIDIFIER", "IFCSPACEHEATER", "IFCFIRESUPPRESSIONTERMINAL",
+    "IFCWASTETERMINAL", "IFCALARM", "IFCSENSOR", "IFCACTUATOR", "IFCCONTROLLER",
+    "IFCJUNCTIONBOX", "IFCTRANSFORMER", "IFCMOTORCONNECTION", "IFCSTACKTERMINAL",
+)
+
+# Types that are bookkeeping rather than model content
+NON_ELEMENT_PREFIXES = ("IFCREL", "IFCPROPERTY", "IFCELEMENTQUANTITY", "IFCOWNERHISTORY")
+SPATIAL_TYPES = ("IFCPROJECT", "IFCSITE", "IFCBUILDING", "IFCBUILDINGSTOREY", "IFCSPACE")
+
+# Directory for spooled uploads (override with AI_PROJECT_SPOOL_DIR)
+SPOOL_DIR = os.environ.get("AI_PROJECT_SPOOL_DIR", os.path.join(tempfile.gettempdir(), "hunter-ai-ifc"))
+
+# Copy size when spooling an upload to disk
+SPOOL_CHUNK_BYTES = 1024 * 1024
+
+# Characters shown in the raw file preview
+PREVIEW_CHARS = 2000
+
+# Size limits for summary sections
+MAX_SUMMARY_TYPES = 40
+MAX_NAMES_PER_TYPE = 12
+MAX_VALUES_PER_PROPERTY = 6
+MAX_PROPERTY_SETS = 30
+MAX_MATERIALS = 60
+
+IFCEntity = namedtuple("IFCEntity", ["id", "type", "args"])
+
+
+class EntityRef(int):
+    """Reference to another entity instance ("#12")."""
+
+    def __repr__(self):
+        return f"#{int(self)}"
+
+
+def decode_step_string(value):
+    """
+    Decode a quoted STEP string literal.
+
+    Args:
+        value: Literal including the surrounding quotes
+
+    Returns:
+        str: Decoded text (\\X2\\, \\X4\\ and \\X\\ escapes resolved)
+    """
+    text = value[1:-1].replace("''", "'")
+    if "\\" not in text:
+        return text
+
+    def wide(match):
+        width = 4 if match.group(1) == "2" else 8
+        digits = match.group(2)
+        return "".join(chr(int(digits[i:i + width], 16)) for i in range(0, len(digits), width))
+
+    text = re.sub(r"\\X([24])\\([0-9A-Fa-f]+)\\X0\\", wide, text)
+    text = re.sub(r"\\X\\([0-9A-Fa-f]{2})", lambda match: chr(int(match.group(1), 16)), text)
+    return text.replace("\\\\", "\\")
+
+
+def parse_arguments(text):
+    """
+    Parse a STEP argument list into Python values.
+
+    Strings become str, references EntityRef, numbers int or float, $ and
+    * None, .T./.F. booleans, other enumerations their name, lists lists.
+    Typed values such as IFCLABEL('x') become their inner value.
+
+    Args:
+        text: Text between an entity's outer parentheses
+
+    Returns:
+        list: Argument values
+    """
+    # Each level: (values, whether it is a typed-value wrapper)
+    stack = [([], False)]
+    position = 0
+    length = len(text)
+    while position < length:
+        match = ARGUMENT_TOKEN.match(text, position)
+        if not match:
+            if text[position:].strip():
+                raise ValueError(f"unexpected STEP syntax at {text[position:position + 20]!r}")
+            break
+        position = match.end()
+        kind = match.lastgroup
+        if kind == "comma":
+            continue
+        if kind in ("open", "typed"):
+            stack.append(([], kind == "typed"))
+            continue
+        if kind == "close":
+            if len(stack) == 1:
+                raise ValueError("unbalanced parentheses in STEP arguments")
+            values, typed = stack.pop()
+            stack[-1][0].append(values[0] if typed and len(values) == 1 else values)
+            continue
+
+        token = match.group(kind)
+        if kind == "string":
+            value = decode_step_string(token)
+        elif kind == "ref":
+            value = EntityRef(token[1:])
+        elif kind == "null":
+            value = None
+        elif kind == "enum":
+            value = {".T.": True, ".F.": False}.get(token.upper(), token.strip(".").upper())
+        elif kind == "number":
+            value = float(token) if any(c in token for c in ".eE") else int(token)
+        else:
+            value = token.strip('"')
+        stack[-1][0].append(value)
+
+    if len(stack) != 1:
+        raise ValueError("unbalanced parentheses in STEP arguments")
+    return stack[0][0]
+
+
+def is_step_file(head):
+    """
+    Check whether text starts like an ISO-10303-21 (STEP) file.
+
+    Args:
+        head: The first few hundred characters (or bytes) of the file
+
+    Returns:
+        bool: True for STEP/IFC physical files
+    """
+    if isinstance(head, (bytes, bytearray)):
+        head = head[:1000].decode("utf-8", errors="ignore")
+    return "ISO-10303-21" in head[:1000].upper()
+
+
+def iter_step_statements(buffer):
+    """
+    Stream the spans of complete STEP statements in a buffer.
+
+    The buffer is scanned line by line without copying it. Statements may
+    span several lines, and a line may hold several statements; semicolons
+    inside quoted strings do not end a statement.
+
+    Args:
+        buffer: bytes or mmap holding the file
+
+    Yields:
+        tuple: (start, end) byte offsets of one statement, including its
+            terminating semicolon
+    """
+    length = len(buffer)
+    position = 0
+    start = None
+    quotes = 0
+    while position < length:
+        newline = buffer.find(b"\n", position)
+        line_end = length if newline == -1 else newline + 1
+        line = buffer[position:line_end]
+        stripped = line.strip()
+        if stripped:
+            if start is None:
+                start = position + len(line) - len(line.lstrip())
+            quotes += stripped.count(b"'")
+            # Complete when it ends with ";" outside a string ('' escapes keep parity)
+            if stripped.endswith(b";") and not quotes % 2:
+                end = position + len(line.rstrip())
+                if stripped.count(b";") == 1 and start >= position:
+                    yield start, end
+                else:
+                    for match in STATEMENT_BYTES.finditer(buffer[start:end]):
+                        yield start + match.start(), start + match.end()
+                start = None
+                quotes = 0
+        position = line_end
+    if start is not None:
+        yield start, length
+
+
+def _release_spool(resources, path):
+    """Close a spooled file's mapping and handle, and delete it if it was spooled."""
+    if resources.get("mapping") is not None:
+        resources["mapping"].close()
+    if resources.get("file") is not None:
+        resources["file"].close()
+    resources.clear()
+    if path:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+class IFCFile:
+    """
+    An IFC file on disk, read through a read-only memory map.
+
+    Uploads are spooled to a temporary file in chunks, so the session
+    holds only this handle; the operating system pages the mapped bytes
+    in and out as the index reads them. The temporary file is deleted on
+    close() or when the handle is garbage collected.
+    """
+
+    def __init__(self, path, name="", delete=False):
+        """
+        Initialize the handle.
+
+        Args:
+            path: Path of the file
+            name: Original file name, for display
+            delete: Whether to delete the file when the handle is closed
+        """
+        self.path = path
+        self.name = name or os.path.basename(path)
+        self.size = os.path.getsize(path)
+        self._resources = {}
+        self._finalizer = weakref.finalize(self, _release_spool, self._resources, path if delete else None)
+
+    @classmethod
+    def spool(cls, file, name=None):
+        """
+        Copy an uploaded file to a temporary file, chunk by chunk.
+
+        Args:
+            file: Binary file object (e.g. Streamlit UploadedFile)
+            name: Original file name (default: the file object's name)
+
+        Returns:
+            IFCFile: Handle to the spooled copy
+        """
+        path = None
+        try:
+            os.makedirs(SPOOL_DIR, exist_ok=True)
+            file.seek(0)
+            fd, path = tempfile.mkstemp(dir=SPOOL_DIR, suffix=".ifc")
+            with os.fdopen(fd, "wb") as spooled:
+                shutil.copyfileobj(file, spooled, SPOOL_CHUNK_BYTES)
+            return cls(path, name or getattr(file, "name", ""), delete=True)
+        except Exception as e:
+            # Do not leave a partial copy behind (e.g. when the disk fills up)
+            if path is not None and os.path.exists(path):
+                os.remove(path)
+            raise Exception(f"Error spooling IFC file: {str(e)}")
+
+    @property
+    def mapping(self):
+        """Read-only memory map of the file (bytes for an empty file)."""
+        if "mapping" not in self._resources:
+            if self.size == 0:
+                self._resources["mapping"] = None
+                return b""
+            self._resources["file"] = open(self.path, "rb")
+            self._resources["mapping"] = mmap.mmap(self._resources["file"].fileno(), 0, access=mmap.ACCESS_READ)
+        return self._resources["mapping"] or b""
+
+    def head(self, size=1000):
+        """
+        Get the start of the file.
+
+        Args:
+            size: Number of bytes to read
+
+        Returns:
+            bytes: Up to size bytes from the start of the file
+        """
+        return self.mapping[:size]
+
+    def preview(self, max_chars=PREVIEW_CHARS):
+        """
+        Get the start of the file as text, for display.
+
+        Args:
+            max_chars: Maximum characters returned
+
+        Returns:
+            str: Decoded text, with "..." appended if the file is longer
+        """
+        text = self.head(max_chars * 4).decode("utf-8", errors="ignore")[:max_chars]
+        return text + ("..." if self.size > len(text) else "")
+
+    def read_text(self):
+        """
+        Decode the whole file (for small non-STEP exports).
+
+        Returns:
+            str: File contents
+        """
+        return self.mapping[:].decode("utf-8", errors="ignore")
+
+    def close(self):
+        """Unmap the file and delete it if it was spooled."""
+        self._finalizer()
+
+
+class IFCIndex:
+    """
+    Index of the entity instances in an IFC model.
+
+    The model is scanned once over a bytes buffer or memory-mapped file.
+    For every "#id=IFCTYPE(...);" record the index keeps only the id, a
+    type code and the byte span of its arguments, in compact arrays, so
+    memory does not grow with the text of the model. Arguments are read
+    from the buffer and parsed only when an entity is looked up.
+    """
+
+    def __init__(self, buffer):
+        """
+        Initialize an empty index over a buffer.
+
+        Args:
+            buffer: bytes or mmap holding the STEP file
+        """
+        self.buffer = buffer
+        self.header = {}
+        self.ids_by_type = defaultdict(lambda: array("q"))
+        self.rooted_types = set()
+        self.skipped = 0
+        self._ids = array("q")
+        self._type_codes = array("H")
+        self._starts = array("q")
+        self._ends = array("q")
+        self._type_names = []
+        self._type_lookup = {}
+
+    @classmethod
+    def from_buffer(cls, buffer):
+        """
+        Build an index by scanning a STEP file held in a buffer.
+
+        Args:
+            buffer: bytes or mmap (see IFCFile.mapping)
+
+        Returns:
+            IFCIndex: The index
+        """
+        index = cls(buffer)
+        in_data = False
+        for start, end in iter_step_statements(buffer):
+            if buffer[start:start + 1] == b"#":
+                index._add_record(start, end)
+                continue
+            statement = buffer[start:end].decode("utf-8", errors="ignore")
+            keyword = statement.rstrip(";").strip().upper()
+            if keyword == "DATA":
+                in_data = True
+            elif keyword == "ENDSEC":
+                in_data = False
+            elif not in_data:
+                match = HEADER_RECORD.match(statement)
+                if match and match.group(1).upper() != "ISO":
+                    try:
+                        index.header[match.group(1).upper()] = parse_arguments(match.group(2))
+                    except ValueError:
+                        pass
+        index._sort()
+        return index
+
+    @classmethod
+    def from_text(cls, text):
+        """
+        Build an index from the text of a STEP file.
+
+        Args:
+            text: File contents
+
+        Returns:
+            IFCIndex: The index
+        """
+        return cls.from_buffer(text.encode("utf-8"))
+
+    def _add_record(self, start, end):
+        match = ENTITY_PREFIX.match(self.buffer, start, end)
+        # Arguments run from after "IFCTYPE(" to the last ")" of the statement
+        args_end = self.buffer.rfind(b")", start, end)
+        if not match or args_end < match.end():
+            self.skipped += 1
+            return
+        entity_id = int(match.group(1))
+        entity_type = match.group(2).decode("ascii").upper()
+        args_start = match.end()
+
+        code = self._type_lookup.get(entity_type)
+        if code is None:
+            code = self._type_lookup[entity_type] = len(self._type_names)
+            self._type_names.append(entity_type)
+        self._ids.append(entity_id)
+        self._type_codes.append(code)
+        self._starts.append(args_start)
+        self._ends.append(args_end)
+        self.ids_by_type[entity_type].append(entity_id)
+        if entity_type not in self.rooted_types and GLOBAL_ID_PREFIX_BYTES.match(self.buffer[args_start:args_start + 32]):
+            self.rooted_types.add(entity_type)
+
+    def _sort(self):
+        """Order the arrays by id so lookups can bisect."""
+        if all(self._ids[i] < self._ids[i + 1] for i in range(len(self._ids) - 1)):
+            return
+        order = sorted(range(len(self._ids)), key=self._ids.__getitem__)
+        for name in ("_ids", "_type_codes", "_starts", "_ends"):
+            values = getattr(self, name)
+            setattr(self, name, array(values.typecode, (values[i] for i in order)))
+
+    def _position(self, entity_id):
+        position = bisect_left(self._ids, entity_id)
+        if position < len(self._ids) and self._ids[position] == entity_id:
+            return position
+        return None
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __contains__(self, entity_id):
+        return self._position(entity_id) is not None
+
+    @property
+    def schema(self):
+        """IFC schema identifier from the header (e.g. "IFC4")."""
+        schema = self.header.get("FILE_SCHEMA", [[]])
+        values = schema[0] if schema and isinstance(schema[0], list) else schema
+        return ", ".join(str(value) for value in values if value) or "unknown"
+
+    @property
+    def type_counts(self):
+        """Counter of entity type -> number of instances."""
+        return Counter({entity_type: len(ids) for entity_type, ids in self.ids_by_type.items()})
+
+    def type_of(self, entity_id, default=None):
+        """
+        Get an entity's type without parsing it.
+
+        Args:
+            entity_id: Instance number (the "12" of "#12")
+            default: Value returned when the entity is not in the model
+
+        Returns:
+            str: Upper-case type name, e.g. "IFCWALL"
+        """
+        position = self._position(entity_id)
+        return default if position is None else self._type_names[self._type_codes[position]]
+
+    def raw_arguments(self, entity_id):
+        """
+        Get an entity's unparsed argument text.
+
+        Args:
+            entity_id: Instance number
+
+        Returns:
+            str: Text between the entity's outer parentheses, or None
+        """
+        raw = self.raw_bytes(entity_id)
+        return None if raw is None else raw.decode("utf-8", errors="ignore")
+
+    def raw_bytes(self, entity_id):
+        """
+        Get an entity's unparsed argument bytes, without decoding.
+
+        Args:
+            entity_id: Instance number
+
+        Returns:
+            bytes: Bytes between the entity's outer parentheses, or None
+        """
+        position = self._position(entity_id)
+        if position is None:
+            return None
+        return self.buffer[self._starts[position]:self._ends[position]]
+
+    def record(self, entity_id):
+        """
+        Get an entity's type and unparsed argument bytes with one lookup.
+
+        Args:
+            entity_id: Instance number
+
+        Returns:
+            tuple: (upper-case type name, argument bytes), or None
+        """
+        position = self._position(entity_id)
+        if position is None:
+            return None
+        return self._type_names[self._type_codes[position]], self.buffer[self._starts[position]:self._ends[position]]
+
+    def records(self):
+        """
+        Iterate over every entity without parsing or lookups.
+
+        Yields:
+            tuple: (instance number, upper-case type name, argument bytes),
+                in instance-number order
+        """
+        names = self._type_names
+        buffer = self.buffer
+        for entity_id, code, start, end in zip(self._ids, self._type_codes, self._starts, self._ends):
+            yield entity_id, names[code], buffer[start:end]
+
+    def entity(self, entity_id):
+        """
+        Look up and parse one entity.
+
+        Args:
+            entity_id: Instance number (the "12" of "#12")
+
+        Returns:
+            IFCEntity: The entity, or None if it is not in the model
+        """
+        raw = self.raw_arguments(entity_id)
+        if raw is None:
+            return None
+        try:
+            args = parse_arguments(raw)
+        except ValueError:
+            args = []
+        return IFCEntity(entity_id, self.type_of(entity_id), args)
+
+    def entities(self, *entity_types):
+        """
+        Iterate over parsed entities of the given types.
+
+        Args:
+            *entity_types: Upper-case type names, e.g. "IFCWALL"
+
+        Yields:
+            IFCEntity: Entities in file order per type
+        """
+        for entity_type in entity_types:
+            for entity_id in self.ids_by_type.get(entity_type, ()):
+                yield self.entity(entity_id)
+
+    def entities_by_id(self, entity_ids):
+        """
+        Iterate over parsed entities for a list of instance numbers.
+
+        Args:
+            entity_ids: Instance numbers; ids not in the model are skipped
+
+        Yields:
+            IFCEntity: Entities in the given order
+        """
+        for entity_id in entity_ids:
+            entity = self.entity(entity_id)
+            if entity is not None:
+                yield entity
+
+    def attribute(self, entity, position, default=None):
+        """Get an entity's attribute by position, or default when absent."""
+        if entity is None or position >= len(entity.args) or entity.args[position] is None:
+            return default
+        return entity.args[position]
+
+    def name(self, entity_id):
+        """
+        Get a readable name for an entity.
+
+        Args:
+            entity_id: Instance number
+
+        Returns:
+            str: Name (or object type) for rooted entities, the first string
+                attribute otherwise, or "" if it has none
+        """
+        entity = self.entity(entity_id)
+        if entity is None:
+            return ""
+        if entity.type in self.rooted_types:
+            name = self.attribute(entity, 2) or self.attribute(entity, 4)
+        else:
+            name = next((arg for arg in entity.args if isinstance(arg, str)), "")
+        return name if isinstance(name, str) else ""
+
+    def material_names(self, entity_id, depth=0):
+        """
+        Resolve a material definition to the material names it contains.
+
+        Handles materials, lists, layer sets, profile sets and constituent
+        sets (and their usages), for IFC2X3 and IFC4.
+
+        Args:
+            entity_id: Instance number of the relating material
+
+        Returns:
+            list: Material names, with layer thicknesses where given
+        """
+        entity = self.entity(entity_id)
+        if entity is None or depth > 4:
+            return []
+        if entity.type == "IFCMATERIAL":
+            return [self.attribute(entity, 0, "Unnamed material")]
+        if entity.type == "IFCMATERIALLAYER":
+            names = self.material_names(self.attribute(entity, 0), depth + 1) if self.attribute(entity, 0) else []
+            thickness = self.attribute(entity, 1)
+            return [f"{name} ({thickness:g} thick)" if isinstance(thickness, (int, float)) else name for name in names]
+        if entity.type in ("IFCMATERIALLAYERSETUSAGE", "IFCMATERIALPROFILESETUSAGE"):
+            return self.material_names(self.attribute(entity, 0), depth + 1) if self.attribute(entity, 0) else []
+
+        if entity.type in ("IFCMATERIALLIST", "IFCMATERIALLAYERSET"):
+            members = self.attribute(entity, 0, [])
+        elif entity.type in ("IFCMATERIALPROFILESET", "IFCMATERIALCONSTITUENTSET"):
+            members = self.attribute(entity, 2, [])
+        elif entity.type in ("IFCMATERIALPROFILE", "IFCMATERIALCONSTITUENT"):
+            members = [self.attribute(entity, 2)] if self.attribute(entity, 2) else []
+        else:
+            return []
+
+        names = []
+        for member in members if isinstance(members, list) else [members]:
+            if isinstance(member, EntityRef):
+                names.extend(self.material_names(member, depth + 1))
+        return names
+
+    def material_usage(self):
+        """
+        Map materials to the elements associated with them.
+
+        Returns:
+            dict: material name -> Counter of element type -> count
+        """
+        usage = defaultdict(Counter)
+        for relation in self.entities("IFCRELASSOCIATESMATERIAL"):
+            related = self.attribute(relation, 4, [])
+            relating = self.attribute(relation, 5)
+            if not isinstance(relating, EntityRef):
+                continue
+            for name in dict.fromkeys(self.material_names(relating)):
+                for element_id in related:
+                    usage[name][self.type_of(element_id, "UNKNOWN")] += 1
+        return usage
+
+    def property_sets(self, element_types=None):
+        """
+        Aggregate property sets and their values.
+
+        Args:
+            element_types: Only count property sets attached to elements of
+                these types (None for all property sets)
+
+        Returns:
+            dict: property set name -> {"count": int, "properties":
+                {property name -> Counter of value -> count}}
+        """
+        if element_types is None:
+            pset_ids = self.ids_by_type.get("IFCPROPERTYSET", [])
+        else:
+            pset_ids = []
+            for relation in self.entities("IFCRELDEFINESBYPROPERTIES"):
+                related = self.attribute(relation, 4, [])
+                definition = self.attribute(relation, 5)
+                if isinstance(definition, EntityRef) and any(self.type_of(r) in element_types for r in related):
+                    pset_ids.append(definition)
+
+        psets = {}
+        for pset_id in dict.fromkeys(pset_ids):
+            pset = self.entity(pset_id)
+            if pset is None or pset.type != "IFCPROPERTYSET":
+                continue
+            summary = psets.setdefault(self.attribute(pset, 2, "Unnamed"), {"count": 0, "properties": defaultdict(Counter)})
+            summary["count"] += 1
+            for property_id in self.attribute(pset, 4, []):
+                prop = self.entity(property_id)
+                if prop is None or prop.type != "IFCPROPERTYSINGLEVALUE":
+                    continue
+                value = self.attribute(prop, 2)
+                summary["properties"][self.attribute(prop, 0, "?")][_format_value(value)] += 1
+        return psets
+
+    def spatial_structure(self):
+        """
+        List the project, sites, buildings and storeys.
+
+        Returns:
+            list: (type, name, elevation or None) tuples in file order
+        """
+        rows = []
+        for entity_type in SPATIAL_TYPES[:4]:
+            for entity in self.entities(entity_type):
+                name = self.attribute(entity, 2) or self.attribute(entity, 7) or "Unnamed"
+                elevation = self.attribute(entity, 9) if entity_type == "IFCBUILDINGSTOREY" else None
+                rows.append((entity_type, name, elevation if isinstance(elevation, (int, float)) else None))
+        return rows
+
+    def element_names(self, entity_type, limit=MAX_NAMES_PER_TYPE):
+        """
+        Most common names among the instances of a type.
+
+        Args:
+            entity_type: Upper-case type name
+            limit: Maximum names returned
+
+        Returns:
+            list: (name, count) pairs, most common first
+        """
+        names = Counter(self.name(entity_id) or "Unnamed" for entity_id in self.ids_by_type.get(entity_type, ()))
+        return names.most_common(limit)
+
+
+def _format_value(value):
+    if isinstance(value, float):
+        return f"{value:g}"
+    if isinstance(value, list):
+        return ", ".join(_format_value(item) for item in value)
+    return "" if value is None else str(value)
+
+
+def _is_system_type(entity_type):
+    return entity_type.startswith(SYSTEM_TYPE_PREFIXES)
+
+
+def _is_element_type(entity_type):
+    return not entity_type.startswith(NON_ELEMENT_PREFIXES) and entity_type not in SPATIAL_TYPES
+
+
+def _type_lines(index, entity_types, with_names=True):
+    counts = index.type_counts
+    lines = []
+    for entity_type in sorted(entity_types, key=lambda t: -counts[t])[:MAX_SUMMARY_TYPES]:
+        lines.append(f"- {entity_type}: {counts[entity_type]}")
+        if with_names:
+            names = index.element_names(entity_type)
+            if names and names != [("Unnamed", counts[entity_type])]:
+                lines.append("  names: " + "; ".join(f"{name} x{count}" for name, count in names))
+    return lines
+
+
+def _material_lines(index, element_types=None):
+    lines = []
+    usage = index.material_usage()
+    for name, types in sorted(usage.items(), key=lambda item: -sum(item[1].values()))[:MAX_MATERIALS]:
+        if element_types is not None:
+            types = Counter({t: c for t, c in types.items() if t in element_types})
+            if not types:
+                continue
+        used_by = ", ".join(f"{t} x{c}" for t, c in types.most_common(6))
+        lines.append(f"- {name}: used by {used_by}")
+    unused = [index.attribute(entity, 0) for entity in index.entities("IFCMATERIAL")]
+    unused = [name for name in unused if name and not any(key.startswith(name) for key in usage)]
+    if unused and element_types is None:
+        lines.append(f"- Defined but not assigned: {', '.join(sorted(set(unused))[:MAX_MATERIALS])}")
+    return lines
+
+
+def _property_lines(index, element_types=None):
+    lines = []
+    psets = index.property_sets(element_types)
+    for name, summary in sorted(psets.items(), key=lambda item: -item[1]["count"])[:MAX_PROPERTY_SETS]:
+        lines.append(f"- {name} (x{summary['count']})")
+        for prop, values in summary["properties"].items():
+            shown = "; ".join(f"{value or '(empty)'} x{count}" for value, count in values.most_common(MAX_VALUES_PER_PROPERTY))
+            more = f"; +{len(values) - MAX_VALUES_PER_PROPERTY} more" if len(values) > MAX_VALUES_PER_PROPERTY else ""
+            lines.append(f"  {prop}: {shown}{more}")
+    return lines
+
+
+def summarize_ifc(index, analysis_type="General Overview"):
+    """
+    Build a compact, pre-aggregated model summary for an analysis prompt.
+
+    Args:
+        index: IFCIndex of the model
+        analysis_type: "General Overview", "Material Analysis",
+            "Structural Components", "Building Systems" or "Custom Analysis"
+
+    Returns:
+        str: Summary text
+    """
+    counts = index.type_counts
+    element_types = {t for t in index.rooted_types if _is_element_type(t)}
+    structural_types = element_types & STRUCTURAL_TYPES
+    system_types = {t for t in element_types if _is_system_type(t)}
+
+    file_name = index.header.get("FILE_NAME", [])
+    sections = [
+        "MODEL",
+        f"- Schema: {index.schema}",
+        f"- File: {file_name[0] if file_name else 'unknown'}",
+        f"- Entity instances: {len(index)} ({len(counts)} types)",
+    ]
+    if len(file_name) > 5 and file_name[5]:
+        sections.append(f"- Authoring application: {file_name[5]}")
+
+    spatial = index.spatial_structure()
+    if spatial:
+        sections.append("\nSPATIAL STRUCTURE")
+        for entity_type, name, elevation in spatial:
+            level = f" (elevation {elevation:g})" if elevation is not None else ""
+            sections.append(f"- {entity_type}: {name}{level}")
+        if counts["IFCSPACE"]:
+            sections.append(f"- IFCSPACE: {counts['IFCSPACE']}")
+
+    if analysis_type == "Material Analysis":
+        sections.append("\nELEMENT COUNTS")
+        sections.extend(_type_lines(index, element_types, with_names=False))
+        sections.append("\nMATERIALS (name: element types using it)")
+        sections.extend(_material_lines(index) or ["- No materials assigned"])
+        material_psets = {name: s for name, s in index.property_sets().items() if "material" in name.lower()}
+        if material_psets:
+            sections.append("\nMATERIAL PROPERTY SETS")
+            sections.extend(f"- {name} (x{s['count']})" for name, s in material_psets.items())
+    elif analysis_type == "Structural Components":
+        sections.append("\nSTRUCTURAL ELEMENTS")
+        sections.extend(_type_lines(index, structural_types) or ["- None found"])
+        sections.append("\nSTRUCTURAL MATERIALS")
+        sections.extend(_material_lines(index, structural_types) or ["- No materials assigned"])
+        sections.append("\nSTRUCTURAL PROPERTY SETS")
+        sections.extend(_property_lines(index, structural_types) or ["- None"])
+    elif analysis_type == "Building Systems":
+        sections.append("\nSYSTEM ELEMENTS")
+        sections.extend(_type_lines(index, system_types) or ["- None found"])
+        groups = Counter()
+        for relation in index.entities("IFCRELASSIGNSTOGROUP"):
+            group = index.attribute(relation, 6)
+            if isinstance(group, EntityRef):
+                groups[f"{index.type_of(group, '')}: {index.name(group) or 'Unnamed'}"] += len(index.attribute(relation, 4, []))
+        if groups:
+            sections.append("\nSYSTEMS AND GROUPS (members)")
+            sections.extend(f"- {group}: {members}" for group, members in groups.most_common(MAX_SUMMARY_TYPES))
+        sections.append("\nSYSTEM PROPERTY SETS")
+        sections.extend(_property_lines(index, system_types) or ["- None"])
+    else:
+        sections.append("\nELEMENT COUNTS AND NAMES")
+        sections.extend(_type_lines(index, element_types))
+        sections.append("\nMATERIALS")
+        sections.extend(_material_lines(index) or ["- No materials assigned"])
+        sections.append("\nPROPERTY SETS")
+        sections.extend(_property_lines(index) or ["- None"])
+
+    return "\n".join(sections)
@@ -1,37 +1,437 @@
 """PDF processing utilities for extracting text from PDF files."""
+import json
+import os
+import threading
 import pypdf as PyPDF2
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from io import BytesIO
 
+from utils.cache_utils import get_cache, make_cache_key
+from utils.text_utils import DEFAULT_STEPS, normalize_pages
 
-def extract_text_from_pdf(pdf_file, max_chars=200000):
+
+# Size cap for the extracted-text cache (override with AI_PROJECT_PDF_CACHE_MB)
+PDF_CACHE_MAX_BYTES = int(os.environ.get("AI_PROJECT_PDF_CACHE_MB", "512")) * 1024 * 1024
+
+# Documents with fewer pages than this are always extracted serially
+PARALLEL_MIN_PAGES = 32
+
+# Page batches handed to each worker per round; more batches let the
+# max_chars cutoff stop work earlier, fewer reduce scheduling overhead
+BATCHES_PER_WORKER = 4
+
+# Per-process reader used by parallel extraction workers
+_worker_reader = None
+
+
+def _init_extraction_worker(pdf_bytes):
+    """Parse the PDF once in each worker process."""
+    global _worker_reader
+    _worker_reader = PyPDF2.PdfReader(BytesIO(pdf_bytes))
+
+
+def _extract_page_range(start, stop):
+    """Extract text for pages [start, stop) in a worker process."""
+    return [_worker_reader.pages[i].extract_text() for i in range(start, stop)]
+
+
+def _extract_document_text(pdf_bytes, max_chars, normalize):
+    """Extract (and cache) a whole document's text in a worker process."""
+    return PDFDocument(pdf_bytes).extract_text(max_chars=max_chars, normalize=normalize)
+
+
+def _read_pdf_bytes(pdf_file):
+    """Return the full contents of an uploaded file or bytes object."""
+    if isinstance(pdf_file, (bytes, bytearray)):
+        return bytes(pdf_file)
+    if hasattr(pdf_file, "getvalue"):
+        # Streamlit UploadedFile / BytesIO: independent of the read position
+        return pdf_file.getvalue()
+    return pdf_file.read()
+
+
+class PDFDocument:
     """
-    Extract text from a PDF file.
+    A parsed PDF upload.
+
+    The PDF is parsed at most once; page count and file size are available
+    immediately and page text is extracted lazily on first access.
+    """
+
+    def __init__(self, pdf_bytes, file_name=""):
+        """
+        Initialize the document.
+
+        Args:
+            pdf_bytes: Raw PDF file contents
+            file_name: Original file name, for display
+        """
+        self.pdf_bytes = pdf_bytes
+        self.file_name = file_name
+        self.file_size = len(pdf_bytes)
+        self._reader = None
+        self._content_hash = None
+        self._page_texts = {}
+        self._reports = {}
+
+    @property
+    def reader(self):
+        """pypdf reader over the document, created on first use."""
+        if self._reader is None:
+            self._reader = PyPDF2.PdfReader(BytesIO(self.pdf_bytes))
+        return self._reader
+
+    @property
+    def page_count(self):
+        """Number of pages in the document."""
+        return len(self.reader.pages)
+
+    @property
+    def content_hash(self):
+        """Content hash of the PDF bytes, used in cache keys."""
+        if self._content_hash is None:
+            self._content_hash = make_cache_key(self.pdf_bytes)
+        return self._content_hash
+
+    def page_text(self, page_num):
+        """
+        Get the text of a single page.
+
+        Args:
+            page_num: Zero-based page index
+
+        Returns:
+            str: Extracted page text
+        """
+        if page_num not in self._page_texts:
+            self._page_texts[page_num] = self.reader.pages[page_num].extract_text()
+        return self._page_texts[page_num]
+
+    def info(self):
+        """
+        Get information about the document.
+
+        Returns:
+            dict: PDF information including page count and file size
+        """
+        return {
+            "page_count": self.page_count,
+            "file_size": self.file_size,
+            "file_name": self.file_name
+        }
+
+    def _iter_page_texts_parallel(self, max_workers):
+        """
+        Yield page texts in page order, extracting them in a process pool.
+
+        Pages are split into contiguous batches that are submitted up front
+        and collected in order. Abandoning the generator (e.g. when
+        max_chars is reached) cancels batches that have not started.
+        """
+        page_count = self.page_count
+        batch_size = max(1, -(-page_count // (max_workers * BATCHES_PER_WORKER)))
+
+        executor = ProcessPoolExecutor(
+            max_workers=max_workers,
+            initializer=_init_extraction_worker,
+            initargs=(self.pdf_bytes,)
+        )
+        try:
+            futures = [
+                (start, executor.submit(_extract_page_range, start, min(start + batch_size, page_count)))
+                for start in range(0, page_count, batch_size)
+            ]
+            for start, future in futures:
+                for offset, page_text in enumerate(future.result()):
+                    self._page_texts[start + offset] = page_text
+                    yield page_text
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def iter_pages(self, parallel=False, max_workers=None):
+        """
+        Extract pages one at a time, in order.
+
+        Args:
+            parallel: Split pages across a process pool; documents shorter
+                than PARALLEL_MIN_PAGES are still extracted serially
+            max_workers: Worker processes for parallel mode (default: CPU count)
+
+        Yields:
+            tuple: (page_number, page_text), with 1-based page numbers
+        """
+        max_workers = max_workers or os.cpu_count() or 1
+        if parallel and max_workers > 1 and self.page_count >= PARALLEL_MIN_PAGES:
+            page_texts = self._iter_page_texts_parallel(max_workers)
+        else:
+            page_texts = (self.page_text(page_num) for page_num in range(self.page_count))
+
+        try:
+            for page_num, page_text in enumerate(page_texts):
+                yield page_num + 1, page_text
+        finally:
+            page_texts.close()
+
+    def _text_cache_key(self, max_chars, normalize):
+        return make_cache_key(
+            self.content_hash,
+            f"pypdf={PyPDF2.__version__}",
+            f"max_chars={max_chars}",
+            f"normalize={','.join(DEFAULT_STEPS) if normalize else ''}"
+        )
+
+    def _cached_entry(self, max_chars, normalize):
+        cached = get_cache("pdf_text", PDF_CACHE_MAX_BYTES).get(self._text_cache_key(max_chars, normalize))
+        return None if cached is None else json.loads(cached.decode("utf-8"))
+
+    def cached_text(self, max_chars=200000, normalize=True):
+        """
+        Get previously extracted text without extracting.
+
+        Args:
+            max_chars: Maximum number of characters the text was extracted with
+            normalize: Whether the text was normalized
+
+        Returns:
+            str: Cached text, or None if this document was not extracted yet
+        """
+        entry = self._cached_entry(max_chars, normalize)
+        return None if entry is None else entry["text"]
+
+    def normalization_report(self, max_chars=200000):
+        """
+        Get the token savings of each normalization step for this document.
+
+        Args:
+            max_chars: Maximum number of characters the text was extracted with
+
+        Returns:
+            list: Report from normalize_pages, or None if the document was
+                not extracted (and cached) with normalization
+        """
+        if max_chars in self._reports:
+            return self._reports[max_chars]
+        entry = self._cached_entry(max_chars, True)
+        return None if entry is None else entry["report"]
+
+    def extract_text(self, max_chars=200000, use_cache=True, parallel=False, max_workers=None,
+                     on_page=None, normalize=True):
+        """
+        Extract text from the document.
+
+        Results are cached on disk keyed on the PDF bytes and extraction
+        settings, so re-uploading the same file returns immediately.
+
+        Args:
+            max_chars: Maximum number of characters to extract (default: 200000)
+            use_cache: Whether to read from and write to the extraction cache
+            parallel: Split pages across a process pool; documents shorter
+                than PARALLEL_MIN_PAGES are still extracted serially
+            max_workers: Worker processes for parallel mode (default: CPU count)
+            on_page: Optional callback called with each page number as it is
+                extracted (not called on a cache hit)
+            normalize: Strip running headers and footers, rejoin hyphenation
+                and normalize unicode and whitespace (see normalize_pages)
+
+        Returns:
+            str: Extracted text from the PDF
+        """
+        try:
+            if use_cache:
+                cached = self.cached_text(max_chars, normalize)
+                if cached is not None:
+                    return cached
+
+            pages = self.iter_pages(parallel=parallel, max_workers=max_workers)
+            report = []
+            if normalize and DEFAULT_STEPS:
+                text, report = normalize_pages(collect_pages(pages, max_chars, on_page))
+                if max_chars is not None and len(text) > max_chars:
+                    text = text[:max_chars]
+                self._reports[max_chars] = report
+            else:
+                text = collect_page_text(pages, max_chars=max_chars, on_page=on_page)
+
+            if use_cache:
+                entry = json.dumps({"text": text, "report": report})
+                get_cache("pdf_text", PDF_CACHE_MAX_BYTES).set(
+                    self._text_cache_key(max_chars, normalize), entry.encode("utf-8"))
+            return text
+        except Exception as e:
+            raise Exception(f"Error extracting text from PDF: {str(e)}")
+
+
+def collect_pages(pages, max_chars=200000, on_page=None):
+    """
+    Gather streamed page texts, stopping once max_chars is reached.
 
     Args:
-        pdf_file: File object or bytes from Streamlit file uploader
-        max_chars: Maximum number of characters to extract (default: 200000)
+        pages: Iterable of (page_number, page_text), e.g. PDFDocument.iter_pages()
+        max_chars: Characters after which no further pages are read (None for no limit)
+        on_page: Optional callback called with each page number
 
     Returns:
-        str: Extracted text from the PDF
+        list: Page texts, in order
+    """
+    texts = []
+    total_chars = 0
+    for page_number, page_text in pages:
+        texts.append(page_text)
+        total_chars += len(page_text) + 1
+
+        if on_page:
+            on_page(page_number)
+
+        if max_chars is not None and total_chars >= max_chars:
+            if hasattr(pages, "close"):
+                pages.close()
+            break
+
+    return texts
+
+
+def collect_page_text(pages, max_chars=200000, on_page=None):
+    """
+    Join streamed pages into the document text.
+
+    Page texts are accumulated in a list and joined once, so building the
+    result is linear in the document size. Iteration stops as soon as
+    max_chars is reached.
+
+    Args:
+        pages: Iterable of (page_number, page_text), e.g. PDFDocument.iter_pages()
+        max_chars: Maximum number of characters to keep (None for no limit)
+        on_page: Optional callback called with each page number
+
+    Returns:
+        str: The joined, truncated and stripped text
+    """
+    text = "\n".join(collect_pages(pages, max_chars, on_page))
+    if max_chars is not None and len(text) > max_chars:
+        text = text[:max_chars]
+    return text.strip()
+
+
+# Parsed uploads, keyed on the uploader's file id (most recent last)
+_DOCUMENT_MEMO_SIZE = 16
+_documents = OrderedDict()
+_documents_lock = threading.Lock()
+
+
+def load_pdf_document(pdf_file):
+    """
+    Get the parsed document for an upload, parsing it only once.
+
+    Documents are memoized by the Streamlit uploader's file id, so reruns
+    and widget clicks reuse the existing parse instead of re-reading the PDF.
+
+    Args:
+        pdf_file: File object from Streamlit file uploader
+
+    Returns:
+        PDFDocument: The parsed document
     """
     try:
-        # Create a PDF reader object
-        pdf_reader = PyPDF2.PdfReader(BytesIO(pdf_file.read()))
+        memo_key = getattr(pdf_file, "file_id", None)
+        if memo_key is None:
+            return PDFDocument(_read_pdf_bytes(pdf_file), getattr(pdf_file, "name", ""))
+
+        with _documents_lock:
+            if memo_key in _documents:
+                _documents.move_to_end(memo_key)
+                return _documents[memo_key]
 
-        # Extract text from all pages
-        text = ""
-        for page_num, page in enumerate(pdf_reader.pages):
-            page_text = page.extract_text()
-            text += page_text + "\n"
+        document = PDFDocument(_read_pdf_bytes(pdf_file), pdf_file.name)
+        # Parse now so a corrupt upload fails here rather than on first use
+        document.page_count
 
-            # Check if we've exceeded max characters
-            if len(text) >= max_chars:
-                text = text[:max_chars]
-                break
+        with _documents_lock:
+            _documents[memo_key] = document
+            while len(_documents) > _DOCUMENT_MEMO_SIZE:
+                _documents.popitem(last=False)
+        return document
+    except Exception as e:
+        raise Exception(f"Error reading PDF: {str(e)}")
+
+
+def extract_texts(documents, max_chars=200000, max_workers=None, on_document=None, normalize=True):
+    """
+    Extract several documents concurrently.
+
+    Documents already in the extraction cache return immediately. A single
+    remaining document is extracted with page-level parallelism; several
+    are extracted one per worker process, so wall time is close to the
+    slowest document rather than the sum of all of them.
+
+    Args:
+        documents: List of PDFDocument
+        max_chars: Maximum number of characters per document (None for no limit)
+        max_workers: Worker processes (default: CPU count)
+        on_document: Optional callback(done, total) as each document finishes
+        normalize: Normalize each document's text (see PDFDocument.extract_text)
 
-        return text.strip()
+    Returns:
+        list: Extracted text per document, in input order
+    """
+    try:
+        texts = [document.cached_text(max_chars, normalize) for document in documents]
+        pending = [index for index, text in enumerate(texts) if text is None]
+        done = len(documents) - len(pending)
+        if on_document and done:
+            on_document(done, len(documents))
+
+        max_workers = max_workers or os.cpu_count() or 1
+        if len(pending) == 1 or max_workers == 1:
+            for index in pending:
+                texts[index] = documents[index].extract_text(max_chars=max_chars, parallel=True, max_workers=max_workers,
+                                                             normalize=normalize)
+                done += 1
+                if on_document:
+                    on_document(done, len(documents))
+        elif pending:
+            with ProcessPoolExecutor(max_workers=min(max_workers, len(pending))) as executor:
+                futures = {
+                    executor.submit(_extract_document_text, documents[index].pdf_bytes, max_chars, normalize): index
+                    for index in pending
+                }
+                for future in as_completed(futures):
+                    texts[futures[future]] = future.result()
+                    done += 1
+                    if on_document:
+                        on_document(done, len(documents))
+        return texts
     except Exception as e:
-        raise Exception(f"Error extracting text from PDF: {str(e)}")
+        raise Exception(f"Error extracting text from PDFs: {str(e)}")
+
+
+def extract_text_from_pdf(pdf_file, max_chars=200000, use_cache=True, parallel=False, max_workers=None,
+                          normalize=True):
+    """
+    Extract text from a PDF file.
+
+    Args:
+        pdf_file: File object or bytes from Streamlit file uploader
+        max_chars: Maximum number of characters to extract (default: 200000)
+        use_cache: Whether to read from and write to the extraction cache
+        parallel: Extract pages in a process pool (see PDFDocument.extract_text)
+        max_workers: Worker processes for parallel mode (default: CPU count)
+        normalize: Normalize the extracted text (see PDFDocument.extract_text)
+
+    Returns:
+        str: Extracted text from the PDF
+    """
+    if isinstance(pdf_file, (bytes, bytearray)):
+        document = PDFDocument(bytes(pdf_file))
+    else:
+        document = load_pdf_document(pdf_file)
+    return document.extract_text(
+        max_chars=max_chars,
+        use_cache=use_cache,
+        parallel=parallel,
+        max_workers=max_workers,
+        normalize=normalize
+    )
 
 
 def get_pdf_info(pdf_file):
@@ -45,17 +445,6 @@ def get_pdf_info(pdf_file):
         dict: PDF information including page count and file size
     """
     try:
-        # Read file into bytes
-        pdf_bytes = pdf_file.read()
-        pdf_reader = PyPDF2.PdfReader(BytesIO(pdf_bytes))
-
-        # Reset file pointer for future reads
-        pdf_file.seek(0)
-
-        return {
-            "page_count": len(pdf_reader.pages),
-            "file_size": len(pdf_bytes),
-            "file_name": pdf_file.name
-        }
+        return load_pdf_document(pdf_file).info()
     except Exception as e:
         raise Exception(f"Error getting PDF info: {str(e)}")
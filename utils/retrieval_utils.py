@@ -0,0 +1,255 @@
+"""Local BM25 passage retrieval for focusing prompts on relevant clauses."""
+import math
+import re
+from collections import Counter, defaultdict
+
+from utils.chunked_analysis import SECTION_HEADING, estimate_tokens, _split_blocks, _split_oversized
+
+
+# BM25 term-frequency saturation and length normalization
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+# Passages longer than this are split; shorter blocks of one clause are merged up to it
+MAX_PASSAGE_CHARS = 1500
+
+# Passages retrieved per analysis, and the token budget they may fill
+DEFAULT_TOP_K = 15
+DEFAULT_RETRIEVAL_TOKENS = 4000
+
+# Leading passages always kept: the parties, recitals and definitions are there
+LEAD_PASSAGES = 2
+
+# Contracts shorter than this are sent whole; retrieval would save little
+MIN_RETRIEVAL_TOKENS = 6000
+
+# Clause number at the start of a heading: "12.3", "12.3.1(a)", "Section 5", "ARTICLE V", "Clause 7"
+CLAUSE_NUMBER = re.compile(
+    r"^\s*(?:"
+    r"(?P<number>\d+(?:\.\d+)*(?:\([a-z0-9]+\))?)\.?\s"
+    r"|(?P<word>(?:SECTION|ARTICLE|CLAUSE|PART|APPENDIX|EXHIBIT|SCHEDULE)\s+[0-9IVXLC]+(?:\.\d+)*)"
+    r")",
+    re.IGNORECASE
+)
+
+TERM = re.compile(r"[a-z0-9]+")
+
+STOPWORDS = frozenset("""
+a an and any are as at be been by for from has have if in into is it its of on or
+such that the their then there these this those to under upon was were which will with
+""".split())
+
+# Search terms for each Contract Helper analysis type
+ANALYSIS_QUERIES = {
+    "Contract Summary": (
+        "agreement parties between purpose scope work term commencement effective date "
+        "duration termination expiry contract sum price milestone completion"
+    ),
+    "Key Clauses Extraction": (
+        "payment terms invoice price delivery performance warranty guarantee defects "
+        "liability indemnify indemnification limitation termination dispute resolution arbitration"
+    ),
+    "Obligations & Responsibilities": (
+        "shall must obligation responsible responsibility duty contractor owner client supplier "
+        "provide perform deadline within days milestone standard comply"
+    ),
+    "Risk Assessment": (
+        "liability indemnify damages liquidated penalty risk insurance force majeure delay "
+        "termination default breach limitation consequential warranty retention bond"
+    ),
+    "Compliance Review": (
+        "comply compliance law regulation code standard permit license insurance confidentiality "
+        "governing law notice amendment assignment waiver audit"
+    ),
+}
+
+# Prompt heading for retrieved passages
+EXCERPT_LABEL = ("CONTRACT EXCERPTS (the passages most relevant to this analysis, with clause numbers; "
+                 "[...] marks omitted text)")
+
+
+def analysis_query(analysis_type, custom_instructions=""):
+    """
+    Pick the retrieval query for a Contract Helper analysis type.
+
+    Args:
+        analysis_type: Analysis type
+        custom_instructions: Custom instructions, used as the query for Custom Analysis
+
+    Returns:
+        str: Search terms for BM25Index.retrieve
+    """
+    return ANALYSIS_QUERIES.get(analysis_type) or custom_instructions or ANALYSIS_QUERIES["Key Clauses Extraction"]
+
+
+def _stem(term):
+    """Strip common English suffixes so "payments" matches "payment"."""
+    if len(term) > 4:
+        if term.endswith("ies"):
+            return term[:-3] + "y"
+        for suffix in ("ing", "ed", "es", "s"):
+            if term.endswith(suffix) and not term.endswith("ss"):
+                return term[:-len(suffix)]
+    return term
+
+
+def tokenize(text):
+    """
+    Split text into lowercase, stemmed search terms without stopwords.
+
+    Args:
+        text: Text to tokenize
+
+    Returns:
+        list: Terms in order
+    """
+    return [_stem(term) for term in TERM.findall(text.lower()) if term not in STOPWORDS]
+
+
+def split_passages(text, max_chars=MAX_PASSAGE_CHARS):
+    """
+    Split a contract into passages labelled with their clause number.
+
+    Passages break at clause headings and paragraph breaks; short
+    paragraphs of the same clause are merged and long ones split, so
+    passages stay comparable in length.
+
+    Args:
+        text: Contract text
+        max_chars: Maximum characters per passage
+
+    Returns:
+        list: dicts with "position", "clause" (clause number or "") and "text"
+    """
+    passages = []
+    clause = ""
+    current = None
+    for block in _split_blocks(text):
+        match = CLAUSE_NUMBER.match(block) if SECTION_HEADING.match(block) else None
+        if match:
+            clause = (match.group("number") or match.group("word")).strip()
+        for piece in _split_oversized(block, max_chars):
+            if current and not match and current["clause"] == clause \
+                    and len(current["text"]) + len(piece) + 1 <= max_chars:
+                current["text"] += "\n" + piece
+                continue
+            current = {"position": len(passages), "clause": clause, "text": piece}
+            passages.append(current)
+            match = None
+    return passages
+
+
+class BM25Index:
+    """
+    Okapi BM25 inverted index over the passages of one document.
+
+    Built once per document; each search only touches the postings of
+    the query's terms.
+    """
+
+    def __init__(self, passages, k1=BM25_K1, b=BM25_B):
+        """
+        Build the index.
+
+        Args:
+            passages: Passages from split_passages
+            k1: Term-frequency saturation
+            b: Length normalization
+        """
+        self.passages = passages
+        self.k1 = k1
+        self.b = b
+        self.postings = defaultdict(list)
+        self.lengths = []
+        for position, passage in enumerate(passages):
+            terms = Counter(tokenize(passage["text"]))
+            for term, count in terms.items():
+                self.postings[term].append((position, count))
+            self.lengths.append(sum(terms.values()))
+        self.average_length = (sum(self.lengths) / len(self.lengths)) if self.lengths else 0.0
+        self.tokens = sum(estimate_tokens(passage["text"]) for passage in passages)
+
+    @classmethod
+    def from_text(cls, text, max_chars=MAX_PASSAGE_CHARS):
+        """Build an index over the passages of a text."""
+        return cls(split_passages(text, max_chars))
+
+    def __len__(self):
+        return len(self.passages)
+
+    def idf(self, term):
+        """Inverse document frequency of a term (never negative)."""
+        frequency = len(self.postings.get(term, ()))
+        return math.log(1 + (len(self.passages) - frequency + 0.5) / (frequency + 0.5))
+
+    def search(self, query, top_k=DEFAULT_TOP_K):
+        """
+        Rank passages against a query.
+
+        Args:
+            query: Query text
+            top_k: Maximum passages to return
+
+        Returns:
+            list: (score, position) tuples, best first
+        """
+        scores = defaultdict(float)
+        average_length = self.average_length or 1.0
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = self.idf(term)
+            for position, count in postings:
+                norm = self.k1 * (1 - self.b + self.b * self.lengths[position] / average_length)
+                scores[position] += idf * count * (self.k1 + 1) / (count + norm)
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+        return [(score, position) for position, score in ranked[:top_k]]
+
+    def retrieve(self, query, top_k=DEFAULT_TOP_K, max_tokens=DEFAULT_RETRIEVAL_TOKENS, lead=LEAD_PASSAGES):
+        """
+        Select the passages most relevant to a query within a token budget.
+
+        Args:
+            query: Query text
+            top_k: Maximum passages retrieved by score
+            max_tokens: Token budget for all selected passages
+            lead: Leading passages always included (parties, recitals)
+
+        Returns:
+            list: Selected passages in document order
+        """
+        selected = set()
+        used = 0
+        candidates = list(range(min(lead, len(self.passages))))
+        candidates += [position for _, position in self.search(query, top_k)]
+        for position in candidates:
+            if position in selected:
+                continue
+            cost = estimate_tokens(self.passages[position]["text"])
+            if used + cost > max_tokens:
+                continue
+            selected.add(position)
+            used += cost
+        return [self.passages[position] for position in sorted(selected)]
+
+
+def format_passages(passages):
+    """
+    Render passages for a prompt, keeping clause numbers and marking gaps.
+
+    Args:
+        passages: Passages in document order
+
+    Returns:
+        str: Passages separated by blank lines, "[...]" between non-adjacent ones
+    """
+    blocks = []
+    previous = None
+    for passage in passages:
+        if previous is not None and passage["position"] != previous + 1:
+            blocks.append("[...]")
+        label = f"[Clause {passage['clause']}] " if passage["clause"] and not CLAUSE_NUMBER.match(passage["text"]) else ""
+        blocks.append(f"{label}{passage['text']}")
+        previous = passage["position"]
+    return "\n\n".join(blocks)
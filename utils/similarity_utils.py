@@ -0,0 +1,652 @@
+"""Clause segmentation, fingerprints and near-duplicate matching."""
+import difflib
+import hashlib
+import re
+import zlib
+from collections import defaultdict
+
+import numpy as np
+
+from utils.chunked_analysis import estimate_tokens, _split_blocks, _split_oversized
+
+
+# Words per shingle for MinHash
+SHINGLE_WORDS = 3
+
+# MinHash permutations; 64 gives a Jaccard estimate within about +/-0.12
+MINHASH_PERMUTATIONS = 64
+MINHASH_SEED = 20240601
+_MERSENNE_PRIME = (1 << 31) - 1
+
+# Estimated Jaccard similarity above which two clauses are the same clause, edited
+NEAR_MATCH_THRESHOLD = 0.5
+
+# Words of unchanged context kept around each edit in a compact diff
+DIFF_CONTEXT_WORDS = 6
+
+# LSH bands over the MinHash signature; 16 bands of 4 rows surface pairs from about 0.5 similarity
+LSH_BANDS = 16
+
+# Paragraphs at least this similar are the same boilerplate
+BOILERPLATE_THRESHOLD = 0.8
+
+# Paragraphs shorter than this are never collapsed (headings, captions, table rows)
+MIN_BOILERPLATE_WORDS = 20
+
+# Longest paragraph considered as one unit
+MAX_PARAGRAPH_CHARS = 2000
+
+# Clause start: "12.3 ...", "12. ...", "12 TITLE", "ARTICLE 5", "Clause 7.1"
+CLAUSE_START = re.compile(
+    r"^\s*(?:"
+    r"(?P<number>\d+(?:\.\d+)+\.?|\d+\.|\d+(?=\s+[A-Z]))"
+    r"|(?P<word>(?:ARTICLE|SECTION|CLAUSE)\s+(?:\d+(?:\.\d+)*|[IVXLC]+)\.?)"
+    r")\s+(?P<rest>\S.*)$",
+    re.IGNORECASE
+)
+
+CLAUSE_NUMBER_PREFIX = re.compile(
+    r"^\s*(?:\d+(?:\.\d+)*\.?|(?:ARTICLE|SECTION|CLAUSE)\s+(?:\d+(?:\.\d+)*|[IVXLC]+)\.?)\s+", re.IGNORECASE
+)
+
+# Defined term paragraph: '"Owner" means ...'
+DEFINED_TERM = re.compile(r"^\s*[\"“']([A-Z][^\"”']{0,60})[\"”']\s+(?:means|shall mean|has the meaning|includes|refers to)\b")
+
+WORD = re.compile(r"[a-z0-9]+")
+
+# Tokens of a compact diff: "[-removed-]", "{+added+}" or a word ("..." skips unchanged words)
+DIFF_TOKEN = re.compile(r"\[-(.*?)-\]|\{\+(.*?)\+\}|(\S+)")
+
+# A collapsed paragraph: "[Shared text S3]" or "[Shared text S3, with edits: ...]"
+SHARED_MARKER = re.compile(r"^\[Shared text (S\d+)(?:, with edits: (.*))?\]$")
+
+# Heading of a shared copy in the shared text: "S3 (appears in PROPOSAL A, PROPOSAL B):"
+SHARED_HEADING = re.compile(r"^(S\d+) \(appears in [^\n]*\):\n", re.MULTILINE)
+
+# Candidate readings kept while re-applying a compact diff before giving up
+MAX_DIFF_READINGS = 1000
+
+# Heading for a clause comparison in a prompt
+CLAUSE_COMPARISON_NOTE = (
+    "The contracts were segmented into clauses and matched locally. Clauses with the same wording in both are only "
+    "listed; changed clauses are given as word-level edits from Contract 1 to Contract 2, or in full when rewritten; "
+    "clauses found in only one contract are given in full."
+)
+
+
+def _words(text):
+    return WORD.findall(text.lower())
+
+
+def _title_of(rest):
+    """The heading text of a clause line, if it reads like a title rather than a sentence."""
+    title = rest.strip()
+    if len(title) <= 80 and not title.endswith((".", ",", ";", ":")):
+        return title
+    return ""
+
+
+def segment_clauses(text):
+    """
+    Split a contract into clauses at numbered headings and defined terms.
+
+    Args:
+        text: Contract text
+
+    Returns:
+        list: dicts with "label" (clause number and title, or defined
+            term), "key" (label normalized for pairing), "text" and "body"
+            (the text without its clause number)
+    """
+    clauses = []
+    current = {"label": "(Preamble)", "key": "preamble", "lines": []}
+
+    def start(label, key):
+        nonlocal current
+        if current["lines"]:
+            clauses.append(current)
+        current = {"label": label, "key": key, "lines": []}
+
+    for line in text.splitlines():
+        if not line.strip():
+            continue
+        clause = CLAUSE_START.match(line)
+        term = DEFINED_TERM.match(line)
+        if clause:
+            number = (clause.group("number") or clause.group("word")).rstrip(".")
+            title = _title_of(clause.group("rest"))
+            start(f"{number} {title}".strip(), " ".join(_words(title)) or number.lower())
+        elif term:
+            start(f'Definition "{term.group(1)}"', "def " + " ".join(_words(term.group(1))))
+        current["lines"].append(" ".join(line.split()))
+    if current["lines"]:
+        clauses.append(current)
+
+    result = []
+    for clause in clauses:
+        text = "\n".join(clause["lines"])
+        # Fingerprints ignore the clause number, so renumbering is not a change
+        body = CLAUSE_NUMBER_PREFIX.sub("", text, count=1)
+        result.append({"label": clause["label"], "key": clause["key"], "text": text, "body": body})
+    return result
+
+
+def exact_fingerprint(text):
+    """
+    Fingerprint of a text that ignores only how it is spaced and wrapped.
+
+    Case, punctuation and signs are kept: "$1,500.00" and "$1.500,00",
+    or "5%" and "-5%", are different wording. The looser word
+    normalization is only used to find candidate pairs (shingles).
+
+    Args:
+        text: Text to fingerprint
+
+    Returns:
+        str: Hex digest
+    """
+    return hashlib.blake2b(" ".join(text.split()).encode("utf-8"), digest_size=16).hexdigest()
+
+
+def shingles(text, size=SHINGLE_WORDS):
+    """
+    Word shingles of a text.
+
+    Args:
+        text: Text to shingle
+        size: Words per shingle
+
+    Returns:
+        set: Shingle strings (the whole text if it has fewer words)
+    """
+    words = _words(text)
+    if len(words) <= size:
+        return {" ".join(words)} if words else set()
+    return {" ".join(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+class MinHasher:
+    """MinHash signatures over word shingles, using one fixed set of permutations."""
+
+    def __init__(self, permutations=MINHASH_PERMUTATIONS, seed=MINHASH_SEED, shingle_words=SHINGLE_WORDS):
+        """
+        Initialize the hasher.
+
+        Args:
+            permutations: Signature length
+            seed: Seed of the permutation coefficients (signatures are only
+                comparable between hashers with the same seed)
+            shingle_words: Words per shingle
+        """
+        rng = np.random.default_rng(seed)
+        self.a = rng.integers(1, _MERSENNE_PRIME, size=permutations, dtype=np.uint64)
+        self.b = rng.integers(0, _MERSENNE_PRIME, size=permutations, dtype=np.uint64)
+        self.shingle_words = shingle_words
+
+    def signature(self, text):
+        """
+        MinHash signature of a text.
+
+        Args:
+            text: Text to sign
+
+        Returns:
+            ndarray: uint64 signature, all _MERSENNE_PRIME for empty text
+        """
+        values = shingles(text, self.shingle_words)
+        if not values:
+            return np.full(len(self.a), _MERSENNE_PRIME, dtype=np.uint64)
+        hashes = np.fromiter((zlib.crc32(value.encode("utf-8")) for value in values),
+                             dtype=np.uint64, count=len(values))
+        return ((hashes[:, None] * self.a + self.b) % _MERSENNE_PRIME).min(axis=0)
+
+    @staticmethod
+    def similarity(signature_a, signature_b):
+        """Estimated Jaccard similarity of the texts behind two signatures."""
+        return float(np.mean(signature_a == signature_b))
+
+
+def compact_diff(old_text, new_text, context=DIFF_CONTEXT_WORDS):
+    """
+    Word-level diff of two versions of a clause.
+
+    Args:
+        old_text: First version
+        new_text: Second version
+        context: Unchanged words kept around each edit
+
+    Returns:
+        str: Edits as "[-removed-]" and "{+added+}" with surrounding words,
+            "..." marking skipped unchanged text
+    """
+    old_words = old_text.split()
+    new_words = new_text.split()
+    matcher = difflib.SequenceMatcher(None, old_words, new_words, autojunk=False)
+    parts = []
+    opcodes = matcher.get_opcodes()
+    for position, (tag, i1, i2, j1, j2) in enumerate(opcodes):
+        if tag == "equal":
+            words = old_words[i1:i2]
+            first, last = position == 0, position == len(opcodes) - 1
+            if len(words) > 2 * context or (first and len(words) > context) or (last and len(words) > context):
+                head = [] if first else words[:context]
+                tail = [] if last else words[-context:]
+                parts.append(" ".join(head + ["..."] + tail))
+            else:
+                parts.append(" ".join(words))
+            continue
+        if i2 > i1:
+            parts.append(f"[-{' '.join(old_words[i1:i2])}-]")
+        if j2 > j1:
+            parts.append(f"{{+{' '.join(new_words[j1:j2])}+}}")
+    return " ".join(part for part in parts if part)
+
+
+def match_clauses(clauses_a, clauses_b, threshold=NEAR_MATCH_THRESHOLD, hasher=None):
+    """
+    Pair the clauses of two contracts.
+
+    Clauses are paired by exact fingerprint first, then by MinHash
+    similarity so moved or renumbered clauses still pair up, and finally
+    by heading or defined term for clauses that were rewritten.
+
+    Args:
+        clauses_a: Clauses of the first contract (from segment_clauses)
+        clauses_b: Clauses of the second contract
+        threshold: Minimum estimated Jaccard similarity of a near match
+        hasher: MinHasher to use (a default one if None)
+
+    Returns:
+        dict: "identical" and "changed" lists of (index_a, index_b,
+            similarity), and "removed" / "added" lists of unpaired indexes
+    """
+    hasher = hasher or MinHasher()
+    fingerprints_b = {}
+    for index, clause in enumerate(clauses_b):
+        fingerprints_b.setdefault(exact_fingerprint(clause["body"]), []).append(index)
+
+    identical = []
+    paired_a = set()
+    paired_b = set()
+    for index, clause in enumerate(clauses_a):
+        candidates = [j for j in fingerprints_b.get(exact_fingerprint(clause["body"]), []) if j not in paired_b]
+        if candidates:
+            identical.append((index, candidates[0], 1.0))
+            paired_a.add(index)
+            paired_b.add(candidates[0])
+
+    open_a = [i for i in range(len(clauses_a)) if i not in paired_a]
+    open_b = [j for j in range(len(clauses_b)) if j not in paired_b]
+    changed = []
+    if open_a and open_b:
+        matrix_a = np.stack([hasher.signature(clauses_a[i]["body"]) for i in open_a])
+        matrix_b = np.stack([hasher.signature(clauses_b[j]["body"]) for j in open_b])
+        similarities = (matrix_a[:, None, :] == matrix_b[None, :, :]).mean(axis=2)
+
+        # Near matches wherever they moved to, most similar pairs first
+        rows, columns = np.nonzero(similarities >= threshold)
+        for row, column in sorted(zip(rows, columns), key=lambda pair: -similarities[pair]):
+            i, j = open_a[row], open_b[column]
+            if i not in paired_a and j not in paired_b:
+                changed.append((i, j, float(similarities[row, column])))
+                paired_a.add(i)
+                paired_b.add(j)
+
+        # Rewritten clauses still pair by heading or defined term
+        keys_b = {}
+        for column, j in enumerate(open_b):
+            keys_b.setdefault(clauses_b[j]["key"], []).append(column)
+        for row, i in enumerate(open_a):
+            if i in paired_a:
+                continue
+            columns = [column for column in keys_b.get(clauses_a[i]["key"], []) if open_b[column] not in paired_b]
+            if columns:
+                column = max(columns, key=lambda column: similarities[row, column])
+                changed.append((i, open_b[column], float(similarities[row, column])))
+                paired_a.add(i)
+                paired_b.add(open_b[column])
+
+    changed.sort()
+    return {
+        "identical": identical,
+        "changed": changed,
+        "removed": [i for i in range(len(clauses_a)) if i not in paired_a],
+        "added": [j for j in range(len(clauses_b)) if j not in paired_b],
+    }
+
+
+def compare_contracts(text_a, text_b, threshold=NEAR_MATCH_THRESHOLD):
+    """
+    Segment two contracts and pair their clauses.
+
+    Args:
+        text_a: First contract
+        text_b: Second contract
+        threshold: Minimum estimated Jaccard similarity of a near match
+
+    Returns:
+        dict: "clauses_a", "clauses_b" and the pairing from match_clauses
+    """
+    clauses_a = segment_clauses(text_a)
+    clauses_b = segment_clauses(text_b)
+    result = match_clauses(clauses_a, clauses_b, threshold)
+    result.update({"clauses_a": clauses_a, "clauses_b": clauses_b})
+    return result
+
+
+def clause_comparison_to_text(comparison, threshold=NEAR_MATCH_THRESHOLD):
+    """
+    Render a clause comparison for a prompt.
+
+    Identical clauses are listed by label only, near-identical clauses
+    are sent as word diffs, and rewritten, new and removed clauses whole.
+
+    Args:
+        comparison: Result of compare_contracts
+        threshold: Similarity below which a paired clause is sent whole
+
+    Returns:
+        str: Summary followed by changed, removed and added clauses
+    """
+    clauses_a = comparison["clauses_a"]
+    clauses_b = comparison["clauses_b"]
+    lines = [
+        f"CLAUSES: {len(clauses_a)} in Contract 1, {len(clauses_b)} in Contract 2; "
+        f"{len(comparison['identical'])} identical, {len(comparison['changed'])} changed, "
+        f"{len(comparison['removed'])} only in Contract 1, {len(comparison['added'])} only in Contract 2."
+    ]
+    if comparison["identical"]:
+        lines.append("IDENTICAL CLAUSES (same wording in both, not repeated): "
+                     + "; ".join(clauses_a[i]["label"] for i, _, _ in comparison["identical"]))
+
+    for i, j, similarity in comparison["changed"]:
+        clause_a, clause_b = clauses_a[i], clauses_b[j]
+        heading = clause_a["label"] if clause_a["label"] == clause_b["label"] \
+            else f"{clause_a['label']} (Contract 1) / {clause_b['label']} (Contract 2)"
+        lines.append("")
+        lines.append(f"=== CHANGED: {heading} ===")
+        if similarity >= threshold:
+            lines.append("Edits from Contract 1 to Contract 2 ([-removed-] {+added+}):")
+            lines.append(compact_diff(clause_a["body"], clause_b["body"]))
+        else:
+            lines.append("Contract 1:")
+            lines.append(clause_a["text"])
+            lines.append("Contract 2:")
+            lines.append(clause_b["text"])
+
+    for section, clauses, indexes in (("ONLY IN CONTRACT 1", clauses_a, comparison["removed"]),
+                                      ("ONLY IN CONTRACT 2", clauses_b, comparison["added"])):
+        for index in indexes:
+            lines.append("")
+            lines.append(f"=== {section}: {clauses[index]['label']} ===")
+            lines.append(clauses[index]["text"])
+
+    return "\n".join(lines)
+
+
+class LSHIndex:
+    """
+    Locality-sensitive hashing over MinHash signatures.
+
+    Each signature is cut into bands; texts sharing any whole band land in
+    the same bucket and become candidate pairs, so similar texts are found
+    without comparing every pair.
+    """
+
+    def __init__(self, bands=LSH_BANDS):
+        """
+        Initialize the index.
+
+        Args:
+            bands: Number of bands the signature is cut into
+        """
+        self.bands = bands
+        self.buckets = defaultdict(list)
+
+    def add(self, key, signature):
+        """
+        Add a signature and get the keys already sharing a bucket with it.
+
+        Args:
+            key: Identifier of the text
+            signature: MinHash signature
+
+        Returns:
+            set: Keys of earlier candidate matches
+        """
+        rows = len(signature) // self.bands
+        candidates = set()
+        for band in range(self.bands):
+            bucket = self.buckets[(band, signature[band * rows:(band + 1) * rows].tobytes())]
+            candidates.update(bucket)
+            bucket.append(key)
+        return candidates
+
+
+def split_paragraphs(text, max_chars=MAX_PARAGRAPH_CHARS):
+    """
+    Split a document into paragraphs at blank lines and headings.
+
+    Args:
+        text: Document text
+        max_chars: Longest paragraph; longer blocks are split on lines
+
+    Returns:
+        list: Paragraph strings in order
+    """
+    return [piece for block in _split_blocks(text) for piece in _split_oversized(block, max_chars)]
+
+
+def find_boilerplate(documents, threshold=BOILERPLATE_THRESHOLD, min_words=MIN_BOILERPLATE_WORDS, hasher=None):
+    """
+    Find paragraphs repeated across (or within) documents.
+
+    Paragraphs are MinHashed and bucketed with LSH; candidate pairs at or
+    above the threshold are joined into clusters.
+
+    Args:
+        documents: dict of label -> document text
+        threshold: Minimum estimated Jaccard similarity of two occurrences
+        min_words: Shortest paragraph considered
+        hasher: MinHasher to use (a default one if None)
+
+    Returns:
+        tuple: (paragraphs, clusters) where paragraphs is label -> list of
+            paragraph strings and clusters is a list of lists of
+            (label, paragraph index) occurrences, in document order
+    """
+    hasher = hasher or MinHasher()
+    lsh = LSHIndex()
+    paragraphs = {label: split_paragraphs(text) for label, text in documents.items()}
+    keys = []
+    signatures = {}
+    parent = {}
+
+    def find(key):
+        while parent[key] != key:
+            parent[key] = parent[parent[key]]
+            key = parent[key]
+        return key
+
+    for label, items in paragraphs.items():
+        for position, paragraph in enumerate(items):
+            if len(_words(paragraph)) < min_words:
+                continue
+            key = (label, position)
+            keys.append(key)
+            parent[key] = key
+            signatures[key] = hasher.signature(paragraph)
+            for other in lsh.add(key, signatures[key]):
+                if hasher.similarity(signatures[key], signatures[other]) >= threshold:
+                    parent[find(key)] = find(other)
+
+    clusters = defaultdict(list)
+    for key in keys:
+        clusters[find(key)].append(key)
+    return paragraphs, [members for members in clusters.values() if len(members) > 1]
+
+
+def collapse_boilerplate(documents, threshold=BOILERPLATE_THRESHOLD, min_words=MIN_BOILERPLATE_WORDS):
+    """
+    Replace repeated paragraphs with references to one shared copy.
+
+    Every occurrence of a repeated paragraph is replaced in place by a
+    "[Shared text S<n>]" marker, so documents keep their structure. The
+    first occurrence becomes the shared copy; occurrences whose wording
+    differs from it keep their edits inline, so no wording is lost.
+
+    Args:
+        documents: dict of label -> document text
+        threshold: Minimum estimated Jaccard similarity of two occurrences
+        min_words: Shortest paragraph considered
+
+    Returns:
+        dict: "documents" (label -> collapsed text), "shared" (the shared
+            copies, or "" if nothing repeats), "verified" (label -> whether
+            the document rebuilds word for word from the collapsed text and
+            shared copies), "clusters" (one dict per
+            shared paragraph with "id", "labels", "occurrences", "exact",
+            "words" and "preview") and "tokens" (label -> (before, after)
+            estimated tokens, plus "SHARED TEXT" -> (0, shared tokens))
+    """
+    paragraphs, clusters = find_boilerplate(documents, threshold, min_words)
+    replacements = {}
+    shared_blocks = []
+    summary = []
+    for number, members in enumerate(clusters, 1):
+        shared_id = f"S{number}"
+        reference = paragraphs[members[0][0]][members[0][1]]
+        reference_fingerprint = exact_fingerprint(reference)
+        exact = True
+        for label, position in members:
+            paragraph = paragraphs[label][position]
+            if exact_fingerprint(paragraph) == reference_fingerprint:
+                replacements[(label, position)] = f"[Shared text {shared_id}]"
+            else:
+                exact = False
+                replacements[(label, position)] = f"[Shared text {shared_id}, with edits: {compact_diff(reference, paragraph)}]"
+        labels = list(dict.fromkeys(label for label, _ in members))
+        shared_blocks.append(f"{shared_id} (appears in {', '.join(labels)}):\n{reference}")
+        summary.append({
+            "id": shared_id,
+            "labels": labels,
+            "occurrences": len(members),
+            "exact": exact,
+            "words": len(reference.split()),
+            "preview": " ".join(reference.split()[:20]),
+        })
+
+    if not clusters:
+        tokens = {label: (estimate_tokens(text), estimate_tokens(text)) for label, text in documents.items()}
+        verified = {label: True for label in documents}
+        return {"documents": dict(documents), "shared": "", "verified": verified, "clusters": [], "tokens": tokens}
+
+    collapsed = {
+        label: "\n\n".join(replacements.get((label, position), paragraph)
+                            for position, paragraph in enumerate(items))
+        for label, items in paragraphs.items()
+    }
+    shared = "\n\n".join(shared_blocks)
+    tokens = {label: (estimate_tokens(documents[label]), estimate_tokens(collapsed[label])) for label in documents}
+    if shared:
+        tokens["SHARED TEXT"] = (0, estimate_tokens(shared))
+
+    # Rebuild every document from what the prompt will contain and check no wording was lost
+    expanded = expand_boilerplate(collapsed, shared)
+    verified = {label: expanded[label] is not None and expanded[label].split() == documents[label].split()
+                for label in documents}
+    return {"documents": collapsed, "shared": shared, "verified": verified, "clusters": summary, "tokens": tokens}
+
+
+def apply_compact_diff(reference, diff):
+    """
+    Re-apply a compact diff to the text it was computed from.
+
+    "..." does not say how many unchanged words it skips, so every reading
+    consistent with the reference is followed until the diff ends.
+
+    Args:
+        reference: The first version, as given to compact_diff
+        diff: Result of compact_diff(reference, edited)
+
+    Returns:
+        list: Each possible edited text (words joined by single spaces);
+            exactly one entry when the diff can be read unambiguously
+    """
+    words = reference.split()
+    tokens = DIFF_TOKEN.findall(diff)
+    # A reading is (position in reference, output so far as a (previous, words) chain)
+    readings = [(0, None)]
+    for index, (removed, added, word) in enumerate(tokens):
+        next_readings = []
+        for position, output in readings:
+            if word == "...":
+                # Skip to every point where the rest of the diff can continue
+                following = tokens[index + 1] if index + 1 < len(tokens) else None
+                for end in range(position + 1, len(words) + 1):
+                    if following is None:
+                        if end < len(words):
+                            continue
+                    elif following[2]:
+                        if end >= len(words) or words[end] != following[2]:
+                            continue
+                    elif following[0]:
+                        if words[end:end + len(following[0].split())] != following[0].split():
+                            continue
+                    next_readings.append((end, (output, words[position:end])))
+            elif word:
+                if position < len(words) and words[position] == word:
+                    next_readings.append((position + 1, (output, [word])))
+            elif removed:
+                removed_words = removed.split()
+                if words[position:position + len(removed_words)] == removed_words:
+                    next_readings.append((position + len(removed_words), output))
+            else:
+                next_readings.append((position, (output, added.split())))
+        readings = next_readings
+        if not readings or len(readings) > MAX_DIFF_READINGS:
+            return []
+
+    texts = set()
+    for position, output in readings:
+        if position != len(words):
+            continue
+        parts = []
+        while output is not None:
+            output, part = output
+            parts.append(" ".join(part))
+        texts.add(" ".join(part for part in reversed(parts) if part))
+    return sorted(texts)
+
+
+def expand_boilerplate(documents, shared):
+    """
+    Rebuild collapsed documents from the shared copies and inline edits.
+
+    Args:
+        documents: dict of label -> collapsed text, as from collapse_boilerplate
+        shared: The shared copies, as from collapse_boilerplate
+
+    Returns:
+        dict: label -> rebuilt text, or None if a collapsed paragraph
+            cannot be rebuilt unambiguously
+    """
+    pieces = SHARED_HEADING.split(shared)
+    copies = dict(zip(pieces[1::2], (text.strip() for text in pieces[2::2])))
+
+    expanded = {}
+    for label, text in documents.items():
+        blocks = []
+        for block in text.split("\n\n"):
+            match = SHARED_MARKER.match(block)
+            if not match or match.group(1) not in copies:
+                blocks.append(block)
+                continue
+            reference = copies[match.group(1)]
+            versions = [reference] if match.group(2) is None else apply_compact_diff(reference, match.group(2))
+            if len(versions) != 1:
+                blocks = None
+                break
+            blocks.append(versions[0])
+        expanded[label] = None if blocks is None else "\n\n".join(blocks)
+    return expanded
@@ -0,0 +1,678 @@
+"""Requirement-level spec parsing and parallel compliance checking."""
+import html
+import json
+import re
+
+
+# Numbered requirement lines: "3.2.1 Text", "3.2.1. Text", "2.4 (a) Text",
+# plus all-caps top-level headings such as "2 PRODUCTS"
+REQUIREMENT_LINE = re.compile(
+    r"^\s*(\d+(?:\.\d+)+|\d+(?=\.?\s+[A-Z][A-Z0-9 ,&/\-]*$))\.?\s+(\S.*)$"
+)
+
+# Statuses from the compliance template and their report CSS classes
+STATUS_CLASSES = {
+    "Match": "comparison-match",
+    "Partial Match": "comparison-partial",
+    "Mismatch": "comparison-mismatch",
+    "Gap": "comparison-notaddressed",
+    "Clarification Needed": "comparison-informational",
+}
+
+# Requirements per compliance-check request
+DEFAULT_BATCH_SIZE = 12
+
+# Estimated requirement tokens per compliance-check request
+DEFAULT_BATCH_TOKENS = 1500
+
+# Attempts per batch before it is reported as failed
+DEFAULT_BATCH_ATTEMPTS = 2
+
+# Stylesheet of spec comparison reports; the spec template inserts it with "[[insert report_css]]"
+REPORT_CSS = """body {
+    font-family: sans-serif;
+    line-height: 1.6;
+    margin: 20px;
+    background-color: #f4f4f4;
+    color: #333;
+}
+.container {
+    max-width: 1200px;
+    margin: auto;
+    background: #fff;
+    padding: 20px;
+    border-radius: 8px;
+    box-shadow: 0 0 10px rgba(0, 0, 0, 0.1);
+}
+h1, h2 {
+    color: #333;
+}
+h1 {
+    border-bottom: 2px solid #3498db;
+    padding-bottom: 10px;
+}
+h2 {
+    margin-top: 30px;
+}
+table {
+    width: 100%;
+    border-collapse: collapse;
+    margin: 20px 0;
+    box-shadow: 0 1px 3px rgba(0,0,0,0.2);
+}
+th, td {
+    padding: 10px;
+    text-align: left;
+    border: 1px solid #ddd;
+    vertical-align: top;
+}
+th {
+    background-color: #f2f2f2;
+    font-weight: bold;
+}
+.summary-section div {
+    padding: 10px;
+    margin-bottom: 10px;
+    border-radius: 5px;
+}
+.summary-critical {
+    background-color: #ffeeba;
+    border: 1px solid #ffc107;
+}
+.summary-alignment {
+    background-color: #d4edda;
+    border: 1px solid #28a745;
+}
+.comparison-match {
+    background-color: #e9ffe9;
+}
+.comparison-partial {
+    background-color: #fffacd;
+}
+.comparison-mismatch {
+    background-color: #ffe0e0;
+}
+.comparison-notaddressed {
+    background-color: #e0e0e0;
+}
+.comparison-informational {
+    background-color: #e0f7fa;
+}
+ul {
+    padding-left: 20px;
+}
+li {
+    margin-bottom: 8px;
+}"""
+
+BATCH_INSTRUCTIONS = """You are an expert who checks proposal documents against specification requirements.
+
+For each SPEC requirement listed at the end, find where the PROPOSAL addresses it and assign exactly one status:
+- Match: the Proposal fully and clearly meets the requirement.
+- Partial Match: the Proposal addresses it only partially or with minor deviations.
+- Mismatch: the Proposal contradicts or significantly differs from the requirement.
+- Gap: the requirement is not addressed anywhere in the Proposal.
+- Clarification Needed: the Proposal is ambiguous or lacks detail to confirm compliance.
+
+{directives}Comments must be brief and factual, and are required for every status except Match.
+
+Respond with only a JSON array, one object per requirement, in this form:
+[{{"id": "<requirement number>", "proposal": "<relevant Proposal specification and page/section, or Not Found>", "status": "<status>", "comment": "<comment>"}}]
+
+PROPOSAL Document:
+{proposal}
+
+{custom_instructions}SPEC requirements to check:
+{requirements}"""
+
+# Batch prompt directives, included when evaluate_directives finds they apply
+BATCH_DIRECTIVES = {
+    "welded": "Assume welded structural components are carbon steel unless the Proposal states otherwise; only external non-welded hardware (grounding pads, door hardware, hinges, bolts) is assumed stainless steel.",
+    "multi_module": "If the Proposal indicates more than one module, check that inter-module connection details are included; otherwise use Gap or Clarification Needed.",
+    "ada": "If a requirement concerns ADA compliance, check that the Proposal includes the necessary details; otherwise use Gap or Clarification Needed.",
+}
+
+# A report's stylesheet and the end of its body, for adding styles and notes to model-written reports
+STYLE_BLOCK = re.compile(r"<style[^>]*>.*?</style>", re.IGNORECASE | re.DOTALL)
+HEAD_END = re.compile(r"</head>", re.IGNORECASE)
+BODY_END = re.compile(r"(?:</div>\s*)?</body>", re.IGNORECASE)
+
+
+def parse_requirements(spec_text):
+    """
+    Split extracted SPEC text into numbered requirements.
+
+    A numbered line ("3.2.1 ...") starts a requirement; following lines
+    are appended to it until the next numbered line. An entry whose
+    number is the prefix of the next entry's number ("3.2" before
+    "3.2.1") is treated as a section heading.
+
+    Args:
+        spec_text: Extracted specification text
+
+    Returns:
+        list: dicts with id, text, section (parent heading text) and is_section
+    """
+    entries = []
+    for line in spec_text.splitlines():
+        match = REQUIREMENT_LINE.match(line)
+        if match:
+            entries.append({"id": match.group(1), "lines": [match.group(2).strip()]})
+        elif entries and line.strip():
+            entries[-1]["lines"].append(line.strip())
+
+    requirements = []
+    headings = {}
+    for index, entry in enumerate(entries):
+        next_id = entries[index + 1]["id"] if index + 1 < len(entries) else ""
+        is_section = next_id.startswith(entry["id"] + ".")
+        text = " ".join(entry["lines"])
+
+        # Nearest enclosing heading: longest numbered prefix seen as a section
+        parts = entry["id"].split(".")
+        section = ""
+        for depth in range(len(parts) - 1, 0, -1):
+            parent = ".".join(parts[:depth])
+            if parent in headings:
+                section = headings[parent]
+                break
+
+        if is_section:
+            headings[entry["id"]] = f"{entry['id']} {text}"
+        requirements.append({
+            "id": entry["id"],
+            "text": text,
+            "section": section,
+            "is_section": is_section
+        })
+    return requirements
+
+
+class RequirementIndex:
+    """
+    Index of the numbered requirements in one or more SPEC volumes.
+
+    Requirement ids are kept unique: with several volumes each id is
+    prefixed with its volume ("V2-3.2.1"), and a number repeated within a
+    volume is suffixed. A requirement whose text repeats one seen earlier
+    (common boilerplate across volumes) is recorded as a duplicate and is
+    checked only once.
+    """
+
+    def __init__(self, requirements):
+        """
+        Initialize the index.
+
+        Args:
+            requirements: Requirement dicts from parse_requirements, optionally
+                with a "volume" name
+        """
+        self.entries = []
+        self.by_id = {}
+        first_by_text = {}
+        for requirement in requirements:
+            requirement = dict(requirement)
+            requirement.setdefault("volume", "")
+            requirement["duplicate_of"] = None
+            base_id = requirement["id"]
+            suffix = 2
+            while requirement["id"] in self.by_id:
+                requirement["id"] = f"{base_id} ({suffix})"
+                suffix += 1
+
+            if not requirement["is_section"]:
+                key = normalize_requirement_text(requirement["text"])
+                if key in first_by_text:
+                    requirement["duplicate_of"] = first_by_text[key]
+                else:
+                    first_by_text[key] = requirement["id"]
+
+            self.entries.append(requirement)
+            self.by_id[requirement["id"]] = requirement
+
+    @classmethod
+    def from_text(cls, spec_text):
+        """
+        Build an index from extracted SPEC text.
+
+        Args:
+            spec_text: Extracted specification text
+
+        Returns:
+            RequirementIndex: The index
+        """
+        return cls(parse_requirements(spec_text))
+
+    @classmethod
+    def from_volumes(cls, volumes):
+        """
+        Build one index over several SPEC volumes.
+
+        Args:
+            volumes: dict of volume name -> extracted specification text
+
+        Returns:
+            RequirementIndex: The index, in volume order
+        """
+        requirements = []
+        for number, (name, text) in enumerate(volumes.items(), start=1):
+            for requirement in parse_requirements(text):
+                if len(volumes) > 1:
+                    requirement["id"] = f"V{number}-{requirement['id']}"
+                requirement["volume"] = name
+                requirements.append(requirement)
+        return cls(requirements)
+
+    @property
+    def volumes(self):
+        """Volume names, in document order."""
+        return list(dict.fromkeys(entry["volume"] for entry in self.entries))
+
+    @property
+    def duplicates(self):
+        """Requirements skipped because an identical one is checked elsewhere."""
+        return [entry for entry in self.entries if entry["duplicate_of"]]
+
+    @property
+    def requirements(self):
+        """Requirements to check (not section headings or duplicates)."""
+        return [entry for entry in self.entries if not entry["is_section"] and not entry["duplicate_of"]]
+
+    def __len__(self):
+        return len(self.requirements)
+
+    def batches(self, max_items=DEFAULT_BATCH_SIZE, max_tokens=DEFAULT_BATCH_TOKENS, count_tokens=None):
+        """
+        Group requirements into compliance-check batches in document order.
+
+        Args:
+            max_items: Maximum requirements per batch
+            max_tokens: Maximum estimated requirement tokens per batch
+            count_tokens: Token counting function (default: 4 chars per token)
+
+        Returns:
+            list: Lists of requirement dicts
+        """
+        count_tokens = count_tokens or (lambda text: len(text) // 4 + 1)
+        batches = []
+        current = []
+        current_tokens = 0
+        for requirement in self.requirements:
+            tokens = count_tokens(format_requirement(requirement))
+            if current and (len(current) >= max_items or current_tokens + tokens > max_tokens):
+                batches.append(current)
+                current = []
+                current_tokens = 0
+            current.append(requirement)
+            current_tokens += tokens
+        if current:
+            batches.append(current)
+        return batches
+
+
+def normalize_requirement_text(text):
+    """Comparison key for requirement text: lower case, words only."""
+    return " ".join(re.findall(r"\w+", text.lower()))
+
+
+def format_requirement(requirement):
+    """Render a requirement as one prompt line."""
+    section = f" [{requirement['section']}]" if requirement["section"] else ""
+    return f"{requirement['id']}{section}: {requirement['text']}"
+
+
+def build_batch_prompt(batch, proposal_text, custom_instructions="", directives=None):
+    """
+    Create the compliance-check prompt for one batch of requirements.
+
+    The proposal comes before the requirements, so every batch shares the
+    same prompt prefix. Directives are decided once for the whole SPEC,
+    not per batch, for the same reason.
+
+    Args:
+        batch: List of requirement dicts
+        proposal_text: Text from proposal document
+        custom_instructions: Custom analysis instructions
+        directives: Result of evaluate_directives (default: all directives)
+
+    Returns:
+        str: Formatted prompt for AI analysis
+    """
+    lines = [line for name, line in BATCH_DIRECTIVES.items()
+             if directives is None or directives.get(name, {"included": True})["included"]]
+    return BATCH_INSTRUCTIONS.format(
+        directives="Directives:\n" + "".join(f"- {line}\n" for line in lines) + "\n" if lines else "",
+        proposal=proposal_text,
+        custom_instructions=f"{custom_instructions}\n\n" if custom_instructions else "",
+        requirements="\n".join(format_requirement(requirement) for requirement in batch)
+    )
+
+
+def parse_verdicts(response, batch):
+    """
+    Parse a batch response into per-requirement verdicts.
+
+    Args:
+        response: Model response text
+        batch: The requirement dicts the response answers
+
+    Returns:
+        dict: requirement id -> verdict dict (proposal, status, comment)
+
+    Raises:
+        ValueError: If the response has no JSON array or misses requirements
+    """
+    start = response.find("[")
+    end = response.rfind("]")
+    if start == -1 or end <= start:
+        raise ValueError("response contains no JSON array")
+    items = json.loads(response[start:end + 1])
+
+    verdicts = {}
+    for item in items:
+        if not isinstance(item, dict) or "id" not in item:
+            continue
+        status = str(item.get("status", "")).strip()
+        # Normalize status spelling/case to the template's terms
+        status = next((known for known in STATUS_CLASSES if known.lower() == status.lower()), "Clarification Needed")
+        verdicts[str(item["id"]).strip()] = {
+            "proposal": str(item.get("proposal", "")).strip() or "Not Found",
+            "status": status,
+            "comment": str(item.get("comment", "")).strip()
+        }
+
+    missing = [requirement["id"] for requirement in batch if requirement["id"] not in verdicts]
+    if missing:
+        raise ValueError(f"no verdict for requirement(s) {', '.join(missing)}")
+    return {requirement["id"]: verdicts[requirement["id"]] for requirement in batch}
+
+
+def check_requirements(async_client, model_id, batches, proposal_text, custom_instructions="",
+                       attempts=DEFAULT_BATCH_ATTEMPTS, use_cache=True, on_progress=None, directives=None):
+    """
+    Check batches of requirements against the proposal in parallel.
+
+    Batches run concurrently up to the async client's concurrency limit.
+    A batch whose request fails or whose response cannot be parsed is
+    retried on its own; other batches are not re-run. Responses that
+    cannot be parsed are never cached, so a retry (or a later run) asks
+    the model again and stores its good answer.
+
+    Args:
+        async_client: AsyncLMStudioClient to send requests through
+        model_id: The model ID to use
+        batches: dict of batch number -> list of requirement dicts
+        proposal_text: Text from proposal document
+        custom_instructions: Custom analysis instructions
+        attempts: Tries per batch before giving up
+        use_cache: Whether to replay and store cached responses
+        on_progress: Optional callback(done, total) as batches finish
+        directives: Result of evaluate_directives (default: all directives)
+
+    Returns:
+        tuple: (verdicts dict of requirement id -> verdict,
+                failures dict of batch number -> error message)
+    """
+    verdicts = {}
+    failures = {}
+    pending = dict(batches)
+    done = 0
+
+    for _ in range(attempts):
+        if not pending:
+            break
+        numbers = list(pending)
+        prompts = [build_batch_prompt(pending[number], proposal_text, custom_instructions, directives) for number in numbers]
+        failures = {}
+
+        def on_result(index, response):
+            # Parse each batch as it finishes so progress advances batch by batch
+            nonlocal done
+            number = numbers[index]
+            try:
+                if isinstance(response, Exception):
+                    raise response
+                verdicts.update(parse_verdicts(response, pending[number]))
+                done += 1
+                if on_progress:
+                    on_progress(done, len(batches))
+            except Exception as e:
+                failures[number] = str(e)
+
+        async_client.complete_all(
+            prompts, model_id, use_cache=use_cache, return_exceptions=True, on_result=on_result,
+            validate=[lambda response, batch=pending[number]: parse_verdicts(response, batch) for number in numbers]
+        )
+        pending = {number: pending[number] for number in failures}
+
+    return verdicts, failures
+
+
+def _summary_item(requirement, verdict):
+    comment = f" - {verdict['comment']}" if verdict["comment"] else ""
+    return f"<li><strong>{html.escape(requirement['id'])}</strong> {html.escape(requirement['text'][:160])}{html.escape(comment)}</li>"
+
+
+def directives_html(directives):
+    """
+    Render directive decisions as an HTML section of the report.
+
+    Args:
+        directives: Result of evaluate_directives (None for no section)
+
+    Returns:
+        str: "Analysis Directives" heading and list, or "" without decisions
+    """
+    if not directives:
+        return ""
+    items = "".join(
+        f"<li><strong>{'Included' if decision['included'] else 'Skipped'}: {html.escape(decision['title'])}</strong>"
+        f" - {html.escape(decision['reason'])}</li>"
+        for decision in sorted(directives.values(), key=lambda decision: not decision["included"])
+    )
+    return f"<h2>Analysis Directives</h2>\n<ul>{items}</ul>\n"
+
+
+def finalize_html_report(report, directives=None):
+    """
+    Add the report stylesheet and directive decisions to a model-written report.
+
+    The model is not asked to reproduce the stylesheet; any style element
+    it wrote is replaced with REPORT_CSS. Text that is not HTML is
+    returned unchanged.
+
+    Args:
+        report: Report text from the model
+        directives: Result of evaluate_directives (optional)
+
+    Returns:
+        str: The report with styles and the directives section
+    """
+    lowered = report.lower()
+    if "<html" not in lowered and "<!doctype" not in lowered:
+        return report
+
+    style = f"<style>\n{REPORT_CSS}\n</style>"
+    if STYLE_BLOCK.search(report):
+        report = STYLE_BLOCK.sub(lambda match: style, report, count=1)
+    elif HEAD_END.search(report):
+        report = HEAD_END.sub(lambda match: f"{style}\n{match.group()}", report, count=1)
+    else:
+        report = f"{style}\n{report}"
+
+    note = directives_html(directives)
+    if note:
+        ends = list(BODY_END.finditer(report))
+        if ends:
+            position = ends[-1].start()
+            report = report[:position] + note + report[position:]
+        else:
+            report += note
+    return report
+
+
+def render_compliance_report(index, verdicts, spec_name="SPEC Document", proposal_name="Proposal Document",
+                             directives=None):
+    """
+    Merge per-requirement verdicts into the compliance HTML report.
+
+    The output follows the report template from "Prompt MATT.txt": summary
+    section, then a four-column comparison table with section header rows
+    and status-classed comment cells.
+
+    Args:
+        index: RequirementIndex that was checked
+        verdicts: dict of requirement id -> verdict
+        spec_name: Specification name for the introduction
+        proposal_name: Proposal name for the introduction
+        directives: Result of evaluate_directives, listed in the report (optional)
+
+    Returns:
+        str: Complete HTML report
+    """
+    alignments = []
+    critical = []
+    clarifications = []
+    rows = []
+
+    multi_volume = len(index.volumes) > 1
+    volume = None
+    for entry in index.entries:
+        if multi_volume and entry["volume"] != volume:
+            volume = entry["volume"]
+            rows.append(
+                f"<tr><th colspan=\"4\">{html.escape(volume)}</th></tr>"
+            )
+
+        if entry["is_section"]:
+            rows.append(
+                f"<tr><td><strong>{html.escape(entry['id'])} {html.escape(entry['text'])}</strong></td>"
+                f"<td></td><td></td><td class=\"comparison-informational\">Section header</td></tr>"
+            )
+            continue
+
+        if entry["duplicate_of"]:
+            original = verdicts.get(entry["duplicate_of"], {"proposal": "Not checked", "status": "Clarification Needed"})
+            rows.append(
+                f"<tr><td>{html.escape(entry['id'])}</td>"
+                f"<td>{html.escape(entry['text'])}</td>"
+                f"<td>{html.escape(original['proposal'])}</td>"
+                f"<td class=\"{STATUS_CLASSES[original['status']]}\"><strong>{original['status']}</strong>"
+                f" - Same requirement as {html.escape(entry['duplicate_of'])}.</td></tr>"
+            )
+            continue
+
+        verdict = verdicts.get(entry["id"])
+        if verdict is None:
+            verdict = {"proposal": "Not checked", "status": "Clarification Needed",
+                       "comment": "Compliance check failed for this requirement; re-run the failed batch."}
+
+        status = verdict["status"]
+        comment = f" - {html.escape(verdict['comment'])}" if verdict["comment"] and status != "Match" else ""
+        rows.append(
+            f"<tr><td>{html.escape(entry['id'])}</td>"
+            f"<td>{html.escape(entry['text'])}</td>"
+            f"<td>{html.escape(verdict['proposal'])}</td>"
+            f"<td class=\"{STATUS_CLASSES[status]}\"><strong>{status}</strong>{comment}</td></tr>"
+        )
+
+        if status in ("Match", "Partial Match"):
+            alignments.append(_summary_item(entry, verdict))
+        elif status in ("Mismatch", "Gap"):
+            critical.append(_summary_item(entry, verdict))
+        else:
+            clarifications.append(_summary_item(entry, verdict))
+
+    duplicates_note = f"; {len(index.duplicates)} repeated requirements reported once" if index.duplicates else ""
+
+    def summary_list(items, empty):
+        return "<ul>" + ("".join(items) if items else f"<li>{empty}</li>") + "</ul>"
+
+    return f"""<!DOCTYPE html>
+<html lang="en">
+<head>
+<meta charset="UTF-8">
+<meta name="viewport" content="width=device-width, initial-scale=1.0">
+<title>SPEC vs Proposal Comparison Report</title>
+<style>
+{REPORT_CSS}
+</style>
+</head>
+<body>
+<div class="container">
+<h1>SPEC vs Proposal Comparison Report</h1>
+<p>This report compares {html.escape(spec_name)} against {html.escape(proposal_name)}, requirement by requirement ({len(index)} requirements checked{duplicates_note}).</p>
+<div class="summary-section">
+<h2>Summary of Findings</h2>
+<div class="summary-alignment">
+<h3>Key Alignments:</h3>
+{summary_list(alignments, "None identified.")}
+</div>
+<div class="summary-critical">
+<h3>Critical Discrepancies, Gaps, and Exclusions:</h3>
+{summary_list(critical, "None identified.")}
+</div>
+<div class="summary-critical">
+<h3>Areas Needing Clarification:</h3>
+{summary_list(clarifications, "None identified.")}
+</div>
+</div>
+{directives_html(directives)}<h2>Detailed Comparison</h2>
+<table>
+<thead>
+<tr><th>SPEC Section / Requirement</th><th>SPEC Specification</th><th>Proposal Specification (Page #)</th><th>Status &amp; Comments</th></tr>
+</thead>
+<tbody>
+{chr(10).join(rows)}
+</tbody>
+</table>
+</div>
+</body>
+</html>
+"""
+
+
+def merge_html_reports(reports, title="SPEC vs Proposal Comparison Report", directives=None):
+    """
+    Combine per-volume compliance reports into one HTML document.
+
+    Each report's body is kept under a heading for its volume; the styles
+    come from the report template. Reports that are not HTML are included
+    as preformatted text.
+
+    Args:
+        reports: dict of volume name -> report text
+        title: Title of the merged report
+        directives: Result of evaluate_directives, listed at the end (optional)
+
+    Returns:
+        str: Complete HTML report
+    """
+    sections = []
+    for volume, report in reports.items():
+        body = re.search(r"<body[^>]*>(.*?)(?:</body>|$)", report, re.IGNORECASE | re.DOTALL)
+        if body:
+            content = body.group(1)
+        elif "<table" in report.lower():
+            content = report
+        else:
+            content = f"<pre>{html.escape(report)}</pre>"
+        sections.append(f"<h1>{html.escape(volume)}</h1>\n{content}")
+
+    return f"""<!DOCTYPE html>
+<html lang="en">
+<head>
+<meta charset="UTF-8">
+<meta name="viewport" content="width=device-width, initial-scale=1.0">
+<title>{html.escape(title)}</title>
+<style>
+{REPORT_CSS}
+</style>
+</head>
+<body>
+<div class="container">
+{chr(10).join(sections)}
+{directives_html(directives)}</div>
+</body>
+</html>
+"""
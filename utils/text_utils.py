@@ -0,0 +1,214 @@
+"""Normalization of extracted document text before it is sent to the model."""
+import os
+import re
+import unicodedata
+from collections import Counter
+
+from utils.chunked_analysis import estimate_tokens
+
+
+# Steps in the order they run; set AI_PROJECT_NORMALIZE_STEPS to a comma-separated
+# subset (or to "none") to change which run
+NORMALIZATION_STEPS = ("unicode", "headers", "hyphenation", "whitespace")
+DEFAULT_STEPS = tuple(
+    step.strip() for step in os.environ.get("AI_PROJECT_NORMALIZE_STEPS", ",".join(NORMALIZATION_STEPS)).split(",")
+    if step.strip() in NORMALIZATION_STEPS
+)
+
+# Lines at the top and bottom of each page checked for running headers and footers
+EDGE_LINES = 3
+
+# A line is a running header/footer when it repeats on this share of pages (and on at least MIN_HEADER_PAGES)
+HEADER_PAGE_RATIO = 0.3
+MIN_HEADER_PAGES = 3
+
+# Standalone page numbers: "3", "- 3 -", "Page 3", "Page 3 of 40", "3/40"
+PAGE_NUMBER = re.compile(r"^\s*(?:page\s*)?-?\s*\d{1,4}\s*-?\s*(?:(?:of|/)\s*\d{1,4})?\s*$", re.IGNORECASE)
+
+# Page label inside a running header/footer: "page 3", "page 3 of 40"
+PAGE_LABEL = re.compile(r"page\s*\d+(?:\s*(?:of|/)\s*\d+)?")
+
+# Characters that carry no text: zero-width, BOM, soft hyphen and C0 controls other than whitespace
+INVISIBLE = re.compile("[\u200b\u200c\u200d\u2060\ufeff\u00ad\x00-\x08\x0e-\x1f\x7f]")
+
+# Typographic punctuation mapped to ASCII; NFKC leaves these alone
+PUNCTUATION = {
+    "\u2018": "'", "\u2019": "'", "\u201a": "'", "\u201b": "'",
+    "\u201c": '"', "\u201d": '"', "\u201e": '"', "\u201f": '"',
+    "\u2010": "-", "\u2011": "-", "\u2012": "-", "\u2013": "-", "\u2014": "-", "\u2212": "-",
+    "\u2022": "*", "\u25cf": "*", "\u25aa": "*", "\uf0b7": "*",
+}
+TYPOGRAPHIC = re.compile("[" + "".join(PUNCTUATION) + "]")
+
+# A hyphen at a line break: "require-\nments" (a broken word) or "self-\ncontained" (a compound)
+HYPHENATED = re.compile(r"\b(\w{2,})-[ \t]*\n[ \t]*([a-z]\w*)")
+
+WORD_TOKEN = re.compile(r"\w+")
+
+SPACE_RUN = re.compile(r"[ \t\f\v\u00a0]+")
+TRAILING_SPACE = re.compile(r" \n")
+BLANK_LINES = re.compile(r"\n{3,}")
+
+
+def _header_key(line):
+    """
+    A page's edge line with spacing, case and its page number ignored.
+
+    Only the number after "Page" is masked, so "Page 3 of 40" and "Page 4
+    of 40" count as the same line while numbered clauses such as "1.2
+    Submittals" at the top of different pages never look alike.
+    """
+    return PAGE_LABEL.sub("page #", " ".join(line.split()).lower())
+
+
+def _normalize_unicode(page):
+    page = unicodedata.normalize("NFKC", page).replace("\r\n", "\n").replace("\r", "\n")
+    return TYPOGRAPHIC.sub(lambda match: PUNCTUATION[match.group()], INVISIBLE.sub("", page))
+
+
+def strip_headers_footers(pages, edge_lines=EDGE_LINES, ratio=HEADER_PAGE_RATIO, min_pages=MIN_HEADER_PAGES):
+    """
+    Remove running headers, footers and page numbers from page texts.
+
+    The first and last few lines of every page are compared across pages
+    with their page label ignored, so "Page 3 of 40" and "Page 4 of 40"
+    count as the same line. Lines repeating on enough pages, and lines
+    that are only a page number, are dropped. Runs in one pass over the
+    lines.
+
+    Args:
+        pages: List of page texts
+        edge_lines: Lines checked at the top and at the bottom of each page
+        ratio: Share of pages a line must appear on
+        min_pages: Minimum number of pages a line must appear on
+
+    Returns:
+        list: Page texts without their headers and footers
+    """
+    page_lines = [page.split("\n") for page in pages]
+    counts = Counter()
+    for lines in page_lines:
+        content = [index for index, line in enumerate(lines) if line.strip()]
+        edges = set(content[:edge_lines]) | set(content[-edge_lines:])
+        counts.update({_header_key(lines[index]) for index in edges})
+
+    threshold = max(min_pages, ratio * len(pages))
+    repeated = {key for key, count in counts.items() if count >= threshold}
+
+    stripped = []
+    for lines in page_lines:
+        content = [index for index, line in enumerate(lines) if line.strip()]
+        edges = set(content[:edge_lines]) | set(content[-edge_lines:])
+        drop = {index for index in edges
+                if _header_key(lines[index]) in repeated or PAGE_NUMBER.match(lines[index])}
+        stripped.append("\n".join(line for index, line in enumerate(lines) if index not in drop))
+    return stripped
+
+
+def rejoin_hyphenated(text):
+    """
+    Remove the line breaks inside words hyphenated across lines.
+
+    The hyphen is only dropped when the joined word occurs elsewhere in
+    the text ("require-\nments" with "requirements" used elsewhere);
+    otherwise it is kept, so compounds such as "self-\ncontained" are
+    never fused into words that do not exist.
+
+    Args:
+        text: Document text
+
+    Returns:
+        str: Text with the hyphenated line breaks removed
+    """
+    words = set(WORD_TOKEN.findall(text.lower()))
+
+    def rejoin(match):
+        head, tail = match.groups()
+        if (head + tail).lower() in words:
+            return head + tail
+        return f"{head}-{tail}"
+
+    return HYPHENATED.sub(rejoin, text)
+
+
+def normalize_pages(pages, steps=DEFAULT_STEPS):
+    """
+    Normalize extracted page texts into one compact document text.
+
+    Steps (each optional, always in this order):
+        unicode: NFKC, invisible characters removed, typographic quotes
+            and dashes mapped to ASCII
+        headers: running headers, footers and page numbers stripped
+        hyphenation: words hyphenated across line breaks rejoined (see
+            rejoin_hyphenated)
+        whitespace: runs of spaces collapsed, trailing spaces and extra
+            blank lines removed
+
+    Every step is linear in the text length.
+
+    Args:
+        pages: List of page texts (a single-item list for unpaginated text)
+        steps: Names of the steps to run
+
+    Returns:
+        tuple: (text, report) where report is a list of dicts with "step",
+            "tokens_before" and "tokens_after" for each step that ran
+    """
+    report = []
+    tokens = estimate_tokens("\n".join(pages))
+
+    def record(step, text):
+        nonlocal tokens
+        after = estimate_tokens(text)
+        report.append({"step": step, "tokens_before": tokens, "tokens_after": after})
+        tokens = after
+
+    if "unicode" in steps:
+        pages = [_normalize_unicode(page) for page in pages]
+        record("unicode", "\n".join(pages))
+    if "headers" in steps and len(pages) >= MIN_HEADER_PAGES:
+        pages = strip_headers_footers(pages)
+        record("headers", "\n".join(pages))
+
+    text = "\n".join(pages)
+    if "hyphenation" in steps:
+        text = rejoin_hyphenated(text)
+        record("hyphenation", text)
+    if "whitespace" in steps:
+        text = SPACE_RUN.sub(" ", text)
+        text = TRAILING_SPACE.sub("\n", text)
+        text = BLANK_LINES.sub("\n\n", text).strip()
+        record("whitespace", text)
+
+    return text, report
+
+
+def normalize_text(text, steps=DEFAULT_STEPS):
+    """
+    Normalize unpaginated text (e.g. from a DOCX); headers are not detected.
+
+    Args:
+        text: Text to normalize
+        steps: Names of the steps to run
+
+    Returns:
+        tuple: (text, report) as from normalize_pages
+    """
+    return normalize_pages([text], steps)
+
+
+def format_normalization_report(report):
+    """
+    Summarize a normalization report in one line.
+
+    Args:
+        report: Report from normalize_pages
+
+    Returns:
+        str: Total and per-step token savings, or "" if nothing ran
+    """
+    if not report:
+        return ""
+    saved = report[0]["tokens_before"] - report[-1]["tokens_after"]
+    steps = ", ".join(f"{entry['step']} {entry['tokens_before'] - entry['tokens_after']:,}" for entry in report)
+    return f"Normalization saved ~{saved:,} tokens ({steps})"
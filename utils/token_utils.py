@@ -0,0 +1,247 @@
+"""Token estimation, context budgeting and runtime prediction."""
+import json
+import os
+import tempfile
+import threading
+
+from utils.cache_utils import CACHE_ROOT
+from utils.chunked_analysis import (
+    CHARS_PER_TOKEN,
+    DEFAULT_CHUNK_TOKENS,
+    DEFAULT_CONTEXT_TOKENS,
+    RESPONSE_RESERVE_TOKENS,
+)
+
+
+# Per-model calibration and throughput measured on this machine
+PROFILE_PATH = CACHE_ROOT / "model_profiles.json"
+
+# Characters of a document sent to LM Studio's tokenizer for calibration
+CALIBRATION_SAMPLE_CHARS = 4000
+
+# Throughput assumed before any run has been measured (CPU inference)
+DEFAULT_PROMPT_TOKENS_PER_SEC = 100.0
+DEFAULT_GENERATION_TOKENS_PER_SEC = 8.0
+
+# Weight of the newest measurement in the moving throughput average
+THROUGHPUT_SMOOTHING = 0.3
+
+# Expected report length relative to the prompt, bounded below
+EXPECTED_RESPONSE_RATIO = 0.25
+MIN_EXPECTED_RESPONSE_TOKENS = 1000
+
+_profiles_lock = threading.Lock()
+
+
+def _load_profiles():
+    try:
+        with open(PROFILE_PATH, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_profiles(profiles):
+    try:
+        PROFILE_PATH.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=PROFILE_PATH.parent, prefix=".tmp-")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(profiles, f, indent=2)
+        os.replace(tmp_path, PROFILE_PATH)
+    except OSError:
+        pass
+
+
+def get_model_profile(model_id):
+    """
+    Get the stored calibration and throughput for a model.
+
+    Args:
+        model_id: The model ID
+
+    Returns:
+        dict: Profile values (empty if the model has never been measured)
+    """
+    with _profiles_lock:
+        return dict(_load_profiles().get(model_id or "", {}))
+
+
+def update_model_profile(model_id, **values):
+    """
+    Store calibration or throughput values for a model.
+
+    Args:
+        model_id: The model ID
+        **values: Profile fields to set
+    """
+    with _profiles_lock:
+        profiles = _load_profiles()
+        profiles.setdefault(model_id or "", {}).update(values)
+        _save_profiles(profiles)
+
+
+def record_throughput(model_id, prompt_tokens, prompt_seconds, completion_tokens, generation_seconds):
+    """
+    Fold one measured run into the model's moving-average throughput.
+
+    Args:
+        model_id: The model ID
+        prompt_tokens: Tokens in the prompt
+        prompt_seconds: Time until the first response token
+        completion_tokens: Tokens generated
+        generation_seconds: Time from first to last response token
+    """
+    profile = get_model_profile(model_id)
+    values = {}
+    for key, tokens, seconds in (
+        ("prompt_tokens_per_sec", prompt_tokens, prompt_seconds),
+        ("generation_tokens_per_sec", completion_tokens, generation_seconds),
+    ):
+        # Ignore runs too short to time meaningfully
+        if tokens < 16 or seconds <= 0.05:
+            continue
+        measured = tokens / seconds
+        previous = profile.get(key)
+        values[key] = measured if previous is None else (
+            THROUGHPUT_SMOOTHING * measured + (1 - THROUGHPUT_SMOOTHING) * previous
+        )
+    if values:
+        update_model_profile(model_id, **values)
+
+
+class TokenPlanner:
+    """
+    Estimate prompt sizes and pick token limits for a model.
+
+    Counting is local: a characters-per-token ratio calibrated once per
+    model against LM Studio's tokenizer (falling back to CHARS_PER_TOKEN).
+    The context window is read from LM Studio when it reports one.
+    """
+
+    def __init__(self, lm_client, model_id):
+        """
+        Initialize the planner.
+
+        Args:
+            lm_client: LMStudioClient for calibration and model metadata
+            model_id: The model ID to plan for
+        """
+        self.lm_client = lm_client
+        self.model_id = model_id
+        self.profile = get_model_profile(model_id)
+
+        self.context_tokens = lm_client.get_model_context_length(model_id) or DEFAULT_CONTEXT_TOKENS
+
+        self.chars_per_token = self.profile.get("chars_per_token", CHARS_PER_TOKEN)
+        self.calibrated = "chars_per_token" in self.profile
+
+    def calibrate(self, sample_text):
+        """
+        Measure the characters-per-token ratio with LM Studio's tokenizer.
+
+        Only runs once per model; the ratio is stored in the model profile.
+
+        Args:
+            sample_text: Representative document text
+        """
+        if self.calibrated or not sample_text:
+            return
+        sample = sample_text[:CALIBRATION_SAMPLE_CHARS]
+        tokens = self.lm_client.count_prompt_tokens(sample, self.model_id)
+        if tokens:
+            self.chars_per_token = len(sample) / tokens
+            self.calibrated = True
+            update_model_profile(self.model_id, chars_per_token=self.chars_per_token)
+
+    def count(self, text):
+        """
+        Estimate the number of tokens in a text.
+
+        Args:
+            text: Text to measure
+
+        Returns:
+            int: Estimated token count
+        """
+        return int(len(text) / self.chars_per_token) + 1
+
+    @property
+    def prompt_budget(self):
+        """Tokens available for a prompt after reserving room for the answer."""
+        return max(0, self.context_tokens - RESPONSE_RESERVE_TOKENS)
+
+    @property
+    def chunk_tokens(self):
+        """Map-step chunk size: small enough for fast calls, bounded by the context."""
+        return max(256, min(DEFAULT_CHUNK_TOKENS, self.prompt_budget // 2))
+
+    def max_tokens_for(self, prompt):
+        """
+        Pick max_tokens so prompt and answer fit the context window.
+
+        Args:
+            prompt: The full prompt text
+
+        Returns:
+            int: Tokens left for the answer, or -1 (no limit) if unknown
+        """
+        remaining = self.context_tokens - self.count(prompt)
+        return remaining if remaining > 0 else -1
+
+    def predict_seconds(self, prompt_tokens, completion_tokens):
+        """
+        Predict runtime from throughput measured on this machine.
+
+        Args:
+            prompt_tokens: Tokens to process
+            completion_tokens: Tokens to generate
+
+        Returns:
+            float: Predicted seconds
+        """
+        prompt_tps = self.profile.get("prompt_tokens_per_sec", DEFAULT_PROMPT_TOKENS_PER_SEC)
+        generation_tps = self.profile.get("generation_tokens_per_sec", DEFAULT_GENERATION_TOKENS_PER_SEC)
+        return prompt_tokens / prompt_tps + completion_tokens / generation_tps
+
+    def plan(self, documents, build_prompt):
+        """
+        Build a pre-flight plan for an analysis.
+
+        Args:
+            documents: dict of label -> document text
+            build_prompt: Callable taking a dict of label -> text and returning the prompt
+
+        Returns:
+            dict: document_tokens (label -> tokens), overhead_tokens,
+                prompt_tokens, context_tokens, remaining_tokens,
+                needs_chunking, chunk_tokens, map_calls, predicted_seconds
+                and measured (whether throughput comes from real runs)
+        """
+        document_tokens = {label: self.count(text) for label, text in documents.items()}
+        overhead_tokens = self.count(build_prompt({label: "" for label in documents}))
+        prompt_tokens = overhead_tokens + sum(document_tokens.values())
+        needs_chunking = prompt_tokens > self.prompt_budget
+
+        expected_response = max(MIN_EXPECTED_RESPONSE_TOKENS, int(min(prompt_tokens, self.prompt_budget) * EXPECTED_RESPONSE_RATIO))
+        if needs_chunking:
+            # Map step: every token is read once and condensed to about a third
+            oversized = sum(document_tokens.values())
+            map_calls = sum(-(-tokens // self.chunk_tokens) for tokens in document_tokens.values())
+            predicted = self.predict_seconds(oversized, oversized // 3)
+            predicted += self.predict_seconds(self.prompt_budget, expected_response)
+        else:
+            map_calls = 0
+            predicted = self.predict_seconds(prompt_tokens, expected_response)
+
+        return {
+            "document_tokens": document_tokens,
+            "overhead_tokens": overhead_tokens,
+            "prompt_tokens": prompt_tokens,
+            "context_tokens": self.context_tokens,
+            "remaining_tokens": self.context_tokens - prompt_tokens,
+            "needs_chunking": needs_chunking,
+            "chunk_tokens": self.chunk_tokens,
+            "map_calls": map_calls,
+            "predicted_seconds": predicted,
+            "measured": "generation_tokens_per_sec" in self.profile
+        }
@@ -0,0 +1,375 @@
+"""Shared Streamlit UI helpers used by the pages."""
+import time
+
+import streamlit as st
+
+from utils.ai_utils import AsyncLMStudioClient, DEFAULT_MAX_CONCURRENCY
+from utils.chunked_analysis import MapReduceAnalyzer, allocate_budget, prompt_token_budget
+from utils.directive_utils import format_directive_report
+from utils.pdf_utils import extract_texts
+from utils.spec_utils import check_requirements
+from utils.text_utils import format_normalization_report
+from utils.token_utils import TokenPlanner
+
+
+def extract_text_with_progress(pdf_doc, label="Extracting text...", max_chars=200000):
+    """
+    Extract a document's text while showing live page progress.
+
+    Args:
+        pdf_doc: PDFDocument to extract
+        label: Message shown next to the page counter
+        max_chars: Maximum number of characters to extract (None for no limit)
+
+    Returns:
+        str: Extracted text from the PDF
+    """
+    page_count = pdf_doc.page_count
+    progress = st.progress(0.0, text=label)
+
+    def on_page(page_number):
+        progress.progress(page_number / page_count, text=f"{label} page {page_number}/{page_count}")
+
+    try:
+        text = pdf_doc.extract_text(max_chars=max_chars, parallel=True, on_page=on_page)
+    finally:
+        progress.empty()
+    show_normalization_report(pdf_doc.normalization_report(max_chars))
+    return text
+
+
+def show_normalization_report(report, label=""):
+    """
+    Show the token savings of text normalization as a caption.
+
+    Args:
+        report: Report from normalize_pages (nothing is shown if empty or None)
+        label: Optional document name to prefix
+    """
+    summary = format_normalization_report(report or [])
+    if summary:
+        st.caption(f"{label}: {summary}" if label else summary)
+
+
+def show_directive_report(directives):
+    """
+    Show which conditional analysis directives apply, and why.
+
+    Args:
+        directives: Result of evaluate_directives
+    """
+    included = sum(decision["included"] for decision in directives.values())
+    with st.expander(f"🧭 Analysis Directives ({included} of {len(directives)} included)"):
+        st.markdown(format_directive_report(directives))
+
+
+def get_token_planner(lm_client, model_id):
+    """
+    Get the session's TokenPlanner for a model.
+
+    Planners are kept in session state, one per server and model, so page
+    reruns reuse the context length and calibration instead of asking
+    LM Studio again.
+
+    Args:
+        lm_client: LMStudioClient for calibration and model metadata
+        model_id: The model ID to plan for
+
+    Returns:
+        TokenPlanner: Planner for the model
+    """
+    planners = st.session_state.setdefault("token_planners", {})
+    key = (lm_client.base_url, model_id)
+    if key not in planners:
+        planners[key] = TokenPlanner(lm_client, model_id)
+    return planners[key]
+
+
+def condense_documents(lm_client, model_id, documents, token_budget, planner, use_cache=True,
+                       max_concurrency=DEFAULT_MAX_CONCURRENCY, max_document_tokens=None):
+    """
+    Condense documents to a token budget (map step), with a progress bar.
+
+    Documents within their share of the budget (see allocate_budget) are
+    returned verbatim. Map calls for all documents run concurrently.
+
+    Args:
+        lm_client: LMStudioClient used for the map step
+        model_id: The model ID to use
+        documents: dict of label -> document text
+        token_budget: Tokens available for all documents together
+        planner: TokenPlanner for the model, used for counting and chunk sizes
+        use_cache: Whether map calls replay and store cached responses
+        max_concurrency: Map calls in flight at once
+        max_document_tokens: Cap on any one document (e.g. when each
+            document goes into a prompt of its own)
+
+    Returns:
+        dict: label -> text that fits its share of the budget
+    """
+    sizes = {label: planner.count(text) for label, text in documents.items()}
+    shares = allocate_budget(sizes, token_budget, max_document_tokens)
+    if all(sizes[label] <= shares[label] for label in documents):
+        return documents
+
+    progress = st.progress(0.0, text="Documents exceed the model context; condensing in chunks...")
+
+    def on_progress(done, total):
+        progress.progress(done / total, text=f"Condensing long documents: chunk {done}/{total}")
+
+    try:
+        return MapReduceAnalyzer(
+            AsyncLMStudioClient(lm_client, max_concurrency=max_concurrency), model_id,
+            chunk_tokens=planner.chunk_tokens, count_tokens=planner.count, use_cache=use_cache
+        ).condense(documents, token_budget, on_progress=on_progress, max_document_tokens=max_document_tokens)
+    finally:
+        progress.empty()
+
+
+def fit_documents_to_context(lm_client, model_id, documents, build_prompt, planner, use_cache=True,
+                             max_concurrency=DEFAULT_MAX_CONCURRENCY):
+    """
+    Condense documents that do not fit the context, with a progress bar.
+
+    Documents that fit are returned verbatim. Otherwise they are split
+    into chunks and condensed by the model (map step).
+
+    Args:
+        lm_client: LMStudioClient used for the map step
+        model_id: The model ID to use
+        documents: dict of label -> document text
+        build_prompt: Callable taking a dict of label -> text and returning the prompt
+        planner: TokenPlanner for the model, used for counting and chunk sizes
+        use_cache: Whether map calls replay and store cached responses
+        max_concurrency: Map calls in flight at once
+
+    Returns:
+        dict: label -> text that fits the prompt
+    """
+    planner.calibrate(next((text for text in documents.values() if text), ""))
+
+    token_budget = prompt_token_budget(
+        build_prompt, documents, planner.context_tokens, count_tokens=planner.count
+    )
+    if sum(planner.count(text) for text in documents.values()) <= token_budget:
+        return documents
+    return condense_documents(lm_client, model_id, documents, token_budget, planner, use_cache, max_concurrency)
+
+
+def build_prompt_within_context(lm_client, model_id, documents, build_prompt, planner, use_cache=True):
+    """
+    Build an analysis prompt, condensing documents that do not fit the context.
+
+    Documents that fit are used verbatim. Otherwise they are condensed in
+    chunks (map step) and the prompt is built from the condensed notes
+    (reduce step).
+
+    Args:
+        lm_client: LMStudioClient used for the map step
+        model_id: The model ID to use
+        documents: dict of label -> document text
+        build_prompt: Callable taking a dict of label -> text and returning the prompt
+        planner: TokenPlanner for the model, used for counting and chunk sizes
+        use_cache: Whether map calls replay and store cached responses
+
+    Returns:
+        str: Prompt for the final analysis
+    """
+    return build_prompt(fit_documents_to_context(lm_client, model_id, documents, build_prompt, planner, use_cache))
+
+
+def _format_duration(seconds):
+    if seconds < 90:
+        return f"{seconds:.0f} s"
+    if seconds < 5400:
+        return f"{seconds / 60:.0f} min"
+    return f"{seconds / 3600:.1f} h"
+
+
+def show_token_plan(planner, documents, build_prompt):
+    """
+    Show a pre-flight estimate of token usage and runtime.
+
+    Args:
+        planner: TokenPlanner for the selected model
+        documents: dict of label -> document text
+        build_prompt: Callable taking a dict of label -> text and returning the prompt
+    """
+    plan = planner.plan(documents, build_prompt)
+
+    with st.expander("📏 Token Budget & Time Estimate", expanded=plan["needs_chunking"]):
+        columns = st.columns(len(plan["document_tokens"]) + 2)
+        for column, (label, tokens) in zip(columns, plan["document_tokens"].items()):
+            column.metric(label.title(), f"{tokens:,} tokens")
+        columns[-2].metric(
+            "Context Remaining",
+            f"{plan['remaining_tokens']:,}",
+            help=f"Model context: {plan['context_tokens']:,} tokens; "
+                 f"prompt incl. instructions: {plan['prompt_tokens']:,} tokens"
+        )
+        columns[-1].metric(
+            "Predicted Runtime",
+            _format_duration(plan["predicted_seconds"]),
+            help="Based on throughput measured on this machine" if plan["measured"]
+            else "Default CPU estimate; refined automatically after the first run"
+        )
+
+        if plan["needs_chunking"]:
+            st.info(
+                f"Documents exceed the model context and will be condensed in "
+                f"{plan['map_calls']} chunks of ~{plan['chunk_tokens']:,} tokens before the final analysis."
+            )
+        if not planner.calibrated:
+            st.caption("Token counts use a default estimate until the first run calibrates them with LM Studio's tokenizer.")
+
+
+class StreamingRenderer:
+    """
+    Render a streamed response into a placeholder at a throttled cadence.
+
+    Chunks are buffered and the placeholder is re-rendered at most every
+    `interval` seconds, or sooner once `flush_chars` new characters have
+    arrived, instead of on every token. The full text is joined once at
+    the end. Time spent rendering is tracked so it can be compared with
+    time spent waiting on the model.
+    """
+
+    def __init__(self, placeholder, interval=0.3, flush_chars=2000):
+        """
+        Initialize the renderer.
+
+        Args:
+            placeholder: Streamlit placeholder (st.empty()) to render into
+            interval: Minimum seconds between re-renders
+            flush_chars: Re-render early once this many characters are buffered
+        """
+        self.placeholder = placeholder
+        self.interval = interval
+        self.flush_chars = flush_chars
+        self.parts = []
+        self.render_count = 0
+        self.render_seconds = 0.0
+        self.total_seconds = 0.0
+        self.first_chunk_seconds = None
+        self._rendered_text = ""
+        self._pending_chars = 0
+        self._last_flush = 0.0
+
+    def feed(self, chunk):
+        """
+        Buffer a chunk, re-rendering if the cadence allows.
+
+        Args:
+            chunk: Response text chunk
+        """
+        self.parts.append(chunk)
+        self._pending_chars += len(chunk)
+        if (self._pending_chars >= self.flush_chars
+                or time.perf_counter() - self._last_flush >= self.interval):
+            self.flush()
+
+    def flush(self):
+        """Render everything received so far."""
+        if not self._pending_chars:
+            return
+        started = time.perf_counter()
+        self._rendered_text = "".join(self.parts)
+        self.placeholder.markdown(self._rendered_text)
+        self._last_flush = time.perf_counter()
+        self.render_seconds += self._last_flush - started
+        self.render_count += 1
+        self._pending_chars = 0
+
+    def render(self, stream):
+        """
+        Consume a response stream, rendering it as it arrives.
+
+        Args:
+            stream: Iterable of response chunks (e.g. analyze_documents())
+
+        Returns:
+            str: The full response text
+        """
+        started = time.perf_counter()
+        try:
+            for chunk in stream:
+                if self.first_chunk_seconds is None:
+                    self.first_chunk_seconds = time.perf_counter() - started
+                self.feed(chunk)
+            self.flush()
+        finally:
+            self.total_seconds = time.perf_counter() - started
+        return self._rendered_text
+
+    def summary(self):
+        """
+        Describe time to first token and rendering overhead relative to the whole run.
+
+        Returns:
+            str: Human-readable overhead summary
+        """
+        share = 100 * self.render_seconds / self.total_seconds if self.total_seconds else 0.0
+        first = f"First token after {self.first_chunk_seconds:.1f} s. " if self.first_chunk_seconds is not None else ""
+        return (f"{first}Rendered {len(self.parts):,} chunks in {self.render_count} updates; "
+                f"rendering took {self.render_seconds:.2f} s of {self.total_seconds:.1f} s ({share:.1f}%), "
+                f"the rest was generation.")
+
+
+def check_requirements_with_progress(lm_client, model_id, batches, proposal_text, custom_instructions="",
+                                     max_concurrency=DEFAULT_MAX_CONCURRENCY, use_cache=True, directives=None):
+    """
+    Run parallel requirement compliance checks while showing batch progress.
+
+    Args:
+        lm_client: LMStudioClient to send requests through
+        model_id: The model ID to use
+        batches: dict of batch number -> list of requirement dicts
+        proposal_text: Proposal text that fits alongside one batch
+        custom_instructions: Custom analysis instructions
+        max_concurrency: Requests in flight at once (match LM Studio's parallel slots)
+        use_cache: Whether to replay and store cached responses
+        directives: Result of evaluate_directives (default: all directives)
+
+    Returns:
+        tuple: (verdicts dict, failures dict), as from check_requirements
+    """
+    label = "Checking requirements..."
+    progress = st.progress(0.0, text=label)
+
+    def on_progress(done, total):
+        progress.progress(done / total, text=f"{label} batch {done}/{total}")
+
+    try:
+        return check_requirements(
+            AsyncLMStudioClient(lm_client, max_concurrency=max_concurrency), model_id, batches,
+            proposal_text, custom_instructions, use_cache=use_cache, on_progress=on_progress,
+            directives=directives
+        )
+    finally:
+        progress.empty()
+
+
+def extract_texts_with_progress(pdf_docs, label="Extracting text...", max_chars=200000):
+    """
+    Extract several documents concurrently while showing document progress.
+
+    Args:
+        pdf_docs: List of PDFDocument to extract
+        label: Message shown next to the document counter
+        max_chars: Maximum number of characters per document (None for no limit)
+
+    Returns:
+        list: Extracted text per document, in input order
+    """
+    progress = st.progress(0.0, text=label)
+
+    def on_document(done, total):
+        progress.progress(done / total, text=f"{label} document {done}/{total}")
+
+    try:
+        texts = extract_texts(pdf_docs, max_chars=max_chars, on_document=on_document)
+    finally:
+        progress.empty()
+    for pdf_doc in pdf_docs:
+        show_normalization_report(pdf_doc.normalization_report(max_chars), pdf_doc.file_name)
+    return texts